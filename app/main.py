@@ -2,30 +2,127 @@
 import os
 import re
 import html
+import asyncio
+import importlib
 import json
 import logging
+import time
+from contextlib import asynccontextmanager
 from urllib.parse import parse_qs
 
 from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+# 你的邏輯（hkbot.logic：pandas / yfinance 很重，延遲到第一次查詢或背景預熱才載入）
+from hkbot.warmup import Warmup, analytics
+from hkbot import warmup
+from hkbot.config import PRECOMPUTE_ENABLED
+# Cloud API 發送工具（buttons / list / text；async 版共用 keep-alive 連線池）
+from hkbot import cloud
+from hkbot.cloud import asend_text, asend_buttons, asend_list, split_text
+# 背景工作佇列（分析 & 外送都在 worker 內執行，webhook 立即回 200）
+from hkbot.jobs import JobQueue, JobQueueFull
+# Meta 重送去重（message ID seen-set）
+from hkbot.dedupe import SeenSet
+# 組合 / 自選清單（pf 指令；大量代碼）
+from hkbot.watchlists import Watchlists, PORTFOLIO_MAX, parse_portfolio, parse_page
+# 到價 / 訊號提醒（alert 指令；背景 watcher 觸發時主動推播）
+from hkbot import alerts as alerting
+from hkbot.alerts import Alerts, ALERT_ENABLED, ALERT_INTERVAL, parse_alert
+# 外送排程（限速 / 重試 / 優先順序）
+from hkbot.outbound import OutboundScheduler, PRIORITY_QUICK, PRIORITY_NORMAL, PRIORITY_BULK
+# 分段計時 / Prometheus 指標
+from hkbot import metrics
+from hkbot.metrics import span, route_var, REQUESTS, REQUEST_SECONDS, DEADLINE_EXCEEDED, symbols_bucket
+# 每個請求的時間預算（來不及就先回快取 K 線，背景補抓）
+from hkbot.deadline import Deadline, deadline_var
 
-# 你的邏輯（沿用先前的 parse_codes_from_text / build_whatsapp_summary）
-from hkbot.logic import parse_codes_from_text, build_whatsapp_summary
-# Cloud API 發送工具（buttons / list / text）
-from hkbot.cloud import send_text, send_buttons, send_list
-
-app = FastAPI()
 log = logging.getLogger("uvicorn.error")
+jobs = JobQueue()
+seen = SeenSet()
+outbound = OutboundScheduler()
+warm = Warmup()
+watchlists = Watchlists()
+alerts = Alerts()
+
+def _cache_stats():
+    # 還沒載入分析模組就不要為了統計去載入
+    return analytics().cache_stats() if warmup.loaded() else {}
+
+metrics.register_collector("hkbot", lambda: {"jobs": jobs.stats(), "outbound": outbound.stats(),
+                                             "dedupe": seen.stats(), "alerts": alerts.stats(), **_cache_stats()})
+
+async def _analytics():
+    """取得 hkbot.logic；尚未載入時在 thread 裡 import，不卡住 event loop。"""
+    if warmup.loaded():
+        return analytics()
+    return await asyncio.to_thread(analytics)
+
+async def _precompute():
+    """
+    收市後全市場預先計算。WARMUP_ENABLED=0 時等第一個查詢載入分析模組後才開始排程：
+    hkbot.precompute 本身就會載入 pandas，不為了排程破壞延遲載入（要固定跑可用 cron）。
+    """
+    while not warmup.loaded():
+        await asyncio.sleep(1)
+    logic = await _analytics()
+    pre = importlib.import_module("hkbot.precompute")
+    await pre.scheduler(logic._precomputed)
+
+async def _alert_watcher():
+    """提醒 watcher；分析模組還沒載入且沒有任何提醒時先不啟動（新增提醒的指令本身就會載入分析模組）。"""
+    while not warmup.loaded() and not (await asyncio.to_thread(alerts.watched))[0]:
+        await asyncio.sleep(ALERT_INTERVAL)
+    logic = await _analytics()
+    await alerting.watcher(alerts, logic.alert_quotes, cloud.send_text, locks=logic._shared)
+
+async def _background():
+    """啟動後：預熱（import + watchlist 快取），再交給收市後全市場預先計算的排程與提醒 watcher。"""
+    await warm.run()
+    tasks = []
+    if PRECOMPUTE_ENABLED:
+        tasks.append(_precompute())
+    if ALERT_ENABLED:
+        tasks.append(_alert_watcher())
+    await asyncio.gather(*tasks)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await outbound.start()
+    await jobs.start()
+    background = asyncio.create_task(_background())
+    try:
+        yield
+    finally:
+        background.cancel()
+        if _inline:
+            await asyncio.wait(list(_inline), timeout=5)
+        await jobs.stop()
+        await outbound.stop()
+        await cloud.aclose()
+        seen.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # ======== 環境變數 ========
 WA_VERIFY_TOKEN = os.getenv("WA_VERIFY_TOKEN", "change-me")  # 用於 webhook 驗證（GET）
 WA_PHONE_ID = os.getenv("WA_PHONE_NUMBER_ID", "")            # 用於過濾非本號的 sample 事件
+TWILIO_BUDGET = float(os.getenv("TWILIO_BUDGET", "12"))      # 秒：Twilio 約 15 秒內要拿到 TwiML
+WA_BUDGET = float(os.getenv("WA_BUDGET", "25"))              # 秒：收到 webhook → 開始回覆
+BUDGET_GRACE = float(os.getenv("BUDGET_GRACE", "1.5"))       # 預算用完後留給組字 / 回傳的時間
 
 # ======== 共用文字 ========
 HELP_TEXT = (
     "🤖 使用說明：\n"
-    "• 直接輸入代碼（可多隻）：例如 9988, 06618\n"
+    "• 直接輸入代碼或名稱（可多隻）：例如 9988, 06618 或 騰訊 阿里\n"
+    "• 找代碼：find 騰訊 或 find alib（名稱片段）\n"
     "• 參數：mode=short|swing|position、days=60/90/120/240…\n"
     "  範例：9988 6618 mode=swing days=120\n"
+    "• 盤中分鐘線：interval=1m|5m|15m，例如 700 interval=5m mode=short\n"
+    "• 全市場排行：top buy / top sell（可加 mode=…）\n"
+    "• 組合（最多 100 檔）：pf 700 9988 1810 …；pf save … 存清單，之後只打 pf（可加 page=2）\n"
+    "• 回測：backtest 9988 mode=swing（AI 建議過去的命中率與之後報酬）\n"
+    "• 提醒：alert 0700 > 400 或 alert 9988 signal=買入（觸發時主動通知；alert 查看）\n"
     "• 輸入 help 取得互動選單\n"
     "— 本服務僅供教育參考，非投資建議 —"
 )
@@ -38,15 +135,130 @@ def _parse_mode_days(txt: str):
     days = max(60, min(days, 1000))
     return mode, days
 
+def _parse_interval(txt: str):
+    """「interval=5m」→ "5m"；沒指定就是日線 "1d"。"""
+    m = re.search(r"interval\s*=\s*(1m|5m|15m|1d)\b", txt, re.I)
+    return m.group(1).lower() if m else "1d"
+
+def _parse_top(txt: str):
+    """「top buy mode=swing 20」→ (side, mode, n)；不是排行指令回 None。"""
+    m = re.match(r"^\s*(?:top\b|排行)\s*(buy|sell|買入|賣出)?", txt, re.I)
+    if not m:
+        return None
+    side = "sell" if (m.group(1) or "").lower() in ("sell", "賣出") else "buy"
+    mode, _ = _parse_mode_days(txt)
+    rest = re.sub(r"(mode|days)\s*=\s*\w+", " ", txt[m.end():], flags=re.I)
+    k = re.search(r"\b(\d{1,2})\b", rest)
+    n = max(1, min(int(k.group(1)), 30)) if k else 10
+    return side, mode, n
+
+def _parse_find(txt: str):
+    """「find 騰訊」→ 查詢文字（可能是空字串）；不是找代碼指令回 None。"""
+    m = re.match(r"^\s*(?:find\b|search\b|搜尋|搜索)", txt, re.I)
+    return txt[m.end():].strip() if m else None
+
+FIND_HELP = "請在 find 後面加名稱片段，例如：find 騰訊、find alib"
+
+def _parse_backtest(txt: str):
+    """「backtest 9988 mode=swing」→ (代碼部分文字, mode)；不是回測指令回 None。"""
+    m = re.match(r"^\s*(?:backtest\b|bt\b|回測)", txt, re.I)
+    if not m:
+        return None
+    mode, _ = _parse_mode_days(txt)
+    return txt[m.end():], mode
+
+TWILIO_TEXT_MAX = int(os.getenv("TWILIO_TEXT_MAX", "1600"))   # Twilio 單則上限
+
+def _portfolio_reply(logic, user, txt: str):
+    """組合指令（已確認是 pf）→ 回覆文字；阻塞（下載 / 計算），在 worker thread 跑。"""
+    action, rest = parse_portfolio(txt)
+    symbols = logic.parse_codes_from_text(rest, max_n=PORTFOLIO_MAX)
+    if action == "clear":
+        return "🗑️ 已刪除自選清單。" if watchlists.clear(user) else "目前沒有自選清單。"
+    if action == "save":
+        if not symbols:
+            return "請在 pf save 後面加代碼，例如：pf save 700 9988 1810"
+        saved = watchlists.set(user, symbols)
+        return f"✅ 已儲存自選清單（{len(saved)} 檔）。輸入 pf 查看排行。"
+    symbols = symbols or watchlists.get(user)
+    mode, days = _parse_mode_days(txt)
+    return logic.build_portfolio_summary(symbols, days=days, mode=mode, page=parse_page(txt))
+
+ALERT_HELP = ("格式：alert 0700 > 400、alert 0700 <= 350、alert 9988 signal=買入（可加 mode=short）；"
+              "alert 查看、alert del 1 刪除、alert clear 全部刪除")
+
+def _alert_reply(logic, user, txt: str):
+    """提醒指令（已確認是 alert）→ 回覆文字；名稱解析可能查上游，在 worker thread 跑。"""
+    action, arg = parse_alert(txt)
+    if action == "list":
+        rules = alerts.list(user)
+        if not rules:
+            return "目前沒有提醒。\n" + ALERT_HELP
+        return "\n".join(["🔔 你的提醒："] + [f"• {alerting.describe(r)}" for r in rules])
+    if action == "clear":
+        return "🗑️ 已刪除全部提醒。" if alerts.clear(user) else "目前沒有提醒。"
+    if action == "del":
+        return f"🗑️ 已刪除提醒 #{arg}。" if alerts.delete(user, arg) else f"找不到提醒 #{arg}。"
+    if action == "help":
+        return ALERT_HELP
+    symbols = logic.parse_codes_from_text(arg["target"], max_n=1)
+    if not symbols:
+        return "沒有偵測到有效代碼。\n" + ALERT_HELP
+    current_label = None
+    if arg["op"] == "sig":
+        # 記下訂閱時的建議：之後要「變成」目標才通知；查不到就由 watcher 第一輪記下
+        try:
+            _, labels = logic.alert_quotes(symbols[:1], {arg["mode"]: symbols[:1]})
+            current_label = labels.get((symbols[0], arg["mode"]))
+        except Exception as e:
+            log.warning("alert baseline failed for %s: %r", symbols[0], e)
+    rule = alerts.add(user, symbols[0], arg["op"], arg["value"], arg["mode"], seen=current_label)
+    if rule is None:
+        return f"提醒已達上限（{alerts.max_per_user} 則），請先 alert del 刪除。"
+    now = f"（目前：{current_label}）" if current_label else ""
+    return f"✅ 已設定提醒：{alerting.describe(rule)}{now}（觸發後通知一次）"
+
+def _backtest_reply(logic, rest: str, mode: str):
+    """回測指令 → 回覆文字；阻塞（名稱解析 / 可能即時算一檔），在 worker thread 跑。"""
+    return logic.backtest_text(logic.parse_codes_from_text(rest), mode=mode)
+
+LATE_TEXT = "⏳ 行情來源回應較慢，資料更新中，請稍後再查一次 🙏"
+
+async def _within_budget(fut, dl):
+    """等 job 結果，最多到預算用完（再加 BUDGET_GRACE）；來不及回 None。"""
+    try:
+        return await asyncio.wait_for(fut, timeout=dl.remaining() + BUDGET_GRACE)
+    except asyncio.TimeoutError:
+        DEADLINE_EXCEEDED.inc(route=route_var.get())
+        return None
+
 def _twiml_message(body: str) -> str:
-    esc = html.escape(body)
-    return f'<?xml version="1.0" encoding="UTF-8"?><Response><Message>{esc}</Message></Response>'
+    # 太長就依行拆成多個 <Message>（Twilio 會依序送出），不截斷
+    msgs = "".join(f"<Message>{html.escape(m)}</Message>" for m in split_text(body, TWILIO_TEXT_MAX))
+    return f'<?xml version="1.0" encoding="UTF-8"?><Response>{msgs}</Response>'
 
 # ======== 健康檢查 ========
 @app.get("/health")
 async def health():
     return {"ok": True}
 
+# ======== 就緒檢查（分析模組已載入、watchlist 已預熱；與存活檢查分開） ========
+@app.get("/ready")
+async def ready():
+    body = warm.stats()
+    return JSONResponse(body, status_code=200 if warm.ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+# ======== 執行狀態（佇列深度 / 等待時間，用來調整 worker 數） ========
+@app.get("/stats")
+async def stats():
+    return {"jobs": jobs.stats(), "outbound": outbound.stats(), "dedupe": seen.stats(), "warmup": warm.stats(),
+            "alerts": alerts.stats(), **_cache_stats()}
+
+# ======== Prometheus 指標（各階段耗時、請求數、快取命中、上游錯誤） ========
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # =====================================================================
 #                          A) WhatsApp Cloud API
 # =====================================================================
@@ -72,11 +284,223 @@ async def wa_verify(request: Request):
                     status_code=status.HTTP_403_FORBIDDEN)
 
 # ---- A-2) Receive messages (互動/文字) ----
+_COMMANDS = ("help", "menu", "？", "h", "ping", "hi", "hello")
+
+def _wa_code_query(msg: dict):
+    """文字訊息若是代碼查詢，回傳 (symbols, days, mode)；否則 None。"""
+    text_body = (msg.get("text") or {}).get("body", "").strip()
+    if not text_body or text_body.lower() in _COMMANDS or _parse_top(text_body) or parse_portfolio(text_body) \
+            or _parse_find(text_body) is not None or _parse_backtest(text_body) or parse_alert(text_body) \
+            or _parse_interval(text_body) != "1d":
+        return None
+    with span("parse"):
+        symbols = analytics().parse_codes_from_text(text_body)
+        if not symbols:
+            return None
+        mode, days = _parse_mode_days(text_body)
+    return symbols, days, mode
+
+def _is_quick(msg: dict):
+    """help / ping、按鈕 / 清單回覆：不用分析模組，直接在 event loop 回，不排進 job 佇列（不被長分析卡住）。"""
+    if msg.get("interactive"):
+        return True
+    return (msg.get("text") or {}).get("body", "").strip().lower() in _COMMANDS
+
+_inline = set()   # 直接處理中的快速訊息（保留參照，關機時等它們送完）
+
+async def _handle_wa_quick(msg: dict):
+    route_var.set("wa")
+    try:
+        await _handle_wa_message(msg)
+    except Exception as e:
+        log.error("wa message %s failed: %r", msg.get("id"), e)
+
+async def _handle_wa_batch(msgs: list):
+    """
+    一次 webhook 可能帶多位使用者的多則訊息：
+    先把所有代碼查詢的 symbol 合併成一次下載（暖好快取），再各自分析、回覆。
+    """
+    route_var.set("wa")
+    # 預算從收到 webhook 起算（含排隊時間）；gather 出去的 task 都帶著這個 contextvar
+    deadline_var.set(Deadline(WA_BUDGET, start=msgs[0].get("_received")))
+    logic = await _analytics()
+    queries = [q for q in (_wa_code_query(m) for m in msgs) if q]
+    if len(queries) > 1:
+        union = list(dict.fromkeys(s for q in queries for s in q[0]))
+        max_days = max(q[1] for q in queries)
+        await jobs.run_blocking(logic.get_multiple_stocks_data, union, days=max_days)
+    results = await asyncio.gather(*(_handle_wa_message(m) for m in msgs), return_exceptions=True)
+    for m, r in zip(msgs, results):
+        if isinstance(r, Exception):
+            log.error("wa message %s failed: %r", m.get("id"), r)
+
+async def _stream_summary(reply, symbols, days, mode):
+    """
+    逐組算、逐組送：第一組好了就先回（NORMAL），其餘依序跟上（BULK）；
+    下一組在上一則送出期間就開始算。每則依行切到 WA_TEXT_MAX 以內，不丟內容。
+    """
+    parts = analytics().iter_whatsapp_summary(symbols, days=days, mode=mode)
+    sending, first = None, True
+    while True:
+        lines = await jobs.run_blocking(next, parts, None)
+        if lines is None:
+            break
+        for chunk in split_text("\n".join(lines)):
+            if sending is not None:
+                await sending          # 同一位使用者的訊息要照順序到
+            sending = asyncio.ensure_future(
+                reply(asend_text, chunk, priority=PRIORITY_NORMAL if first else PRIORITY_BULK))
+            first = False
+    if sending is not None:
+        await sending
+
+async def _handle_wa_message(msg: dict):
+    """
+    在背景 worker 內處理單則訊息（buttons/list/text），包含分析與外送。
+    分析（阻塞）走 jobs.run_blocking()；外送經 outbound 排程（快速回覆優先於長篇分析）。
+    """
+    wa_from = msg.get("from")  # 純數字國碼電話
+    text_body = (msg.get("text") or {}).get("body", "").strip()
+    interactive = msg.get("interactive")
+    phone_id = msg.get("_phone_id")  # 從哪個號碼收到就從哪個號碼回（各號碼各自限速）
+
+    async def reply(fn, *args, **kwargs):
+        return await outbound.send(fn, wa_from, *args, phone_id=phone_id, **kwargs)
+
+    # 1) 互動：Buttons
+    if interactive and interactive.get("type") == "button":
+        br = interactive.get("button_reply") or {}
+        btn_id = (br.get("id") or "").strip()
+        mapping = {"opt_short": "short", "opt_swing": "swing", "opt_position": "position"}
+        if btn_id in mapping:
+            REQUESTS.inc(route="wa", kind="button")
+            mode = mapping[btn_id]
+            await reply(asend_text, f"✅ 已選擇模式：{mode}。\n請輸入代碼，例如：9988 06618（可再加 days=120）",
+                                priority=PRIORITY_QUICK)
+            return
+
+    # 2) 互動：List
+    if interactive and interactive.get("type") == "list":
+        lr = interactive.get("list_reply") or {}
+        lid = (lr.get("id") or "").strip()
+        if lid.startswith("days_"):
+            try:
+                days = int(lid.split("_", 1)[1])
+            except ValueError:
+                days = None
+            if days:
+                REQUESTS.inc(route="wa", kind="list")
+                await reply(asend_text, f"✅ 已選擇期間：{days} 天。\n請輸入代碼，例如：9988 06618（可再加 mode=swing）",
+                                    priority=PRIORITY_QUICK)
+                return
+
+    # 3) 文字命令
+    if text_body:
+        low = text_body.lower()
+        if low in ("help", "menu", "？", "h"):
+            REQUESTS.inc(route="wa", kind="help")
+            # 先給按鈕選模式
+            await reply(asend_buttons, "請選擇分析模式：", [
+                {"id": "opt_short", "title": "短線"},
+                {"id": "opt_swing", "title": "波段"},
+                {"id": "opt_position", "title": "中長線"},
+            ], priority=PRIORITY_QUICK)
+            # 再送清單選期間
+            await reply(asend_list, "期間", "請選擇資料期間：", [{
+                "title": "期間",
+                "rows": [
+                    {"id": "days_60", "title": "60 天"},
+                    {"id": "days_120", "title": "120 天"},
+                    {"id": "days_240", "title": "240 天"},
+                ]
+            }], button_text="選擇", priority=PRIORITY_QUICK)
+            return
+
+        if low in ("ping", "hi", "hello"):
+            REQUESTS.inc(route="wa", kind="ping")
+            await reply(asend_text, "pong ✅ 服務正常", priority=PRIORITY_QUICK)
+            return
+
+        # 4) 全市場排行（讀收市後預先算好的表）
+        top = _parse_top(text_body)
+        if top:
+            REQUESTS.inc(route="wa", kind="top")
+            side, mode, n = top
+            for chunk in split_text(analytics().top_signals_text(side, mode=mode, n=n)):
+                await reply(asend_text, chunk, priority=PRIORITY_NORMAL)
+            return
+
+        # 4b) 找代碼（名稱片段 → 候選清單）
+        query = _parse_find(text_body)
+        if query is not None:
+            REQUESTS.inc(route="wa", kind="find")
+            logic = await _analytics()
+            await reply(asend_text, logic.search_text(query) if query else FIND_HELP, priority=PRIORITY_QUICK)
+            return
+
+        # 5) 組合 / 自選清單（大量代碼：分批平行下載，排行分頁）
+        if parse_portfolio(text_body):
+            REQUESTS.inc(route="wa", kind="portfolio")
+            logic = await _analytics()
+            with REQUEST_SECONDS.time(route="wa", mode=_parse_mode_days(text_body)[0], symbols="portfolio"):
+                text = await jobs.run_blocking(_portfolio_reply, logic, wa_from, text_body)
+                for chunk in split_text(text):
+                    await reply(asend_text, chunk, priority=PRIORITY_BULK)
+            return
+
+        # 6) 回測（讀離線算好的結果）
+        bt = _parse_backtest(text_body)
+        if bt:
+            REQUESTS.inc(route="wa", kind="backtest")
+            logic = await _analytics()
+            rest, mode = bt
+            text = await jobs.run_blocking(_backtest_reply, logic, rest, mode)
+            for chunk in split_text(text):
+                await reply(asend_text, chunk, priority=PRIORITY_NORMAL)
+            return
+
+        # 7) 到價 / 訊號提醒
+        if parse_alert(text_body):
+            REQUESTS.inc(route="wa", kind="alert")
+            logic = await _analytics()
+            text = await jobs.run_blocking(_alert_reply, logic, wa_from, text_body)
+            await reply(asend_text, text, priority=PRIORITY_QUICK)
+            return
+
+        # 8) 盤中分鐘線（環形緩衝區，只補抓新 K 線）
+        interval = _parse_interval(text_body)
+        if interval != "1d":
+            logic = await _analytics()
+            symbols = logic.parse_codes_from_text(text_body)
+            if symbols:
+                mode, _ = _parse_mode_days(text_body)
+                REQUESTS.inc(route="wa", kind="intraday")
+                with REQUEST_SECONDS.time(route="wa", mode=mode, symbols=symbols_bucket(len(symbols))):
+                    text = await jobs.run_blocking(logic.build_intraday_summary, symbols, interval=interval, mode=mode)
+                for chunk in split_text(text):
+                    await reply(asend_text, chunk, priority=PRIORITY_NORMAL)
+                return
+
+        # 9) 直接輸入代碼
+        query = _wa_code_query(msg)
+        if query:
+            symbols, days, mode = query
+            REQUESTS.inc(route="wa", kind="query")
+            with REQUEST_SECONDS.time(route="wa", mode=mode, symbols=symbols_bucket(len(symbols))):
+                await _stream_summary(reply, symbols, days, mode)
+            return
+
+    # 無法解析 → 提示
+    REQUESTS.inc(route="wa", kind="unknown")
+    await reply(asend_text, "請輸入代碼（例如 9988 06618），或輸入 help 使用互動選單。",
+                        priority=PRIORITY_QUICK)
+
 @app.post("/wa-webhook")
 async def wa_webhook(request: Request):
     """
-    處理 Cloud API 來的訊息（buttons/list/text）。
-    簡化處理：僅取第一則 message。
+    處理 Cloud API 來的訊息：只做解析 & 排隊，立即回 200，
+    實際分析與回覆交給背景 worker（避免 Meta 逾時重送）；help / ping / 按鈕不排隊，直接回。
+    會處理 payload 內所有 entry / change / message（尖峰時 Meta 會合併多則）。
     """
     try:
         data = await request.json()
@@ -85,83 +509,50 @@ async def wa_webhook(request: Request):
         return {"status": "ignored"}
 
     try:
-        entry = (data.get("entry") or [])[0]
-        change = (entry.get("changes") or [])[0]
-        value = change.get("value") or {}
-        metadata = value.get("metadata") or {}
-        messages = value.get("messages") or []
-
-        # 過濾「不是我這支號碼」的事件（多半是後台的 Sample Webhook）
-        if WA_PHONE_ID and str(metadata.get("phone_number_id")) != str(WA_PHONE_ID):
-            return {"status": "ignored_wrong_phone_id"}
-
-        if not messages:
+        msgs, dups, wrong_phone = [], 0, 0
+        for entry in data.get("entry") or []:
+            for change in entry.get("changes") or []:
+                value = change.get("value") or {}
+                metadata = value.get("metadata") or {}
+                # 過濾「不是我這支號碼」的事件（多半是後台的 Sample Webhook）
+                if WA_PHONE_ID and str(metadata.get("phone_number_id")) != str(WA_PHONE_ID):
+                    wrong_phone += 1
+                    continue
+                for msg in value.get("messages") or []:
+                    # Meta 逾時會重送同一則：看過的 ID 直接略過，不再分析 / 回覆
+                    if seen.add(msg.get("id")):
+                        msgs.append(dict(msg, _phone_id=metadata.get("phone_number_id"),
+                                         _received=time.monotonic()))
+                    else:
+                        dups += 1
+
+        if not msgs:
+            if dups:
+                return {"status": "duplicate"}
+            if wrong_phone:
+                return {"status": "ignored_wrong_phone_id"}
             return {"status": "no_messages"}
 
-        msg = messages[0]
-        wa_from = msg.get("from")  # 純數字國碼電話
-        text_body = (msg.get("text") or {}).get("body", "").strip()
-        interactive = msg.get("interactive")
-
-        # 1) 互動：Buttons
-        if interactive and interactive.get("type") == "button":
-            br = interactive.get("button_reply") or {}
-            btn_id = (br.get("id") or "").strip()
-            mapping = {"opt_short": "short", "opt_swing": "swing", "opt_position": "position"}
-            if btn_id in mapping:
-                mode = mapping[btn_id]
-                send_text(wa_from, f"✅ 已選擇模式：{mode}。\n請輸入代碼，例如：9988 06618（可再加 days=120）")
-                return {"ok": True}
-
-        # 2) 互動：List
-        if interactive and interactive.get("type") == "list":
-            lr = interactive.get("list_reply") or {}
-            lid = (lr.get("id") or "").strip()
-            if lid.startswith("days_"):
-                try:
-                    days = int(lid.split("_", 1)[1])
-                    send_text(wa_from, f"✅ 已選擇期間：{days} 天。\n請輸入代碼，例如：9988 06618（可再加 mode=swing）")
-                    return {"ok": True}
-                except Exception:
-                    pass
-
-        # 3) 文字命令
-        if text_body:
-            low = text_body.lower()
-            if low in ("help", "menu", "？", "h"):
-                # 先給按鈕選模式
-                send_buttons(wa_from, "請選擇分析模式：", [
-                    {"id": "opt_short", "title": "短線"},
-                    {"id": "opt_swing", "title": "波段"},
-                    {"id": "opt_position", "title": "中長線"},
-                ])
-                # 再送清單選期間
-                send_list(wa_from, "期間", "請選擇資料期間：", [{
-                    "title": "期間",
-                    "rows": [
-                        {"id": "days_60", "title": "60 天"},
-                        {"id": "days_120", "title": "120 天"},
-                        {"id": "days_240", "title": "240 天"},
-                    ]
-                }], button_text="選擇")
-                return {"ok": True}
-
-            if low in ("ping", "hi", "hello"):
-                send_text(wa_from, "pong ✅ 服務正常")
-                return {"ok": True}
-
-            # 4) 直接輸入代碼
-            mode, days = _parse_mode_days(text_body)
-            symbols = parse_codes_from_text(text_body)
-            if symbols:
-                text = build_whatsapp_summary(symbols, days=days, mode=mode)
-                send_text(wa_from, text)
-                return {"ok": True}
-
-        # 無法解析 → 提示
-        send_text(wa_from, "請輸入代碼（例如 9988 06618），或輸入 help 使用互動選單。")
-        return {"ok": True}
-
+        # 指令類（help / ping / 按鈕）直接回；需要分析的才排隊
+        queued = [m for m in msgs if not _is_quick(m)]
+        for msg in msgs:
+            if _is_quick(msg):
+                task = asyncio.create_task(_handle_wa_quick(msg))
+                _inline.add(task)
+                task.add_done_callback(_inline.discard)
+        if queued:
+            try:
+                jobs.submit(_handle_wa_batch, queued)
+            except JobQueueFull:
+                for msg in queued:
+                    seen.discard(msg.get("id"))   # 沒處理到，讓 Meta 重送時還能再收
+                raise
+        return {"status": "queued", "messages": len(msgs), "inline": len(msgs) - len(queued), "duplicates": dups}
+
+    except JobQueueFull as e:
+        log.warning("wa_webhook dropped: %s", e)
+        # 仍回 200：重送只會讓佇列更滿
+        return {"status": "busy"}
     except Exception as e:
         # 印 payload 方便除錯，但避免過長
         try:
@@ -190,33 +581,104 @@ async def _read_twilio_form(request: Request) -> dict:
         log.warning("Twilio form parse failed, fallback used. err=%r raw=%r", e, raw[:300])
         return fallback
 
+async def _build_summary_job(symbols, days, mode, dl=None):
+    route_var.set("twilio")
+    deadline_var.set(dl)
+    return await jobs.run_blocking(analytics().build_whatsapp_summary, symbols, days=days, mode=mode)
+
+async def _intraday_job(symbols, interval, mode, dl=None):
+    route_var.set("twilio")
+    deadline_var.set(dl)
+    return await jobs.run_blocking(analytics().build_intraday_summary, symbols, interval=interval, mode=mode)
+
+async def _portfolio_job(user, body, dl=None):
+    route_var.set("twilio")
+    deadline_var.set(dl)
+    return await jobs.run_blocking(_portfolio_reply, analytics(), user, body)
+
+async def _backtest_job(rest, mode, dl=None):
+    route_var.set("twilio")
+    deadline_var.set(dl)
+    return await jobs.run_blocking(_backtest_reply, analytics(), rest, mode)
+
 @app.post("/whatsapp")
 async def twilio_webhook(request: Request):
     """
     Twilio Sandbox 路由（如果你已改用 Cloud API，可以不設定 Twilio webhook）。
     """
+    route_var.set("twilio")
+    dl = Deadline(TWILIO_BUDGET)
     try:
         form = await _read_twilio_form(request)
         body = (form.get("Body") or "").strip()
 
         if not body:
+            REQUESTS.inc(route="twilio", kind="unknown")
             return Response(content=_twiml_message("請輸入代碼，或輸入 help 查看說明。"),
                             media_type="application/xml")
 
         if body.lower() in ("help", "menu", "？", "h"):
+            REQUESTS.inc(route="twilio", kind="help")
             return Response(content=_twiml_message(HELP_TEXT), media_type="application/xml")
 
         if body.lower() == "ping":
+            REQUESTS.inc(route="twilio", kind="ping")
             return Response(content=_twiml_message("pong ✅"), media_type="application/xml")
 
-        mode, days = _parse_mode_days(body)
-        symbols = parse_codes_from_text(body)
+        logic = await _analytics()
+        top = _parse_top(body)
+        if top:
+            REQUESTS.inc(route="twilio", kind="top")
+            side, mode, n = top
+            return Response(content=_twiml_message(logic.top_signals_text(side, mode=mode, n=n)),
+                            media_type="application/xml")
+
+        query = _parse_find(body)
+        if query is not None:
+            REQUESTS.inc(route="twilio", kind="find")
+            return Response(content=_twiml_message(logic.search_text(query) if query else FIND_HELP),
+                            media_type="application/xml")
+
+        if parse_portfolio(body):
+            REQUESTS.inc(route="twilio", kind="portfolio")
+            user = form.get("From") or ""
+            with REQUEST_SECONDS.time(route="twilio", mode=_parse_mode_days(body)[0], symbols="portfolio"):
+                text = await _within_budget(jobs.submit(_portfolio_job, user, body, dl), dl)
+            return Response(content=_twiml_message(text or LATE_TEXT), media_type="application/xml")
+
+        if parse_alert(body):
+            # 提醒要主動推播，只支援 Cloud API（Twilio 路由無法事後送訊）
+            REQUESTS.inc(route="twilio", kind="alert")
+            return Response(content=_twiml_message("提醒功能需使用 WhatsApp Cloud API 號碼。"),
+                            media_type="application/xml")
+
+        bt = _parse_backtest(body)
+        if bt:
+            REQUESTS.inc(route="twilio", kind="backtest")
+            rest, mode = bt
+            text = await _within_budget(jobs.submit(_backtest_job, rest, mode, dl), dl)
+            return Response(content=_twiml_message(text or LATE_TEXT), media_type="application/xml")
+
+        with span("parse"):
+            mode, days = _parse_mode_days(body)
+            symbols = logic.parse_codes_from_text(body)
         if not symbols:
+            REQUESTS.inc(route="twilio", kind="unknown")
             return Response(content=_twiml_message("沒有偵測到有效代碼，請輸入如：9988, 06618（可加 mode= 與 days=）"),
                             media_type="application/xml")
 
-        text = build_whatsapp_summary(symbols, days=days, mode=mode)
-        return Response(content=_twiml_message(text), media_type="application/xml")
+        interval = _parse_interval(body)
+        if interval != "1d":
+            REQUESTS.inc(route="twilio", kind="intraday")
+            with REQUEST_SECONDS.time(route="twilio", mode=mode, symbols=symbols_bucket(len(symbols))):
+                text = await _within_budget(jobs.submit(_intraday_job, symbols, interval, mode, dl), dl)
+            return Response(content=_twiml_message(text or LATE_TEXT), media_type="application/xml")
+
+        # Twilio 需要同步回 TwiML：仍排進同一個佇列，但在這裡等結果
+        REQUESTS.inc(route="twilio", kind="query")
+        with REQUEST_SECONDS.time(route="twilio", mode=mode, symbols=symbols_bucket(len(symbols))):
+            text = await _within_budget(jobs.submit(_build_summary_job, symbols, days, mode, dl), dl)
+        return Response(content=_twiml_message(text or LATE_TEXT), media_type="application/xml")
 
     except Exception as e:
         log.exception("twilio_webhook error: %r", e)
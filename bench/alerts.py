@@ -0,0 +1,104 @@
+# bench/alerts.py
+"""
+提醒檢查：排序門檻索引 vs 逐條掃描，每輪耗時（ms）。
+
+    python -m bench.alerts [--rules 20000] [--symbols 2600] [--cycles 50]
+
+規則 / 報價都是隨機產生（固定 seed）；價格每輪小幅波動，大部分規則不觸發（接近實際情況），
+觸發的規則照常移除。兩種做法觸發的規則必須一樣。最後檢查邊界：>= / <= 剛好到價會觸發、
+> / < 不會；訊號規則只在建議轉變時觸發；送出失敗的規則會掛回去。
+"""
+import argparse
+import random
+import time
+
+from hkbot.alerts import Alerts, run_cycle
+
+_CMP = {">": float.__gt__, ">=": float.__ge__, "<": float.__lt__, "<=": float.__le__}
+
+
+def _linear(rules, prices, labels):
+    out = set()
+    for user, rs in rules.items():
+        for rule in rs:
+            rid, sym, op, value, mode = rule[:5]
+            p = prices.get(sym)
+            if p is None:
+                continue
+            if op == "sig":
+                label = labels.get((sym, mode))
+                if label == value and rule[5] is not None and rule[5] != label:
+                    out.add((user, rid))
+            elif _CMP[op](p, value):
+                out.add((user, rid))
+    return out
+
+
+def _edges():
+    alerts = Alerts(path=None)
+    for op in (">", ">=", "<", "<="):
+        alerts.add("u", "0700.HK", op, 400.0)
+    alerts.add("u", "0700.HK", "sig", "買入", "swing", seen="買入")
+    alerts.add("u", "9988.HK", "sig", "買入", "swing")
+    got = alerts.evaluate({"0700.HK": 400.0, "9988.HK": 80.0},
+                          {("0700.HK", "swing"): "買入", ("9988.HK", "swing"): "買入"})
+    assert sorted(r[2] for r, _ in got["u"]) == ["<=", ">="], got
+    # 訂閱時已是買入 / 第一次看到就是買入：都不觸發；要先變成別的再變回來
+    labels = {("0700.HK", "swing"): "持有", ("9988.HK", "swing"): "持有"}
+    assert alerts.evaluate({"0700.HK": 400.0, "9988.HK": 80.0}, labels) == {}
+    labels = {("0700.HK", "swing"): "買入", ("9988.HK", "swing"): "買入"}
+
+    def fail(user, text):
+        raise ConnectionError("send failed")
+    quotes = lambda symbols, modes: ({"0700.HK": 400.0, "9988.HK": 80.0}, labels)
+    assert run_cycle(alerts, quotes, fail) == 0
+    assert len(alerts.list("u")) == 4                      # 送出失敗：兩則訊號規則掛回去
+    sent = []
+    assert run_cycle(alerts, quotes, lambda user, text: sent.append(text)) == 1
+    assert sent[0].count("買入") == 2 and [r[2] for r in alerts.list("u")] == [">", "<"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rules", type=int, default=20000)
+    ap.add_argument("--symbols", type=int, default=2600)
+    ap.add_argument("--cycles", type=int, default=50)
+    args = ap.parse_args()
+
+    rng = random.Random(0)
+    symbols = [f"{i:04d}.HK" for i in range(1, args.symbols + 1)]
+    base = {s: rng.uniform(1, 500) for s in symbols}
+    alerts = Alerts(path=None, max_per_user=10 ** 6)
+    for i in range(args.rules):
+        sym = rng.choice(symbols)
+        if i % 10 == 0:
+            alerts.add(f"u{i % 5000}", sym, "sig", rng.choice(["買入", "賣出"]), "swing")
+        else:
+            op = rng.choice([">", ">=", "<", "<="])
+            alerts.add(f"u{i % 5000}", sym, op,
+                       round(base[sym] * (1.1 if op[0] == ">" else 0.9) * rng.uniform(0.9, 1.1), 2))
+
+    indexed = linear = 0.0
+    fired = 0
+    for c in range(args.cycles):
+        prices = {s: p * rng.uniform(0.97, 1.03) for s, p in base.items()}
+        labels = {(s, "swing"): rng.choice(["買入", "持有", "持有", "賣出"]) for s in symbols[:50]}
+        t = time.perf_counter()
+        expect = _linear(alerts._rules, prices, labels)
+        linear += time.perf_counter() - t
+        alerts.watched()   # 索引在規則變動後的第一次使用時重建，算進索引版的時間
+        t = time.perf_counter()
+        got = alerts.evaluate(prices, labels)
+        indexed += time.perf_counter() - t
+        got = {(u, r[0]) for u, rs in got.items() for r, _ in rs}
+        assert got == expect, (len(got), len(expect))
+        fired += len(got)
+
+    _edges()
+    print(f"{args.rules} rules / {args.symbols} symbols, {args.cycles} cycles, {fired} fired")
+    print(f"{'linear scan':>12} {1000 * linear / args.cycles:8.2f} ms/cycle")
+    print(f"{'indexed':>12} {1000 * indexed / args.cycles:8.2f} ms/cycle")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench/backtest.py
+"""
+回測引擎：先對照（每個交易日的標籤 = 對那天之前 window 根 K 線跑 ai_recommendation），再量時間。
+
+    python -m bench.backtest [--symbols 500] [--years 5] [--workers 1,4]
+
+K 線寫進暫存 BarStore（bench.synthetic 的隨機漫步），不碰網路；
+對照抽幾檔、每檔每隔幾天抽一天，用逐檔 pandas 版重算。
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from bench.synthetic import make_frame, make_symbols
+from hkbot import backtest
+from hkbot.logic import ai_recommendation
+from hkbot.store import BarStore
+
+_LABEL = {name: k for k, name in enumerate(backtest.LABELS)}
+
+
+def check_parity(frames, days=backtest.BACKTEST_DAYS, step=7):
+    bad = checked = 0
+    w = backtest.window_bars(days)
+    for sym, df in frames.items():
+        close = df["Close"].to_numpy(dtype=np.float64)[None, :]
+        volume = df["Volume"].to_numpy(dtype=np.float64)[None, :]
+        for mode in backtest.MODES:
+            labels, valid = backtest.signal_matrix(close, volume, mode=mode, days=days)
+            for t in range(w - 1, len(df), step):
+                if not valid[0, t]:
+                    continue
+                ref = _LABEL[ai_recommendation(df.iloc[t - w + 1:t + 1], mode=mode)["label"]]
+                checked += 1
+                if ref != labels[0, t]:
+                    bad += 1
+                    print(f"MISMATCH {sym} {mode} {df.index[t].date()}: {ref} != {labels[0, t]}")
+    return bad, checked
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=500)
+    ap.add_argument("--years", type=float, default=5)
+    ap.add_argument("--workers", default="1,4")   # 固定對照單一 process 與 4 個 worker 的 pool，不隨 CPU 數變
+    ap.add_argument("--parity", type=int, default=10)
+    args = ap.parse_args()
+
+    bars = int(args.years * 250)
+    root = tempfile.mkdtemp(prefix="hkbot-backtest-")
+    store = BarStore(root)
+    rng = random.Random(0)
+    frames = {}
+    for i, sym in enumerate(make_symbols(args.symbols)):
+        df = make_frame(bars - rng.randint(0, bars // 2), seed=i)   # 長短不一（新上市）
+        store.append(sym, df, since=df.index[0])
+        if i < args.parity:
+            frames[sym] = df
+
+    bad, checked = check_parity(frames)
+    print(f"parity: {'OK' if not bad else f'{bad} mismatches'} ({checked} symbol-days × {len(backtest.MODES)} modes)")
+
+    print(f"{'workers':>8} {'s':>8} {'symbol-days/s':>14}")
+    for workers in (int(x) for x in args.workers.split(",")):
+        t = time.perf_counter()
+        res = backtest.run(root=root, workers=workers)
+        elapsed = time.perf_counter() - t
+        days = sum(m["days"] for m in res["modes"].values())
+        print(f"{workers:>8} {elapsed:8.2f} {days / elapsed:14.0f}")
+    for mode, r in res["modes"].items():
+        print(f"{mode:>8}: hit {r['hit_rate']}%  turnover {r['turnover']}/yr  "
+              + "  ".join(f"{k} n={v['n']} avg={v['avg_ret']}%" for k, v in r["labels"].items()))
+
+    out = os.path.join(root, "backtest.json")
+    results = backtest.Results(out, store=store)
+    results.save(res)
+    t = time.perf_counter()
+    for sym in make_symbols(args.symbols):
+        results.get(sym)
+    print(f"cached lookup: {1e6 * (time.perf_counter() - t) / args.symbols:.1f} µs/symbol")
+    if bad:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
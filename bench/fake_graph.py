@@ -0,0 +1,149 @@
+# bench/fake_graph.py
+"""
+本機假的 Graph API（WhatsApp Cloud API 替身），給 hkbot.cloud 測試 / 壓測用。
+
+    python -m bench.fake_graph            # 自我檢查：help 指令只用 1 條連線
+    python -m bench.fake_graph --serve    # 常駐，搭配 WA_API_BASE=http://127.0.0.1:<port>
+
+記錄每個請求（路徑、payload）與建立過的 TCP 連線數，用來確認 keep-alive 有生效。
+可注入延遲（latency）與錯誤（fail_rate 比例回 error_status，預設 429 + Retry-After）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGraphAPI:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, fail_rate=0.0,
+                 error_status=429, retry_after=None, seed=0, on_call=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self.calls = []          # [(path, payload)]（成功的）
+        self.errors = 0          # 注入的錯誤次數
+        self.connections = 0     # 建立過的 TCP 連線數
+        self.on_call = on_call   # 成功時回呼 on_call(path, payload)（壓測量端到端延遲用）
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v20.0"
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(n) if n else b""
+                try:
+                    payload = json.loads(raw or b"{}")
+                except ValueError:
+                    payload = None
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake._lock:
+                    fail = fake.fail_rate and fake._rng.random() < fake.fail_rate
+                    if fail:
+                        fake.errors += 1
+                if fail:
+                    headers = {"Retry-After": str(fake.retry_after)} if fake.retry_after is not None else {}
+                    return self._reply(fake.error_status, {"error": {
+                        "message": "(#130429) Rate limit hit", "code": 130429}}, headers)
+                with fake._lock:
+                    fake.calls.append((self.path, payload))
+                    seq = len(fake.calls)
+                if fake.on_call:
+                    fake.on_call(self.path, payload)
+                self._reply(200, {"messaging_product": "whatsapp",
+                                  "messages": [{"id": f"wamid.fake{seq}"}]})
+
+            def _reply(self, code, obj, headers=None):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+async def _selfcheck(fake):
+    from hkbot import cloud
+    cloud.WA_API = fake.url
+    await cloud.asend_buttons("85200000000", "請選擇分析模式：", [{"id": "opt_swing", "title": "波段"}])
+    await cloud.asend_list("85200000000", "期間", "請選擇資料期間：",
+                           [{"title": "期間", "rows": [{"id": "days_60", "title": "60 天"}]}])
+    await cloud.asend_text("85200000000", "pong ✅ 服務正常")
+    await cloud.aclose()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--serve", action="store_true")
+    ap.add_argument("--port", type=int, default=int(os.getenv("FAKE_GRAPH_PORT", "0")))
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=429)
+    args = ap.parse_args()
+
+    fake = FakeGraphAPI(port=args.port, latency=args.latency, fail_rate=args.fail_rate,
+                        error_status=args.error_status).start()
+    if args.serve:
+        print(f"fake Graph API on {fake.url}  (export WA_API_BASE={fake.url})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        fake.stop()
+        return
+
+    asyncio.run(_selfcheck(fake))
+    fake.stop()
+    print(f"calls={len(fake.calls)} connections={fake.connections}")
+    assert len(fake.calls) == 3, fake.calls
+    assert fake.connections == 1, "keep-alive not reused"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# bench/indicators.py
+"""
+串流式指標 vs 整段重算：逐根餵入 K 線（視窗起點固定、以及每天往前滑的實際情況），
+每一步都和 ai_recommendation 對照，再量新 K 線 / 重複查詢的成本。
+
+    python -m bench.indicators [--symbols 20] [--days 400]
+"""
+import argparse
+import time
+
+from bench.synthetic import make_frames
+from hkbot.indicators import IndicatorEngine
+from hkbot.logic import ai_recommendation, _rsi
+from hkbot.signals import MODE_PARAMS, mode_params
+
+
+def max_rel_diff(eng, sym, df, mode, window=None):
+    """串流狀態的 EMA / RSI 與 pandas 整段重算的最大相對誤差。"""
+    ema_fast, ema_slow, rsi_p, _, _ = mode_params(mode)
+    v = eng.evaluate(sym, df, mode, window)
+    ref = {
+        "ema_f": df["Close"].ewm(span=ema_fast, adjust=False).mean().iloc[-1],
+        "ema_s": df["Close"].ewm(span=ema_slow, adjust=False).mean().iloc[-1],
+        "rsi": _rsi(df["Close"], rsi_p).iloc[-1],
+    }
+    return max(abs(v[k] - ref[k]) / max(abs(ref[k]), 1e-12) for k in ref)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=20)
+    ap.add_argument("--days", type=int, default=400)
+    ap.add_argument("--window", type=int, default=85, help="滑動視窗的 K 線數（120 個日曆日約 85 根）")
+    args = ap.parse_args()
+
+    frames = make_frames(args.symbols, days=args.days)
+    eng = IndicatorEngine()
+    bad = checked = 0
+    worst = 0.0
+    for mode in MODE_PARAMS:
+        for sym, df in frames.items():
+            # 視窗起點固定逐根加長（window="grow"）；視窗長度固定、每天往前滑一根（window="slide"）
+            for n in range(args.days - 60, args.days + 1, 1):
+                for window, sub in (("grow", df.iloc[:n]), ("slide", df.iloc[n - args.window:n])):
+                    ref = ai_recommendation(sub, mode=mode)
+                    got = eng.recommend(sym, sub, mode=mode, window=window)
+                    worst = max(worst, max_rel_diff(eng, sym, sub, mode, window))
+                    checked += 1
+                    if (ref["label"], ref["reason"]) != (got["label"], got["reason"]):
+                        bad += 1
+                        print(f"MISMATCH {sym} {mode} {window} n={n}: {ref} != {got}")
+    print(f"parity: {'OK' if not bad else f'{bad} mismatches'} ({checked} checks, "
+          f"max rel diff vs pandas {worst:.1e}) {eng.stats()}")
+
+    sym, df = next(iter(frames.items()))
+    reps = 200
+    t = time.perf_counter()
+    for _ in range(reps):
+        ai_recommendation(df, mode="swing")
+    full = (time.perf_counter() - t) / reps
+    eng = IndicatorEngine()
+    t = time.perf_counter()
+    eng.recommend(sym, df.iloc[:-1], mode="swing")
+    cold = time.perf_counter() - t
+    t = time.perf_counter()
+    eng.recommend(sym, df, mode="swing")
+    new_bar = time.perf_counter() - t
+    t = time.perf_counter()
+    for _ in range(reps):
+        eng.recommend(sym, df, mode="swing")
+    repeat = (time.perf_counter() - t) / reps
+    # 實際情況：每天新的一根進來，視窗起點同時往前滑
+    w = args.window
+    eng.recommend(sym, df.iloc[-w - reps - 1:-reps - 1], mode="swing", window="slide")
+    rebuilds = eng.stats()["rebuilds"]
+    t = time.perf_counter()
+    for i in range(reps, 0, -1):
+        eng.recommend(sym, df.iloc[-w - i:-i], mode="swing", window="slide")
+    slide = (time.perf_counter() - t) / reps
+    assert eng.stats()["rebuilds"] == rebuilds, "sliding window rebuilt the state"
+    print(f"full recompute {full * 1e3:.3f} ms | cold build {cold * 1e3:.3f} ms | "
+          f"new bar {new_bar * 1e3:.3f} ms | new bar + window slide {slide * 1e3:.3f} ms | "
+          f"repeat {repeat * 1e3:.3f} ms")
+    if bad:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# bench/intraday.py
+"""
+盤中環形緩衝區：每檔記憶體、每根新 K 線的更新成本、直接在 buffer 上算指標的耗時。
+
+    python -m bench.intraday [--symbols 300] [--capacity 400] [--minutes 330]
+
+模擬一整個交易日的 1m K 線（330 根）：每分鐘每檔補一根（外加覆寫進行中的最後一根），
+對照「每次重抓整段再接起來（np.concatenate + 取最後 capacity 根）」的做法。不碰網路。
+ring 的更新成本固定（只寫新的欄），concatenate 隨 capacity 變大；容量小時兩者差不多（試 --capacity 2000）。
+"""
+import argparse
+import time
+
+import numpy as np
+
+from hkbot.intraday import INTRADAY_BARS, RingBuffer
+from hkbot.signals import recommend_batch
+
+
+def _bars(n, start, seed):
+    rng = np.random.default_rng(seed)
+    arr = np.empty((6, n))
+    arr[0] = start + 60 * np.arange(n)
+    arr[4] = 50 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    arr[1] = arr[2] = arr[3] = arr[4]
+    arr[5] = rng.lognormal(10, 0.5, n).round()
+    return arr
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=300)
+    ap.add_argument("--capacity", type=int, default=INTRADAY_BARS)
+    ap.add_argument("--minutes", type=int, default=330)
+    ap.add_argument("--mode", default="short")
+    args = ap.parse_args()
+
+    cap, n_sym, minutes = args.capacity, args.symbols, args.minutes
+    history = [_bars(cap + minutes, 1_700_000_000, seed=i) for i in range(n_sym)]
+    rings = [RingBuffer(cap) for _ in range(n_sym)]
+    for ring, h in zip(rings, history):
+        ring.extend(h[:, :cap])                       # 開市前：整段下載填滿
+    print(f"{n_sym} symbols × {cap} bars: {rings[0].nbytes / 1024:.1f} KB/symbol, "
+          f"{n_sym * rings[0].nbytes / 2 ** 20:.1f} MB total")
+
+    # 增量：每分鐘每檔收到「最後一根（覆寫）+ 新的一根」
+    t = time.perf_counter()
+    for m in range(minutes):
+        for ring, h in zip(rings, history):
+            ring.extend(h[:, cap + m - 1:cap + m + 1])
+    ring_s = time.perf_counter() - t
+
+    # 對照：每次抓整段再接起來，只留最後 cap 根
+    arrays = [h[:, :cap].copy() for h in history]
+    t = time.perf_counter()
+    for m in range(minutes):
+        for i, h in enumerate(history):
+            arrays[i] = np.concatenate([arrays[i][:, :-1], h[:, cap + m - 1:cap + m + 1]], axis=1)[:, -cap:]
+    concat_s = time.perf_counter() - t
+
+    updates = minutes * n_sym
+    print(f"{'update':>12} {'µs/bar':>8}")
+    print(f"{'ring':>12} {1e6 * ring_s / updates:8.2f}")
+    print(f"{'concatenate':>12} {1e6 * concat_s / updates:8.2f}")
+
+    for ring, arr in zip(rings, arrays):
+        assert np.array_equal(ring.view(), arr), "ring buffer content differs"
+
+    # 指標：每檔直接把 view 的 close / volume 列交給 recommend_batch（不複製）
+    t = time.perf_counter()
+    for r in rings:
+        v = r.view()
+        recommend_batch(v[4:5], v[5:6], mode=args.mode)
+    per_view = time.perf_counter() - t
+    # 先複製成 (n_symbols, n) 矩陣再一次算（IntradayCache.recommend 的做法）
+    t = time.perf_counter()
+    recommend_batch(np.stack([r.view()[4] for r in rings]), np.stack([r.view()[5] for r in rings]), mode=args.mode)
+    stacked = time.perf_counter() - t
+    print(f"recommend {n_sym} symbols: on views {1000 * per_view:.1f} ms, "
+          f"stacked copy {1000 * stacked:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# bench/load.py
+"""
+離線壓測：對 app.main:app 重放 Cloud API / Twilio webhook，量吞吐量與延遲。
+
+    python -m bench.load                                   # 預設 400 則、並發 20
+    python -m bench.load -n 1000 -c 50 --md-latency 0.3    # 行情上游慢一點
+    python -m bench.load --save bench/load_baseline.json   # 存成基準
+    python -m bench.load --compare bench/load_baseline.json  # 與基準比較（p95 / req/s 變差超過容忍度就失敗）
+    python -m bench.load --payloads recorded.jsonl         # 重放錄下來的 payload
+
+- Graph API 用 bench.fake_graph.FakeGraphAPI；行情 / 名稱用 FixtureMarket（假 K 線 + 注入延遲），
+  整個流程不碰網路。
+- Twilio 是同步回覆：延遲 = HTTP 往返。Cloud API 只回 ack：另外量「收到 webhook → 假 Graph 收到回覆」。
+- 外送限速預設關掉（--out-rate 0），量的是處理管線本身；限速行為另見 bench.outbound。
+- 錄下的 payload 檔每行一個 {"route": "wa" | "twilio", "body": {...}}（wa 為 JSON、twilio 為表單欄位）。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from bench.fake_graph import FakeGraphAPI
+from bench.synthetic import make_frame
+
+PHONE_ID = "100000000000001"
+DEFAULT_MIX = "query=0.7,ping=0.1,help=0.05,twilio=0.15"
+
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def _summary(samples):
+    return {"n": len(samples),
+            "p50_ms": round(1000 * _pct(samples, 0.50), 2),
+            "p95_ms": round(1000 * _pct(samples, 0.95), 2),
+            "p99_ms": round(1000 * _pct(samples, 0.99), 2),
+            "max_ms": round(1000 * max(samples), 2) if samples else 0.0}
+
+
+# ---------- 假行情（取代 yf.download / Yahoo quote） ----------
+class FixtureMarket:
+    """每檔固定 seed 的假日 K；fetch / names 與 HistoryCache / NameResolver 的介面相同。"""
+
+    def __init__(self, latency=0.2, names_latency=0.05, days=400, per_symbol=0.0):
+        """per_symbol: 每檔再加的延遲（秒）；模擬 yf.download 一次下載越多檔越久。"""
+        self.latency = latency
+        self.per_symbol = per_symbol
+        self.names_latency = names_latency
+        self.days = days
+        self._frames = {}
+        self._lock = threading.Lock()
+        self.download_calls = 0
+        self.download_symbols = 0
+        self.names_calls = 0
+
+    def _frame(self, sym):
+        df = self._frames.get(sym)
+        if df is None:
+            seed = sum(ord(c) * 31 ** i for i, c in enumerate(sym)) % (2 ** 32)
+            df = self._frames[sym] = make_frame(self.days, seed=seed)
+        return df
+
+    def fetch(self, symbols, period=None, start=None, timeout=None):
+        with self._lock:
+            self.download_calls += 1
+            self.download_symbols += len(symbols)
+        delay = self.latency + self.per_symbol * len(symbols)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fixture download took longer than {timeout:.2f}s")
+        if delay:
+            time.sleep(delay)
+        out = {}
+        for sym in symbols:
+            df = self._frame(sym)
+            if start is not None:
+                df = df[df.index >= start]
+            elif period:
+                df = df.iloc[-int(str(period).rstrip("d")):]
+            out[sym] = df.copy()
+        return out
+
+    def names(self, symbols, timeout=None):
+        with self._lock:
+            self.names_calls += 1
+        if self.names_latency:
+            time.sleep(self.names_latency)
+        return {}   # 都走內建名稱表 / 代碼本身
+
+    def stats(self):
+        return {"download_calls": self.download_calls, "download_symbols": self.download_symbols,
+                "names_calls": self.names_calls}
+
+
+# ---------- payload ----------
+def _wa_payload(mid, sender, text):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": PHONE_ID},
+        "messages": [{"id": mid, "from": sender, "type": "text", "text": {"body": text}}],
+    }}]}]}
+
+
+def synthetic_payloads(n, mix, universe, max_symbols=3, seed=0):
+    """依比例產生 (route, kind, body)。"""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    out = []
+    for i in range(n):
+        kind = rng.choices(kinds, weights)[0]
+        codes = " ".join(s.split(".")[0] for s in rng.sample(universe, rng.randint(1, max_symbols)))
+        mode = rng.choice(("short", "swing", "position"))
+        if kind == "twilio":
+            out.append(("twilio", kind, {"From": "whatsapp:+85290000000", "Body": f"{codes} mode={mode}"}))
+        else:
+            text = {"ping": "ping", "help": "help"}.get(kind, f"{codes} mode={mode}")
+            out.append(("wa", kind, _wa_payload(f"wamid.load{i}", f"8529{i:07d}", text)))
+    return out
+
+
+def recorded_payloads(path, n):
+    """讀錄下的 payload；不夠 n 則時循環重放（message ID / 寄件人加序號避免被去重）。"""
+    with open(path, encoding="utf-8") as fh:
+        rows = [json.loads(line) for line in fh if line.strip()]
+    out = []
+    for i, row in zip(range(n), itertools.cycle(rows)):
+        body = json.loads(json.dumps(row["body"]))
+        if row["route"] == "wa":
+            for entry in body.get("entry") or []:
+                for change in entry.get("changes") or []:
+                    value = change.get("value") or {}
+                    value.setdefault("metadata", {})["phone_number_id"] = PHONE_ID
+                    for msg in value.get("messages") or []:
+                        msg["id"] = f"{msg.get('id', 'wamid')}.{i}"
+                        msg["from"] = f"8529{i:07d}"
+        out.append((row["route"], "recorded", body))
+    return out
+
+
+# ---------- 執行 ----------
+async def _drive(app, payloads, concurrency, first_reply, reply_timeout):
+    import httpx
+
+    acks, twilio, e2e_start = [], [], {}
+    codes = {}
+    it = iter(enumerate(payloads))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker():
+            for i, (route, kind, body) in it:
+                t = time.perf_counter()
+                if route == "wa":
+                    for entry in body.get("entry") or []:
+                        for change in entry.get("changes") or []:
+                            for msg in (change.get("value") or {}).get("messages") or []:
+                                e2e_start[msg["from"]] = t
+                    r = await client.post("/wa-webhook", json=body)
+                    acks.append(time.perf_counter() - t)
+                else:
+                    r = await client.post("/whatsapp", data=body)
+                    twilio.append(time.perf_counter() - t)
+                codes[r.status_code] = codes.get(r.status_code, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        sent_at = time.perf_counter()
+        # 等 Cloud API 的回覆都送到假 Graph
+        while set(e2e_start) - set(first_reply) and time.perf_counter() - sent_at < reply_timeout:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - t0
+
+    e2e = [first_reply[k] - t for k, t in e2e_start.items() if k in first_reply]
+    return {"elapsed_s": round(elapsed, 3), "http_status": codes, "acks": acks, "twilio": twilio,
+            "e2e": e2e, "unanswered": len(set(e2e_start) - set(first_reply))}
+
+
+def run(args):
+    # app 讀的設定都在 import 時決定，所以先設環境變數再 import
+    tmp = tempfile.mkdtemp(prefix="hkbot-load-")
+    os.environ.setdefault("HKBOT_DATA_DIR", tmp)
+    os.environ["DEDUPE_FILE"] = ""
+    os.environ["WA_PHONE_NUMBER_ID"] = PHONE_ID
+    os.environ.setdefault("WA_TOKEN", "bench")
+    os.environ["PRECOMPUTE_ENABLED"] = "1" if args.precompute else "0"
+    os.environ["OUT_RATE_GLOBAL"] = os.environ["OUT_RATE_PER_PHONE"] = str(args.out_rate)
+
+    first_reply = {}
+
+    def on_call(path, payload):
+        to = (payload or {}).get("to")
+        if to and to not in first_reply:
+            first_reply[to] = time.perf_counter()
+
+    with FakeGraphAPI(latency=args.graph_latency, fail_rate=args.graph_fail_rate,
+                      retry_after=0, on_call=on_call) as graph:
+        os.environ["WA_API_BASE"] = graph.url
+        from hkbot import cloud, logic
+        from hkbot.names import load_bundled
+        import app.main as main
+
+        cloud.WA_API = graph.url
+        market = FixtureMarket(latency=args.md_latency, names_latency=args.names_latency)
+        logic._history._fetch = market.fetch
+        logic._names._fetch = market.names
+        logic._precomputed.download = market.fetch
+
+        universe = sorted(load_bundled())[:args.universe]
+        if args.payloads:
+            payloads = recorded_payloads(args.payloads, args.requests)
+        else:
+            mix = {k: float(v) for k, v in (kv.split("=") for kv in args.mix.split(","))}
+            payloads = synthetic_payloads(args.requests, mix, universe, args.max_symbols, args.seed)
+
+        async def go():
+            async with main.app.router.lifespan_context(main.app):
+                res = await _drive(main.app, payloads, args.concurrency, first_reply, args.reply_timeout)
+                res["app_stats"] = main.jobs.stats(), main.outbound.stats(), logic.cache_stats()
+            return res
+
+        res = asyncio.run(go())
+        graph_calls, graph_errors = len(graph.calls), graph.errors
+
+    jobs_stats, out_stats, caches = res["app_stats"]
+    n = len(payloads)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance", "min_ms")},
+        "requests": n,
+        "elapsed_s": res["elapsed_s"],
+        "req_per_s": round(n / res["elapsed_s"], 1) if res["elapsed_s"] else 0.0,
+        "http_status": res["http_status"],
+        "latency": {
+            "wa_ack": _summary(res["acks"]),
+            "wa_reply": _summary(res["e2e"]),
+            "twilio": _summary(res["twilio"]),
+        },
+        "unanswered": res["unanswered"],
+        "upstream": {
+            **market.stats(),
+            "graph_calls": graph_calls,
+            "graph_injected_errors": graph_errors,
+            "history_fetches": caches["history"].get("fetches"),
+            "history_coalesced": caches["history"].get("coalesced"),
+            "summary_hit_rate": caches["summary"].get("hit_rate"),
+        },
+        "jobs": {"max_depth": jobs_stats["max_depth"], "failed": jobs_stats["failed"],
+                 "rejected": jobs_stats["rejected"]},
+        "outbound": {"retried": out_stats["retried"], "failed": out_stats["failed"],
+                     "throttled_s": out_stats["throttled_s"]},
+    }
+
+
+def compare(result, baseline, tolerance, min_ms=5.0, min_calls=3):
+    """
+    p95 比基準慢超過 tolerance（比例）且多出 min_ms 以上、req/s 掉超過 tolerance、
+    或上游呼叫次數多出 tolerance 且多出 min_calls 次以上，就回傳問題清單。
+    絕對門檻是為了雜訊：wa_ack 的 p95 只有 ~1 ms，每次跑 ±0.5 ms 就是 ±50%。
+    """
+    problems = []
+    for key, cur in result["latency"].items():
+        old = baseline.get("latency", {}).get(key)
+        if not old or not cur["n"] or not old["n"]:
+            continue
+        if cur["p95_ms"] > old["p95_ms"] * (1 + tolerance) and cur["p95_ms"] - old["p95_ms"] > min_ms:
+            problems.append(f"{key} p95 {old['p95_ms']} -> {cur['p95_ms']} ms")
+    if result["req_per_s"] < baseline.get("req_per_s", 0) * (1 - tolerance):
+        problems.append(f"req/s {baseline['req_per_s']} -> {result['req_per_s']}")
+    for key in ("download_calls", "names_calls"):
+        old, cur = baseline.get("upstream", {}).get(key), result["upstream"].get(key)
+        if old is not None and cur > old * (1 + tolerance) and cur - old >= min_calls:
+            problems.append(f"{key} {old} -> {cur}")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--requests", type=int, default=400)
+    ap.add_argument("-c", "--concurrency", type=int, default=20)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="query/ping/help/twilio 比例")
+    ap.add_argument("--payloads", help="錄下的 payload（jsonl）")
+    ap.add_argument("--universe", type=int, default=30, help="從內建名稱表取幾檔當查詢範圍")
+    ap.add_argument("--max-symbols", type=int, default=3)
+    ap.add_argument("--md-latency", type=float, default=0.2, help="假 yf.download 每次延遲（秒）")
+    ap.add_argument("--names-latency", type=float, default=0.05)
+    ap.add_argument("--graph-latency", type=float, default=0.02)
+    ap.add_argument("--graph-fail-rate", type=float, default=0.0)
+    ap.add_argument("--out-rate", type=float, default=0, help="外送限速（每秒；0 = 不限，只量處理管線）")
+    ap.add_argument("--precompute", action="store_true", help="開啟收市後全市場預先計算（查表命中）")
+    ap.add_argument("--reply-timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--save", help="結果寫成基準 JSON")
+    ap.add_argument("--compare", help="與基準 JSON 比較")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="比基準差多少比例算退步")
+    ap.add_argument("--min-ms", type=float, default=5.0, help="p95 至少要慢這麼多 ms 才算退步（雜訊門檻）")
+    args = ap.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, ensure_ascii=False, indent=2)
+            fh.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            problems = compare(result, json.load(fh), args.tolerance, min_ms=args.min_ms)
+        for p in problems:
+            print("REGRESSION:", p, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench/outbound.py
+"""
+外送排程器對假 Graph API（注入 429 與延遲）：確認全部送達、快速回覆先走、限速有效。
+
+    python -m bench.outbound [--bulk 60] [--quick 10] [--fail-rate 0.3] [--latency 0.03] [--rate 40]
+"""
+import argparse
+import asyncio
+import time
+
+from bench.fake_graph import FakeGraphAPI
+from hkbot import cloud
+from hkbot.outbound import OutboundScheduler, PRIORITY_BULK, PRIORITY_QUICK
+
+
+async def run(args, fake):
+    cloud.WA_API = fake.url
+    sched = OutboundScheduler(workers=args.workers, global_rate=args.rate, per_phone_rate=args.rate,
+                              backoff_base=0.05, backoff_max=0.5)
+    await sched.start()
+    t0 = time.perf_counter()
+    done_at = {}
+
+    async def one(kind, i, prio):
+        await sched.send(cloud.asend_text, f"8520000{i:04d}", f"{kind} {i}", priority=prio)
+        done_at[(kind, i)] = time.perf_counter() - t0
+
+    tasks = [one("bulk", i, PRIORITY_BULK) for i in range(args.bulk)]
+    tasks += [one("quick", i, PRIORITY_QUICK) for i in range(args.quick)]   # 後排入，但應先完成
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    stats = sched.stats()
+    await sched.stop()
+    await cloud.aclose()
+
+    failed = [r for r in results if isinstance(r, Exception)]
+    avg = lambda k: sum(v for (kk, _), v in done_at.items() if kk == k) / max(1, sum(1 for kk, _ in done_at if kk == k))
+    print(f"delivered {len(fake.calls)}/{args.bulk + args.quick} in {elapsed:.2f}s | injected errors {fake.errors} "
+          f"| failed {len(failed)}")
+    print(f"avg completion: quick {avg('quick') * 1000:.0f} ms, bulk {avg('bulk') * 1000:.0f} ms")
+    print(stats)
+    assert not failed and len(fake.calls) == args.bulk + args.quick
+    assert avg("quick") < avg("bulk"), "quick lane should finish first"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bulk", type=int, default=60)
+    ap.add_argument("--quick", type=int, default=10)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rate", type=float, default=40)
+    ap.add_argument("--fail-rate", type=float, default=0.3)
+    ap.add_argument("--latency", type=float, default=0.03)
+    args = ap.parse_args()
+    with FakeGraphAPI(latency=args.latency, fail_rate=args.fail_rate, retry_after=0) as fake:
+        asyncio.run(run(args, fake))
+
+
+if __name__ == "__main__":
+    main()
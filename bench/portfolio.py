@@ -0,0 +1,70 @@
+# bench/portfolio.py
+"""
+組合查詢（30 ~ 100 檔）端到端延遲：一次整批下載 vs 分批序列 vs 分批平行，再加上快取命中。
+
+    python -m bench.portfolio [--symbols 100] [--md-latency 0.3] [--per-symbol 0.02] [--budget 5]
+
+行情用 bench.load.FixtureMarket（固定延遲 + 每檔延遲，模擬 yf.download 檔數越多越慢），
+每個情境都用全新的 HistoryCache（冷快取）；最後一列是同一批再查一次（熱快取）。
+分批平行的冷查詢超過 --budget 秒即失敗。
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.load import FixtureMarket
+from hkbot import portfolio
+from hkbot.history import HistoryCache
+from hkbot.names import load_bundled
+
+
+def _run(market, symbols, days, chunk, parallel, cache=None):
+    cache = cache or HistoryCache(market.fetch, maxsize=len(symbols) * 2)
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        t0 = time.perf_counter()
+        ranked = portfolio.rank(lambda s, days: cache.get(s, days=days), symbols, days=days,
+                                chunk=chunk, pool=pool)
+        text = portfolio.format_page(ranked, {}, header="bench")
+        elapsed = time.perf_counter() - t0
+    return cache, ranked, text, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=100)
+    ap.add_argument("--days", type=int, default=120)
+    ap.add_argument("--md-latency", type=float, default=0.3)
+    ap.add_argument("--per-symbol", type=float, default=0.02)
+    ap.add_argument("--chunk", type=int, default=portfolio.PORTFOLIO_CHUNK)
+    ap.add_argument("--parallel", type=int, default=portfolio.PORTFOLIO_PARALLEL)
+    ap.add_argument("--budget", type=float, default=5.0)
+    args = ap.parse_args()
+
+    known = sorted(load_bundled())[:args.symbols]
+    symbols = known + [f"{8000 + i}.HK" for i in range(args.symbols - len(known))]
+    scenarios = [
+        ("one download", len(symbols), 1),
+        ("chunked serial", args.chunk, 1),
+        ("chunked parallel", args.chunk, args.parallel),
+    ]
+    print(f"{len(symbols)} symbols, md latency {args.md_latency}s + {args.per_symbol}s/symbol")
+    print(f"{'scenario':>18} {'ms':>9} {'downloads':>10} {'ranked':>7} {'pages':>6}")
+    results = {}
+    for name, chunk, parallel in scenarios:
+        market = FixtureMarket(latency=args.md_latency, per_symbol=args.per_symbol, names_latency=0)
+        cache, ranked, text, elapsed = _run(market, symbols, args.days, chunk, parallel)
+        results[name] = elapsed
+        pages = text.splitlines()[0].rsplit("/", 1)[-1]
+        print(f"{name:>18} {1000 * elapsed:9.1f} {market.download_calls:10d} {len(ranked.rows):7d} {pages:>6}")
+        assert not ranked.late and not ranked.missing, (ranked.late, ranked.missing)
+
+    before = market.download_calls
+    _, ranked, _, elapsed = _run(market, symbols, args.days, args.chunk, args.parallel, cache=cache)
+    print(f"{'warm cache':>18} {1000 * elapsed:9.1f} {market.download_calls - before:10d} {len(ranked.rows):7d}")
+
+    assert results["chunked parallel"] <= args.budget, \
+        f"cold {len(symbols)}-symbol query took {results['chunked parallel']:.2f}s > budget {args.budget}s"
+
+
+if __name__ == "__main__":
+    main()
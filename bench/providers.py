@@ -0,0 +1,79 @@
+# bench/providers.py
+"""
+行情來源 Router：hedge 對尾端延遲的效果、來源故障時 circuit breaker 的快速失敗。
+
+    python -m bench.providers [--calls 400] [--tail 0.05] [--slow 2.0]
+
+兩個假來源（不碰網路）：平常 20~60 ms，有 --tail 比例的請求慢到 --slow 秒。
+1) 只用主要來源 vs 主要 + 備援（hedge），比較 p50 / p95 / p99；
+2) 主要來源整個掛掉（每次等 --slow 秒後出錯）：斷路前後每次呼叫的耗時。
+"""
+import argparse
+import random
+import time
+
+from hkbot.providers import PROVIDER_MIN_SAMPLES, Router
+
+
+class FakeProvider:
+    def __init__(self, name, tail, slow, seed, down=False):
+        self.name = name
+        self.tail = tail
+        self.slow = slow
+        self.down = down
+        self._rng = random.Random(seed)
+
+    def download(self, symbols, period=None, start=None, timeout=None, interval="1d"):
+        if self.down:
+            time.sleep(self.slow)
+            raise ConnectionError(f"{self.name} down")
+        time.sleep(self.slow if self._rng.random() < self.tail else self._rng.uniform(0.02, 0.06))
+        return {s: self.name for s in symbols}
+
+    def names(self, symbols, timeout=None):
+        return {s: s for s in symbols}
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+
+def _run(router, calls):
+    lat = []
+    for _ in range(calls):
+        t = time.perf_counter()
+        try:
+            router.download(["0700.HK"])
+        except Exception:
+            pass
+        lat.append(time.perf_counter() - t)
+    return lat
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=400)
+    ap.add_argument("--tail", type=float, default=0.05)
+    ap.add_argument("--slow", type=float, default=2.0)
+    args = ap.parse_args()
+
+    print(f"{'':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'hedges':>7}")
+    for label, hedge in (("primary", False), ("hedged", True)):
+        router = Router([FakeProvider("a", args.tail, args.slow, 1), FakeProvider("b", args.tail, args.slow, 2)],
+                        hedge=hedge)
+        _run(router, PROVIDER_MIN_SAMPLES)          # 暖身：累積足夠延遲樣本後 hedge 才用百分位
+        lat = _run(router, args.calls)
+        print(f"{label:>10} {1000 * _pct(lat, 0.5):8.1f} {1000 * _pct(lat, 0.95):8.1f} "
+              f"{1000 * _pct(lat, 0.99):8.1f} {router.hedges:7d}")
+
+    # 主要來源掛掉：前 PROVIDER_CB_FAILURES 次要等它出錯才換備援，斷路後直接問備援
+    router = Router([FakeProvider("a", 0, args.slow, 1, down=True), FakeProvider("b", 0, args.slow, 2)])
+    lat = _run(router, 20)
+    st = router.stats()["providers"]["a"]
+    print(f"primary down: first call {1000 * lat[0]:.0f} ms, last call {1000 * lat[-1]:.0f} ms, "
+          f"state={st['state']} errors={st['errors']} fast_fails={st['fast_fails']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench/shared.py
+"""
+多 worker 共用快取：N 個 process 同時查同一批代碼，比較有 / 沒有 HKBOT_SHARED_CACHE 時的上游下載次數。
+
+    python -m bench.shared [--workers 4] [--symbols 20] [--md-latency 0.3]
+
+每個 process 代表一個 uvicorn worker（各自的記憶體快取），行情用 bench.load.FixtureMarket。
+開啟共享快取時預期：同時起跑的 worker 之間，每檔 K 線 / 名稱只有一個 worker 向上游問；
+最後再起一個晚到的 worker，它應該完全不用下載、不用問名稱、不用重算摘要。
+"""
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+
+def _worker(i, env, symbols, md_latency, barrier, out):
+    os.environ.update(env)
+    os.environ["HKBOT_DATA_DIR"] = tempfile.mkdtemp(prefix=f"hkbot-w{i}-")
+    from bench.load import FixtureMarket
+    from hkbot import logic
+
+    market = FixtureMarket(latency=md_latency, names_latency=md_latency / 3)
+    logic._history._fetch = market.fetch
+    logic._names._fetch = market.names
+    barrier.wait()
+    t0 = time.perf_counter()
+    for mode in ("short", "swing", "position"):
+        for k in range(0, len(symbols), 5):
+            logic.build_whatsapp_summary(symbols[k:k + 5], days=120, mode=mode)
+    elapsed = time.perf_counter() - t0
+    st = logic.cache_stats()
+    out.put({"worker": i, "elapsed_s": round(elapsed, 3), **market.stats(),
+             "history_fetches": st["history"]["fetches"], "store_hits": st["history"]["store_hits"],
+             "summary_rendered": st["summary"]["misses"] - st["summary"]["shared_hits"], "names_shared_hits": st["names"].get("shared_hits", 0)})
+
+
+def run(workers, symbols, md_latency, shared, late=True):
+    shared_file = os.path.join(tempfile.mkdtemp(prefix="hkbot-shared-"), "shared.db")
+    env = {"HKBOT_SHARED_CACHE": "1" if shared else "0", "HKBOT_SHARED_CACHE_FILE": shared_file,
+           "HKBOT_BAR_STORE": "0", "PRECOMPUTE_ENABLED": "0", "DEDUPE_FILE": ""}
+    ctx = mp.get_context("spawn")
+    barrier, out = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(i, env, symbols, md_latency, barrier, out)) for i in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [out.get(timeout=120) for _ in procs]
+    for p in procs:
+        p.join()
+    rows.sort(key=lambda r: r["worker"])
+    if late:
+        # 晚一點才起來的 worker（例如 autoscale）：共享時應該什麼都不用抓、不用算
+        alone = ctx.Barrier(1)     # 要留著參照：子 process 反序列化前就被回收會找不到 semaphore
+        p = ctx.Process(target=_worker, args=(workers, env, symbols, md_latency, alone, out))
+        p.start()
+        rows.append(dict(out.get(timeout=120), late=True))
+        p.join()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--symbols", type=int, default=20)
+    ap.add_argument("--md-latency", type=float, default=0.3)
+    args = ap.parse_args()
+
+    from hkbot.names import load_bundled
+    # 一半用內建名稱表沒有的代碼，名稱才需要向上游查
+    known = sorted(load_bundled())
+    symbols = known[:args.symbols // 2] + [f"{8000 + i}.HK" for i in range(args.symbols - args.symbols // 2)]
+    for shared in (False, True):
+        rows = run(args.workers, symbols, args.md_latency, shared)
+        total = lambda k: sum(r[k] for r in rows)
+        print(f"shared={shared!s:5s} downloads={total('download_calls')} symbols_downloaded={total('download_symbols')} "
+              f"name_calls={total('names_calls')} summaries_rendered={total('summary_rendered')} "
+              f"slowest_worker={max(r['elapsed_s'] for r in rows):.2f}s")
+        for r in rows:
+            print("   ", r)
+        if shared:
+            assert total("download_symbols") == len(symbols), "each symbol should be downloaded once"
+            last = rows[-1]
+            assert last["download_calls"] == last["names_calls"] == last["summary_rendered"] == 0, last
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# bench/signals.py
+"""
+向量化 AI 建議 vs 逐檔 ai_recommendation：先對照結果，再量時間。
+
+    python -m bench.signals [--days 250] [--sizes 5,100,2500]
+"""
+import argparse
+import time
+
+from bench.synthetic import make_frames
+from hkbot.logic import ai_recommendation
+from hkbot.signals import recommend_frames, MODE_PARAMS
+
+
+def check_parity(frames):
+    bad = 0
+    for mode in MODE_PARAMS:
+        batch = recommend_frames(frames, mode=mode)
+        for sym, df in frames.items():
+            ref = ai_recommendation(df, mode=mode)
+            got = batch[sym]
+            if (ref["label"], ref["reason"]) != (got["label"], got["reason"]):
+                bad += 1
+                print(f"MISMATCH {sym} {mode}: {ref} != {got}")
+    return bad
+
+
+def _time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=250)
+    ap.add_argument("--sizes", default="5,100,2500")
+    ap.add_argument("--mode", default="swing")
+    args = ap.parse_args()
+
+    bad = check_parity(make_frames(200, days=args.days, ragged=True))
+    print(f"parity: {'OK' if not bad else f'{bad} mismatches'} (200 symbols × {len(MODE_PARAMS)} modes)")
+
+    print(f"{'symbols':>8} {'per-symbol ms':>14} {'batch ms':>10} {'speedup':>8}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        frames = make_frames(n, days=args.days)
+        repeat = 3 if n <= 100 else 1
+        loop = _time(lambda: [ai_recommendation(df, mode=args.mode) for df in frames.values()], repeat)
+        batch = _time(lambda: recommend_frames(frames, mode=args.mode), repeat)
+        print(f"{n:>8} {loop * 1000:>14.1f} {batch * 1000:>10.1f} {loop / batch:>7.1f}×")
+    if bad:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# bench/startup.py
+"""
+啟動成本：import 時間、/health 可用時間、/ready 時間、第一個回覆的時間（每個情境都開新的 process）。
+
+    python -m bench.startup [--repeat 3] [--md-latency 0.2]
+
+情境：
+- eager : 先 import hkbot.logic 再 import app.main（延遲載入之前 app.main 的成本）
+- lazy  : WARMUP_ENABLED=0，第一個代碼查詢才載入 pandas / yfinance
+- warm  : WARMUP_ENABLED=1 + WARMUP_WATCHLIST，等 /ready 後再查詢（查的代碼在 watchlist 內）
+行情用 bench.load.FixtureMarket（假 K 線 + 注入延遲），不碰網路。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+QUERY = "0700 9988 mode=swing"
+WATCHLIST = "0700,9988,0005,1299,0388"
+
+
+def _child(scenario, md_latency):
+    t0 = time.perf_counter()
+    if scenario == "eager":
+        import hkbot.logic  # noqa: F401
+        import app.main  # noqa: F401
+        print(json.dumps({"import_ms": round(1000 * (time.perf_counter() - t0), 1)}))
+        return
+
+    import asyncio
+    import app.main as main
+    t_import = time.perf_counter() - t0
+    heavy = [m for m in ("pandas", "yfinance", "numpy") if m in sys.modules]
+
+    import httpx
+    from hkbot import warmup
+
+    market = None
+
+    def patch(logic):
+        nonlocal market
+        from bench.load import FixtureMarket   # 會載入 pandas：等分析模組載入時才 import
+        market = FixtureMarket(latency=md_latency, names_latency=0)
+        logic._history._fetch = market.fetch
+        logic._names._fetch = market.names
+
+    warmup.on_load(patch)
+
+    async def go():
+        out = {"import_ms": round(1000 * t_import, 1), "heavy_loaded_at_import": heavy}
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+                r = await c.get("/health")
+                out["health_ms"] = round(1000 * (time.perf_counter() - t0), 1)
+                assert r.status_code == 200
+                while (await c.get("/ready")).status_code != 200:
+                    await asyncio.sleep(0.005)
+                out["ready_ms"] = round(1000 * (time.perf_counter() - t0), 1)
+                t1 = time.perf_counter()
+                r = await c.post("/whatsapp", data={"Body": QUERY})
+                assert r.status_code == 200 and "0700.HK" in r.text, r.text[:200]
+                out["first_reply_ms"] = round(1000 * (time.perf_counter() - t1), 1)
+                out["first_reply_since_start_ms"] = round(1000 * (time.perf_counter() - t0), 1)
+                out["upstream"] = market.stats()
+        return out
+
+    print(json.dumps(asyncio.run(go())))
+
+
+def _spawn(scenario, md_latency):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), HKBOT_DATA_DIR=tempfile.mkdtemp(prefix="hkbot-start-"),
+               DEDUPE_FILE="", HKBOT_BAR_STORE="0", PRECOMPUTE_ENABLED="0",
+               WARMUP_ENABLED="1" if scenario == "warm" else "0",
+               WARMUP_WATCHLIST=WATCHLIST if scenario == "warm" else "")
+    out = subprocess.run([sys.executable, "-m", "bench.startup", "--child", scenario, "--md-latency", str(md_latency)],
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--child")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--md-latency", type=float, default=0.2)
+    args = ap.parse_args()
+    if args.child:
+        _child(args.child, args.md_latency)
+        return
+
+    for scenario in ("eager", "lazy", "warm"):
+        runs = [_spawn(scenario, args.md_latency) for _ in range(args.repeat)]
+        keys = [k for k, v in runs[0].items() if isinstance(v, (int, float))]
+        med = {k: statistics.median(r[k] for r in runs) for k in keys}
+        extra = {k: v for k, v in runs[-1].items() if k not in keys}
+        print(f"{scenario:6s}", "  ".join(f"{k}={v:.0f}" for k, v in med.items()), extra or "")
+
+
+if __name__ == "__main__":
+    main()
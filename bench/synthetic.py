@@ -0,0 +1,33 @@
+# bench/synthetic.py
+"""壓測 / 對照用的假 K 線（隨機漫步，固定 seed 可重現）。"""
+import numpy as np
+import pandas as pd
+
+
+def make_symbols(n):
+    return [f"{i:04d}.HK" for i in range(1, n + 1)]
+
+
+def make_frame(days=250, seed=0, end=None):
+    rng = np.random.default_rng(seed)
+    idx = pd.bdate_range(end=end or pd.Timestamp.today().normalize(), periods=days)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+    spread = np.abs(rng.normal(0, 0.01, days)) * close
+    df = pd.DataFrame({
+        "Open": close * (1 + rng.normal(0, 0.005, days)),
+        "High": close + spread,
+        "Low": close - spread,
+        "Close": close,
+        "Volume": rng.lognormal(14, 0.5, days).round(),
+    }, index=idx)
+    df.index.name = "Date"
+    return df
+
+
+def make_frames(n, days=250, seed=0, ragged=False):
+    """n 檔；ragged=True 時各檔長度不同（測右對齊）。"""
+    out = {}
+    for i, sym in enumerate(make_symbols(n)):
+        k = days - (i * 7) % (days // 2) if ragged else days
+        out[sym] = make_frame(k, seed=seed + i)
+    return out
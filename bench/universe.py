@@ -0,0 +1,85 @@
+# bench/universe.py
+"""
+代碼總表索引：全市場規模（預設 2600 檔）下的建表時間與每次查詢的耗時（µs）。
+
+    python -m bench.universe [--symbols 2600] [--n 200000]
+
+總表用內附名稱表（或 UNIVERSE_FILE）+ 隨機中 / 英文名稱補到指定檔數（寫到暫存 CSV），不碰網路。
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from hkbot.universe import UNIVERSE_FILE, Universe
+
+_ZH = "中國香港海洋能源科技控股集團銀行地產國際發展實業電力醫藥健康汽車資源石油保險證券物流建設環保數據網絡"
+_EN = ["alpha", "pacific", "dragon", "harbour", "golden", "orient", "summit", "jade", "lotus", "phoenix"]
+
+
+def make_universe(n, path, seed=0):
+    rng = random.Random(seed)
+    with open(UNIVERSE_FILE, encoding="utf-8") as fh:
+        rows = list(csv.DictReader(fh))
+    used = {int(r["code"]) for r in rows}
+    code = 1
+    while len(rows) < n:
+        code += 1
+        if code in used:
+            continue
+        zh = "".join(rng.choice(_ZH) for _ in range(rng.randint(2, 6)))
+        en = " ".join(rng.choice(_EN) for _ in range(rng.randint(1, 3))).title()
+        rows.append({"code": f"{code:04d}", "name_zh": zh, "name_en": en, "aliases": ""})
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        w = csv.DictWriter(fh, fieldnames=["code", "name_zh", "name_en", "aliases"], lineterminator="\n")
+        w.writeheader()
+        w.writerows({k: r.get(k, "") for k in w.fieldnames} for r in rows)
+
+
+def _us(fn, args, n):
+    t = time.perf_counter()
+    for i in range(n):
+        fn(args[i % len(args)])
+    return 1e6 * (time.perf_counter() - t) / n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=2600)
+    ap.add_argument("--n", type=int, default=200000)
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="hkbot-universe-"), "universe.csv")
+    make_universe(args.symbols, path)
+    t = time.perf_counter()
+    u = Universe(path, strict="1", check_every=3600)
+    print(f"load: {1000 * (time.perf_counter() - t):.1f} ms  {u.stats()}")
+
+    listed = list(u.names)
+    unlisted = [f"{c:04d}.HK" for c in range(1, 100000, 37) if f"{c:04d}.HK" not in u.names][:1000]
+    cases = [
+        ("is_listed (listed)", u.is_listed, listed),
+        ("is_listed (unlisted)", u.is_listed, unlisted),
+        ("search zh", u.search, ["騰訊", "阿里", "滙豐", "中國", "銀行", "海洋能源"]),
+        ("search en", u.search, ["tencent", "hsbc", "alibaba", "golden", "pacific dragon"]),
+        ("match_run", u.match_run, ["騰訊阿里小米", "騰訊和阿里巴巴", "美團", "香港天氣"]),
+        ("match_phrase", u.match_phrase, ["check tencent and hsbc holdings", "power assets", "I want", "great power"]),
+    ]
+    print(f"{'lookup':>22} {'µs/op':>8}")
+    worst = 0.0
+    for name, fn, inputs in cases:
+        us = _us(fn, inputs, args.n)
+        worst = max(worst, us)
+        print(f"{name:>22} {us:8.2f}")
+    assert u.search("騰訊")[0] == "0700.HK" and u.search("阿里")[0] == "9988.HK"
+    # 一般聊天不當成名稱
+    assert not u.match_run("香港天氣") and not u.match_run("恒生指數") and not u.match_phrase("new user here")
+    assert u.match_run("騰訊和阿里") == ["0700.HK", "9988.HK"]
+    assert not u.is_listed("0004.HK") or "0004.HK" in u.names
+    assert worst < 50, f"slowest lookup {worst:.1f} µs"
+
+
+if __name__ == "__main__":
+    main()
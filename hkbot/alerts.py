@@ -0,0 +1,405 @@
+# hkbot/alerts.py
+"""
+到價 / 訊號提醒：使用者訂閱一次，由背景 watcher 定期檢查，觸發時主動推播（一次性）。
+
+    alert 0700 > 400                  # 價格高於 400（>= 400：到 400 就觸發）
+    alert 0700 < 350                  # 價格低於 350（<= 350 同理）
+    alert 9988 signal=買入 [mode=short] # AI 建議「變成」買入（buy / sell / hold 亦可）
+    alert / alert list                # 列出自己的提醒
+    alert del 3 / alert clear         # 刪除一則 / 全部
+
+- 存放：一個 JSON 檔 {user: [[id, symbol, op, value, mode(, seen)], ...]}
+  （op 為 ">" / ">=" / "<" / "<=" / "sig"），寫入走暫存檔 + os.replace；多 worker 共用同一個檔，改過就重讀。
+- 訊號規則只在建議「轉變」成目標時觸發：seen 記上一次看到的建議（訂閱時的建議；不知道就由
+  第一輪檢查記下，不觸發），之後建議從別的變成目標才通知。
+- 索引：每檔每種 op 一個依門檻排序的陣列，另記「不會觸發」的價格區間
+  （最高的低於門檻 ~ 最低的高於門檻）。一輪檢查大部分檔只比兩次；落在區間外（或剛好在邊界）才 bisect，
+  觸發的就是排序陣列的一段前綴 / 後綴（> 與 >= 用 bisect_left / bisect_right 區分），
+  幾千條規則也不用逐條掃；訊號規則用 (symbol, mode) 直接查 dict。
+- watcher 每 ALERT_INTERVAL 秒（盤中；收市後再補一輪收市價）把所有有提醒的檔一次整批抓，
+  觸發的提醒合併成每人一則，經 hkbot.cloud.send_text 送出；送出失敗的提醒掛回去，下一輪再試。
+
+不依賴 pandas / numpy：app 啟動時就能載入；報價 / 訊號由 hkbot.logic.alert_quotes 提供。
+"""
+import asyncio
+import bisect
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from hkbot.config import data_path
+from hkbot.metrics import SHARED_ERRORS
+
+log = logging.getLogger("uvicorn.error")
+
+ALERT_FILE = os.getenv("ALERT_FILE", data_path("alerts.json"))
+ALERT_MAX_PER_USER = int(os.getenv("ALERT_MAX_PER_USER", "20"))
+ALERT_INTERVAL = float(os.getenv("ALERT_INTERVAL", "60"))          # 秒：盤中每輪間隔
+ALERT_ENABLED = os.getenv("ALERT_ENABLED", "1") == "1"
+
+_CMD = re.compile(r"^\s*(?:alert|alerts|提醒)(?=\s|$)", re.I)
+_PRICE = re.compile(r"^(?P<target>.+?)\s*(?P<op>>=|<=|>|<|＞|＜|高於|低於)\s*(?P<value>\d+(?:\.\d+)?)\s*$")
+_SIGNAL = re.compile(r"signal\s*=\s*(\S+)", re.I)
+_DELETE = re.compile(r"^(?:del|delete|rm|刪除)\s*#?(\d+)\s*$", re.I)
+_MODE = re.compile(r"mode\s*=\s*(short|swing|position)", re.I)
+_OPS = {">": ">", ">=": ">=", "＞": ">", "高於": ">", "<": "<", "<=": "<=", "＜": "<", "低於": "<"}
+_OP_TEXT = {">": "高於", ">=": "高於或等於", "<": "低於", "<=": "低於或等於"}
+# op -> (觸發的是前綴?, 切點)：「高於 t」是 t < price → 前綴到 bisect_left；「>= t」是 t <= price → bisect_right；
+# 「低於 t」是 t > price → 從 bisect_right 起的後綴；「<= t」是 t >= price → 從 bisect_left 起
+_CUT = {">": (True, bisect.bisect_left), ">=": (True, bisect.bisect_right),
+        "<": (False, bisect.bisect_right), "<=": (False, bisect.bisect_left)}
+_LABELS = {"buy": "買入", "買入": "買入", "买入": "買入", "sell": "賣出", "賣出": "賣出", "卖出": "賣出",
+           "hold": "持有", "持有": "持有"}
+
+
+def parse_alert(txt: str):
+    """
+    「alert 0700 > 400」→ ("add", {"target": "0700", "op": ">", "value": 400.0, "mode": None})；
+    「alert 9988 signal=買入」→ ("add", {"target": "9988", "op": "sig", "value": "買入", "mode": "swing"})；
+    「alert」/「alert list」→ ("list", None)；「alert del 3」→ ("del", 3)；「alert clear」→ ("clear", None)；
+    格式不對 → ("help", None)。不是提醒指令回 None。target 交給 parse_codes_from_text。
+    """
+    m = _CMD.match(txt)
+    if not m:
+        return None
+    rest = txt[m.end():].strip()
+    low = rest.lower()
+    if low in ("", "list", "ls", "清單"):
+        return "list", None
+    if low in ("clear", "清除"):
+        return "clear", None
+    d = _DELETE.match(rest)
+    if d:
+        return "del", int(d.group(1))
+    s = _SIGNAL.search(rest)
+    if s:
+        label = _LABELS.get(s.group(1).lower())
+        if not label:
+            return "help", None
+        mode = _MODE.search(rest)
+        target = _MODE.sub(" ", _SIGNAL.sub(" ", rest)).strip()
+        return "add", {"target": target, "op": "sig", "value": label,
+                       "mode": mode.group(1).lower() if mode else "swing"}
+    p = _PRICE.match(rest)
+    if p:
+        return "add", {"target": p.group("target"), "op": _OPS[p.group("op")],
+                       "value": float(p.group("value")), "mode": None}
+    return "help", None
+
+
+def describe(rule):
+    rid, sym, op, value, mode = rule[:5]
+    if op == "sig":
+        return f"#{rid} {sym} AI 建議變成「{value}」（{mode}）"
+    return f"#{rid} {sym} 價格 {_OP_TEXT[op]} {value:g}"
+
+
+class _Thresholds:
+    """單一檔的價格規則：每種 op 一組已排序的門檻 t[op]，k[op][i] 為對應的 (user, id)。"""
+    __slots__ = ("t", "k")
+
+    def __init__(self, groups):
+        self.t, self.k = {}, {}
+        for op, items in groups.items():
+            if items:
+                items.sort()
+                self.t[op], self.k[op] = [t for t, _ in items], [k for _, k in items]
+
+    def quiet_band(self):
+        """價格在 (lo, hi) 之間（不含端點）就一定沒有觸發。"""
+        lo = max((self.t[op][-1] for op in ("<", "<=") if op in self.t), default=float("-inf"))
+        hi = min((self.t[op][0] for op in (">", ">=") if op in self.t), default=float("inf"))
+        return lo, hi
+
+    def without(self, keys):
+        """去掉 keys 之後的新索引；全部去掉回 None。"""
+        groups = {op: [(t, k) for t, k in zip(ts, self.k[op]) if k not in keys] for op, ts in self.t.items()}
+        return _Thresholds(groups) if any(groups.values()) else None
+
+    def fired(self, price):
+        keys = []
+        for op, ts in self.t.items():
+            prefix, cut = _CUT[op]
+            i = cut(ts, price)
+            keys += self.k[op][:i] if prefix else self.k[op][i:]
+        return keys
+
+
+class Alerts:
+    def __init__(self, path=ALERT_FILE, max_per_user=ALERT_MAX_PER_USER):
+        self.path = path or None
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._rules = {}          # user -> [[id, symbol, op, value, mode], ...]
+        self._mtime = None
+        self._index = None        # {symbol: _Thresholds}；規則有變就作廢，下次檢查時重建
+        self._bands = {}          # {symbol: (lo, hi)}：價格在區間內就跳過（大部分檔每輪只比兩次）
+        self._signals = {}        # {(symbol, mode): [(user, rule), ...]}；rule 是 _rules 裡的同一個 list
+        self.fired = 0
+        self.cycles = 0
+
+    # ---------- 存取 ----------
+    def _reload(self):
+        """檔案被別的 worker 改過就重讀。"""
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                self._rules = json.load(fh)
+            self._mtime = mtime
+            self._index = None
+        except (OSError, ValueError) as e:
+            log.warning("alerts load failed: %r", e)
+
+    def _save(self, reindex=True):
+        if reindex:
+            self._index = None
+        if not self.path:
+            return
+        try:
+            d = os.path.dirname(self.path) or "."
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-alerts-")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(self._rules, fh, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            log.warning("alerts save failed: %r", e)
+
+    def add(self, user, symbol, op, value, mode=None, seen=None):
+        """
+        新增一則；回傳規則，已達上限回 None。相同的規則不重複加。
+        seen：訊號規則訂閱時的 AI 建議（之後要「變成」value 才觸發）；None 表示由第一輪檢查記下。
+        """
+        user = str(user)
+        with self._lock:
+            self._reload()
+            rules = self._rules.setdefault(user, [])
+            for r in rules:
+                if r[1:5] == [symbol, op, value, mode]:
+                    return r
+            if len(rules) >= self.max_per_user:
+                return None
+            rule = [max((r[0] for r in rules), default=0) + 1, symbol, op, value, mode]
+            if op == "sig":
+                rule.append(seen)
+            rules.append(rule)
+            self._save()
+            return rule
+
+    def restore(self, user, rules):
+        """把已移除（觸發但沒送出）的規則掛回去；id 已被新規則佔用就換一個新 id。"""
+        user = str(user)
+        with self._lock:
+            self._reload()
+            current = self._rules.setdefault(user, [])
+            for rule in rules:
+                if any(r[1:5] == rule[1:5] for r in current):
+                    continue
+                if any(r[0] == rule[0] for r in current):
+                    rule = [max(r[0] for r in current) + 1] + list(rule[1:])
+                current.append(list(rule))
+            self._save()
+
+    def list(self, user):
+        with self._lock:
+            self._reload()
+            return [list(r) for r in self._rules.get(str(user)) or []]
+
+    def delete(self, user, rid):
+        with self._lock:
+            self._reload()
+            rules = self._rules.get(str(user)) or []
+            kept = [r for r in rules if r[0] != rid]
+            if len(kept) == len(rules):
+                return False
+            if kept:
+                self._rules[str(user)] = kept
+            else:
+                self._rules.pop(str(user), None)
+            self._save()
+            return True
+
+    def clear(self, user):
+        with self._lock:
+            self._reload()
+            existed = self._rules.pop(str(user), None) is not None
+            if existed:
+                self._save()
+        return existed
+
+    # ---------- 索引 / 檢查 ----------
+    def _build(self):
+        per, signals = {}, {}
+        for user, rules in self._rules.items():
+            for rule in rules:
+                rid, sym, op, value, mode = rule[:5]
+                if op == "sig":
+                    if len(rule) == 5:           # 舊格式：沒有 seen
+                        rule.append(None)
+                    signals.setdefault((sym, mode), []).append((user, rule))
+                    continue
+                per.setdefault(sym, {}).setdefault(op, []).append((value, (user, rid)))
+        self._index = {sym: _Thresholds(groups) for sym, groups in per.items()}
+        self._bands = {sym: rules.quiet_band() for sym, rules in self._index.items()}
+        self._signals = signals
+        return self._index
+
+    def watched(self):
+        """這一輪要抓的東西：(所有有提醒的 symbol, {mode: [有訊號提醒的 symbol]})。"""
+        with self._lock:
+            self._reload()
+            index = self._index if self._index is not None else self._build()
+            modes = {}
+            for sym, mode in self._signals:
+                modes.setdefault(mode, set()).add(sym)
+        symbols = set(index).union(*modes.values())
+        return sorted(symbols), {m: sorted(s) for m, s in modes.items()}
+
+    def evaluate(self, prices, labels):
+        """
+        prices: {symbol: 最新價}；labels: {(symbol, mode): AI 建議}。
+        觸發的規則從表中移除（一次性）；回傳 {user: [(rule, price), ...]}。
+        訊號規則：建議和 seen 不同且等於目標才觸發；其餘只更新 seen。
+        """
+        with self._lock:
+            self._reload()
+            index = self._index if self._index is not None else self._build()
+            bands, signals, hits, dirty = self._bands, self._signals, {}, False
+            for sym, price in prices.items():
+                band = bands.get(sym)
+                if band is None or band[0] < price < band[1]:
+                    continue
+                for user, rid in index[sym].fired(price):
+                    hits.setdefault(user, {})[rid] = price
+            for (sym, mode), label in labels.items():
+                for user, rule in signals.get((sym, mode), ()):
+                    if rule[5] == label:
+                        continue
+                    if rule[5] is not None and label == rule[3]:
+                        # 觸發的規則保留原本的 seen：送出失敗掛回去時下一輪照樣觸發
+                        if sym in prices:
+                            hits.setdefault(user, {})[rule[0]] = prices[sym]
+                        continue
+                    rule[5] = label
+                    dirty = True
+            if not hits:
+                if dirty:
+                    self._save(reindex=False)
+                return {}
+            out = {}
+            for user, fired in hits.items():
+                rules = self._rules.get(user) or []
+                out[user] = [(r, fired[r[0]]) for r in rules if r[0] in fired]
+                kept = [r for r in rules if r[0] not in fired]
+                if kept:
+                    self._rules[user] = kept
+                else:
+                    self._rules.pop(user, None)
+            self._unindex(out)
+            self._save(reindex=False)
+            self.fired += sum(len(v) for v in out.values())
+            return out
+
+    def _unindex(self, fired):
+        """觸發的規則只從受影響的檔移除；整個索引重建（和釋放舊索引）在幾萬條規則時要好幾 ms。"""
+        gone = {}
+        for user, rules in fired.items():
+            for rule, _ in rules:
+                rid, sym, op, value, mode = rule[:5]
+                if op != "sig":
+                    gone.setdefault(sym, set()).add((user, rid))
+                    continue
+                keys = [k for k in self._signals.get((sym, mode), ()) if k[1] is not rule]
+                if keys:
+                    self._signals[(sym, mode)] = keys
+                else:
+                    self._signals.pop((sym, mode), None)
+        for sym, keys in gone.items():
+            rules = self._index[sym].without(keys)
+            if rules is None:
+                self._index.pop(sym)
+                self._bands.pop(sym)
+            else:
+                self._index[sym] = rules
+                self._bands[sym] = rules.quiet_band()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._rules), "rules": sum(len(v) for v in self._rules.values()),
+                    "fired": self.fired, "cycles": self.cycles}
+
+
+def alert_text(fired):
+    lines = ["🔔 提醒觸發："]
+    for rule, price in fired:
+        lines.append(f"• {describe(rule)}｜現價 {price:g}")
+    lines.append("（提醒只會通知一次；輸入 alert 查看其餘提醒）")
+    return "\n".join(lines)
+
+
+def run_cycle(alerts, quotes, send):
+    """
+    一輪檢查（阻塞）：quotes(symbols, modes) → (prices, labels)，一次整批抓；
+    觸發的提醒每人合併成一則，send(user, text) 送出；送出失敗就把規則掛回去。回傳送出的人數。
+    """
+    symbols, modes = alerts.watched()
+    alerts.cycles += 1
+    if not symbols:
+        return 0
+    prices, labels = quotes(symbols, modes)
+    sent = 0
+    for user, fired in alerts.evaluate(prices, labels).items():
+        try:
+            send(user, alert_text(fired))
+            sent += 1
+        except Exception as e:
+            log.warning("alert send failed to %s, re-armed %d: %r", user, len(fired), e)
+            alerts.restore(user, [rule for rule, _ in fired])
+    return sent
+
+
+async def watcher(alerts, quotes, send, locks=None, interval=ALERT_INTERVAL, run_blocking=None):
+    """
+    app 背景 task：盤中每 interval 秒一輪，收市後再跑一輪（用收市價）。
+    locks: 選用的 hkbot.shared.SharedCache；多 worker 時每輪只有一個 worker 檢查。
+    """
+    from hkbot.history import hk_now, is_market_open, last_close
+    run_blocking = run_blocking or asyncio.to_thread
+    checked_close = None
+    while True:
+        now = hk_now()
+        close = last_close(now)
+        if is_market_open(now) or checked_close != close:
+            got = ["alerts"]
+            if locks is not None:
+                # SharedCache 是 sqlite（可能等 busy timeout），不在 event loop 上跑；出錯就跳過這一輪
+                try:
+                    _, got = await asyncio.to_thread(locks.acquire, ["alerts"], ttl=interval)
+                except Exception as e:
+                    log.warning("shared lock acquire failed: %r", e)
+                    SHARED_ERRORS.inc(op="lock_acquire")
+                    got = []
+            if got:
+                t0 = time.monotonic()
+                try:
+                    sent = await run_blocking(run_cycle, alerts, quotes, send)
+                    if sent:
+                        log.info("alerts: notified %d users in %.2fs", sent, time.monotonic() - t0)
+                except Exception as e:
+                    log.exception("alert cycle failed: %r", e)
+                # 不 release：鎖留到 ttl 到期，其他 worker 這一輪就不會重跑
+            if not is_market_open(now):
+                checked_close = close
+        await asyncio.sleep(interval)
@@ -0,0 +1,419 @@
+# hkbot/backtest.py
+"""
+AI 建議回測：把 ai_recommendation 的規則（EMA / RSI / 量能 / 區間位置）套到每一個歷史交易日，
+看訊號之後的 N 日報酬。
+
+    python -m hkbot.backtest run                       # 用磁碟 K 線庫裡所有的檔（離線）
+    python -m hkbot.backtest run --fetch-years 5       # 先把全市場 5 年日 K 抓進 K 線庫再回測
+    python -m hkbot.backtest show 9988 --mode swing
+
+- 每天的訊號與即時查詢相同：只看最近 window 根 K 線（預設 days=120 → 約 82 根），
+  EMA / RSI 都從視窗第一根起算。視窗 EMA 用「全歷史遞迴和 S_t 減掉視窗外的部分」一次算出所有日子，
+  不用每天重算：y_t = b^(W-1)·x_s + a·(S_t − b^(W-1)·S_s)，s = t − W + 1。
+- 一批股票排成右對齊矩陣（與 hkbot.signals 相同），整批向量化；多批分給 process pool。
+- 每個模式輸出：各標籤（買入 / 持有 / 賣出）的次數、未來報酬平均與勝率、命中率
+  （買入後漲 + 賣出後跌 / 買賣訊號數）、換手（每 250 個交易日標籤變動幾次）。
+- 結果存成 BACKTEST_FILE（JSON），聊天指令「backtest 9988 mode=swing」直接讀；
+  表內沒有的檔用 K 線庫現有的資料即時算（只放記憶體，以 K 線根數 + 最後一天為鍵，庫變長就重算，不寫回檔案）。
+  K 線少於 window + 該模式的 horizon 根時沒有任何一天能算報酬，回「歷史不足」（即時查詢只存約 82 根）。
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from hkbot.config import data_path
+from hkbot.signals import MODE_PARAMS, VOL_WINDOW, mode_params
+from hkbot.store import BAR_STORE_DIR, BarStore
+
+log = logging.getLogger("uvicorn.error")
+
+BACKTEST_FILE = os.getenv("BACKTEST_FILE", data_path("backtest.json"))
+BACKTEST_DAYS = int(os.getenv("BACKTEST_DAYS", "120"))            # 與一般查詢預設 days 相同（日曆日）
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(os.cpu_count() or 2)))
+BACKTEST_CHUNK = int(os.getenv("BACKTEST_CHUNK", "50"))           # 每個 process 一次算幾檔
+HORIZONS = {"short": 5, "swing": 20, "position": 60}              # 各模式看幾個交易日後的報酬
+
+MODES = tuple(MODE_PARAMS)
+LABELS = ("賣出", "持有", "買入")     # 標籤索引：0 / 1 / 2（與 hkbot.precompute 相同）
+
+
+def window_bars(days):
+    """days 個日曆日大約有幾根日 K（一年約 250 個交易日）。"""
+    return max(20, int(round(max(days, 60) * 250 / 365)))
+
+
+def min_bars(mode, days=BACKTEST_DAYS):
+    """至少要幾根日 K 才有一天同時有完整視窗與 horizon 天後的報酬。"""
+    return window_bars(days) + HORIZONS[mode]
+
+
+# ---------- 向量化：所有交易日的視窗指標 ----------
+def _ewm_sums(x, alpha):
+    """S_t = b·S_{t-1} + x_t（逐列，沿時間軸；NaN 當 0）。"""
+    b = 1.0 - alpha
+    x = np.nan_to_num(x)
+    s = np.empty_like(x)
+    acc = np.zeros(x.shape[0])
+    for t in range(x.shape[1]):
+        acc = b * acc + x[:, t]
+        s[:, t] = acc
+    return s
+
+
+def windowed_ewm(x, alpha, w):
+    """
+    每個 t 的 ewm(alpha, adjust=False) 只看 x[t-w+1 .. t] 的最後值（第一根為初值）。
+    回傳 shape 同 x；前 w-1 欄為 NaN。
+    """
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] < w:
+        return out
+    a, b = alpha, 1.0 - alpha
+    s = _ewm_sums(x, alpha)
+    bw = b ** (w - 1)
+    start = x[:, :x.shape[1] - w + 1]
+    out[:, w - 1:] = bw * start + a * (s[:, w - 1:] - bw * s[:, :x.shape[1] - w + 1])
+    return out
+
+
+def windowed_rsi(close, period, w):
+    """每個 t 的 hkbot.logic._rsi(close[t-w+1 .. t]) 最後值。"""
+    delta = np.diff(close, axis=1)
+    up = np.maximum(delta, 0.0)
+    down = -np.minimum(delta, 0.0)
+    # 視窗內的 delta 有 w-1 個（第一根 K 線沒有 delta）
+    ru = np.maximum(windowed_ewm(up, 1.0 / period, w - 1), 0.0)
+    rd = windowed_ewm(down, 1.0 / period, w - 1)
+    rd = np.where(rd <= 1e-12, 1e-9, rd)
+    rsi = 100 - 100 / (1 + ru / rd)
+    return np.concatenate([np.full((close.shape[0], 1), np.nan), rsi], axis=1)
+
+
+def _rolling(x, w, fn):
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] >= w:
+        out[:, w - 1:] = fn(np.lib.stride_tricks.sliding_window_view(x, w, axis=1), axis=-1)
+    return out
+
+
+def score_matrix(price, ema_f, ema_s, rsi, vol, voln, hi, lo):
+    """hkbot.signals.score_signals 的矩陣版（只算分數）。"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        score = np.where((price > ema_f) & (ema_f > ema_s), 2, np.where((price < ema_f) & (ema_f < ema_s), -2, 0))
+        score = score + np.where(rsi < 35, 1, np.where(rsi > 65, -1, 0))
+        ratio = vol / np.maximum(1.0, voln)
+        has_vol = voln > 0
+        score = score + np.where(has_vol & (ratio >= 1.5), 1, np.where(has_vol & (ratio <= 0.7), -1, 0))
+        pos = (price - lo) / (hi - lo + 1e-9)
+        score = score + np.where(pos >= 0.85, -1, np.where(pos <= 0.15, 1, 0))
+    return score
+
+
+def signal_matrix(close, volume, mode="swing", days=BACKTEST_DAYS):
+    """
+    close / volume: 右對齊 (n_symbols, n_days)。
+    回傳 (labels, valid)：labels 為 0 賣出 / 1 持有 / 2 買入；valid 為該日視窗是否完整。
+    """
+    ema_fast, ema_slow, rsi_p, _, min_rows = mode_params(mode)
+    w = window_bars(days)
+    n, T = close.shape
+    first = np.argmax(~np.isnan(close), axis=1)
+    valid = (np.arange(T)[None, :] - w + 1 >= first[:, None]) & ~np.isnan(close)
+    if w < min_rows:
+        valid[:] = False    # 與即時查詢相同：資料不足就只給「持有」，回測不計
+    ema_f = windowed_ewm(close, 2.0 / (ema_fast + 1), w)
+    ema_s = windowed_ewm(close, 2.0 / (ema_slow + 1), w)
+    rsi = windowed_rsi(close, rsi_p, w)
+    voln = _rolling(volume, VOL_WINDOW, np.mean)
+    hi = _rolling(close, w, np.max)
+    lo = _rolling(close, w, np.min)
+    score = score_matrix(close, ema_f, ema_s, rsi, volume, voln, hi, lo)
+    labels = np.where(score >= 2, 2, np.where(score <= -2, 0, 1))
+    return labels, valid
+
+
+# ---------- 統計 ----------
+def _empty():
+    return {"n": [0, 0, 0], "ret": [0.0, 0.0, 0.0], "win": [0, 0, 0], "hits": 0, "changes": 0, "days": 0}
+
+
+def _accumulate(acc, labels, valid, fwd):
+    """把一列（或整個矩陣）的結果加進 acc（都是加總，可跨批次合併）。"""
+    ok = valid & ~np.isnan(fwd)
+    for k in range(3):
+        m = ok & (labels == k)
+        acc["n"][k] += int(m.sum())
+        acc["ret"][k] += float(fwd[m].sum())
+        acc["win"][k] += int((fwd[m] > 0).sum())
+    acc["hits"] += int((ok & (labels == 2) & (fwd > 0)).sum() + (ok & (labels == 0) & (fwd < 0)).sum())
+    both = valid[..., 1:] & valid[..., :-1]
+    acc["changes"] += int((both & (labels[..., 1:] != labels[..., :-1])).sum())
+    acc["days"] += int(valid.sum())
+    return acc
+
+
+def merge(a, b):
+    for k in ("n", "ret", "win"):
+        a[k] = [x + y for x, y in zip(a[k], b[k])]
+    for k in ("hits", "changes", "days"):
+        a[k] += b[k]
+    return a
+
+
+def summarize(acc, horizon):
+    """加總 → 可讀的報表（報酬為 %）。"""
+    signals = acc["n"][0] + acc["n"][2]
+    out = {"horizon": horizon, "days": acc["days"],
+           "hit_rate": round(100.0 * acc["hits"] / signals, 2) if signals else None,
+           "turnover": round(250.0 * acc["changes"] / acc["days"], 2) if acc["days"] else None,
+           "labels": {}}
+    for k, name in enumerate(LABELS):
+        n = acc["n"][k]
+        out["labels"][name] = {"n": n,
+                               "avg_ret": round(100.0 * acc["ret"][k] / n, 3) if n else None,
+                               "win_rate": round(100.0 * acc["win"][k] / n, 2) if n else None}
+    return out
+
+
+def backtest_arrays(symbols, close, volume, modes=MODES, days=BACKTEST_DAYS):
+    """一批（右對齊矩陣）→ ({mode: 加總}, {symbol: {mode: 加總}})。"""
+    totals, per = {}, {s: {} for s in symbols}
+    for mode in modes:
+        h = HORIZONS[mode]
+        labels, valid = signal_matrix(close, volume, mode=mode, days=days)
+        fwd = np.full(close.shape, np.nan)
+        if close.shape[1] > h:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                fwd[:, :-h] = close[:, h:] / close[:, :-h] - 1.0
+        totals[mode] = _accumulate(_empty(), labels, valid, fwd)
+        for i, sym in enumerate(symbols):
+            per[sym][mode] = _accumulate(_empty(), labels[i], valid[i], fwd[i])
+    return totals, per
+
+
+def _stack_arrays(arrays):
+    """[(6, N) 陣列] → 右對齊的 close / volume 矩陣。"""
+    T = max((a.shape[1] for a in arrays), default=0)
+    close = np.full((len(arrays), T), np.nan)
+    volume = np.full((len(arrays), T), np.nan)
+    for i, a in enumerate(arrays):
+        k = a.shape[1]
+        if k:
+            close[i, T - k:] = a[4]
+            volume[i, T - k:] = a[5]
+    return close, volume
+
+
+def _span(arr):
+    d = arr[0].astype(np.int64).astype("datetime64[D]")
+    return str(d[0]), str(d[-1])
+
+
+def _run_chunk(root, symbols, modes, days):
+    """process pool 的工作：從 K 線庫讀這批（memory-map），算完只回傳加總。"""
+    store = BarStore(root)
+    arrays, syms, spans = [], [], {}
+    for sym in symbols:
+        arr = store.read_array(sym)
+        if arr is None or arr.shape[1] == 0:
+            continue
+        arrays.append(np.asarray(arr))
+        syms.append(sym)
+        spans[sym] = _span(arr)
+    if not syms:
+        return {}, {}, {}
+    close, volume = _stack_arrays(arrays)
+    totals, per = backtest_arrays(syms, close, volume, modes=modes, days=days)
+    return totals, per, spans
+
+
+def run(symbols=None, root=BAR_STORE_DIR, modes=MODES, days=BACKTEST_DAYS, workers=BACKTEST_WORKERS,
+        chunk=BACKTEST_CHUNK):
+    """整批回測（離線，只讀 K 線庫）；回傳可存成 BACKTEST_FILE 的 dict。"""
+    t0 = time.perf_counter()
+    symbols = list(symbols) if symbols is not None else BarStore(root).symbols()
+    chunks = [symbols[i:i + chunk] for i in range(0, len(symbols), chunk)]
+    totals = {m: _empty() for m in modes}
+    per, spans = {}, {}
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_chunk, [root] * len(chunks), chunks,
+                                    [modes] * len(chunks), [days] * len(chunks)))
+    else:
+        results = [_run_chunk(root, c, modes, days) for c in chunks]
+    for t, p, s in results:
+        for m, acc in t.items():
+            merge(totals[m], acc)
+        per.update(p)
+        spans.update(s)
+    return {
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "days": days, "window": window_bars(days), "horizons": {m: HORIZONS[m] for m in modes},
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+        "modes": {m: summarize(totals[m], HORIZONS[m]) for m in modes},
+        "symbols": {s: {"from": spans[s][0], "to": spans[s][1],
+                        **{m: summarize(acc, HORIZONS[m]) for m, acc in per[s].items()}} for s in per},
+    }
+
+
+# ---------- 結果快取（聊天指令讀這裡） ----------
+class Results:
+    """BACKTEST_FILE 的記憶體副本；檔案更新（CLI 重跑）時自動重讀。"""
+
+    def __init__(self, path=BACKTEST_FILE, store=None, days=BACKTEST_DAYS):
+        self.path = path
+        self.store = store        # BarStore / SharedBarStore：表內沒有的檔用它即時算
+        self.days = days
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.data = {"modes": {}, "symbols": {}}
+        self.on_demand = 0
+        self._computed = {}       # sym -> ((根數, 最後一天), 結果)：即時算的結果，不寫回 BACKTEST_FILE
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                self.data = json.load(fh)
+            self._mtime = mtime
+        except (OSError, ValueError) as e:
+            log.warning("backtest results load failed: %r", e)
+
+    def save(self, data=None):
+        with self._lock:
+            if data is not None:
+                self.data = data
+            d = os.path.dirname(self.path) or "."
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-backtest-")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(self.data, fh, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+
+    def get(self, sym):
+        """
+        回傳該檔的結果；表內沒有就用 K 線庫即時算；都沒有回 None。
+        即時算的結果只含 K 線夠長（min_bars）的模式，另帶 "bars"（根數）讓呼叫端說明歷史不足。
+        """
+        with self._lock:
+            self._reload()
+            got = self.data.get("symbols", {}).get(sym)
+        if got is not None or self.store is None:
+            return got
+        try:
+            loaded = self.store.load(sym)
+        except Exception as e:
+            log.warning("backtest bar read failed %s: %r", sym, e)
+            return None
+        if loaded is None:
+            return None
+        df = loaded[0]
+        if df.empty:
+            return None
+        key = (len(df), df.index[-1])
+        with self._lock:
+            memo = self._computed.get(sym)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+        got = {"from": str(df.index[0].date()), "to": str(df.index[-1].date()), "bars": len(df)}
+        modes = [m for m in MODES if len(df) >= min_bars(m, self.days)]
+        if modes:
+            close = df["Close"].to_numpy(dtype=np.float64)[None, :]
+            volume = df["Volume"].to_numpy(dtype=np.float64)[None, :]
+            _, per = backtest_arrays([sym], close, volume, modes=modes, days=self.days)
+            got.update({m: summarize(acc, HORIZONS[m]) for m, acc in per[sym].items()})
+            self.on_demand += 1
+        with self._lock:
+            self._computed[sym] = (key, got)
+        return got
+
+    def overall(self, mode):
+        with self._lock:
+            self._reload()
+            return self.data.get("modes", {}).get(mode)
+
+    def stats(self):
+        return {"symbols": len(self.data.get("symbols", {})), "built_at": self.data.get("built_at"),
+                "on_demand": self.on_demand, "computed": len(self._computed)}
+
+
+def format_result(sym, name, res, mode, overall=None, mode_name=""):
+    """聊天用的精簡報表。"""
+    r = res[mode]
+    lines = [f"🧪 回測 {sym} {name}｜模式：{mode_name or mode}｜{res['from']} ~ {res['to']}",
+             f"訊號後 {r['horizon']} 個交易日的報酬："]
+    for label in ("買入", "持有", "賣出"):
+        s = r["labels"][label]
+        if s["n"]:
+            lines.append(f"• {label}：{s['n']} 天｜平均 {s['avg_ret']:+.2f}%｜上漲比率 {s['win_rate']:.1f}%")
+        else:
+            lines.append(f"• {label}：0 天")
+    hit = f"{r['hit_rate']:.1f}%" if r["hit_rate"] is not None else "---"
+    turn = f"{r['turnover']:.1f}" if r["turnover"] is not None else "---"
+    lines.append(f"命中率 {hit}｜換手 {turn} 次 / 年")
+    if overall and overall.get("hit_rate") is not None:
+        lines.append(f"（全市場同模式：命中率 {overall['hit_rate']:.1f}%，換手 {overall['turnover']:.1f} 次 / 年）")
+    return "\n".join(lines)
+
+
+def fill_store(symbols, years, root=BAR_STORE_DIR, chunk=100):
+    """把多年日 K 抓進 K 線庫（需要網路；之後的回測都離線）。"""
+    from hkbot.logic import _download
+    store = BarStore(root)
+    for i in range(0, len(symbols), chunk):
+        part = symbols[i:i + chunk]
+        try:
+            got = _download(part, period=f"{int(years * 365)}d")
+        except Exception as e:
+            log.warning("backtest fill failed (%d symbols): %r", len(part), e)
+            continue
+        for sym, df in got.items():
+            store.append(sym, df, since=df.index[0])
+        print(f"filled {min(i + chunk, len(symbols))}/{len(symbols)}")
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m hkbot.backtest")
+    ap.add_argument("--root", default=BAR_STORE_DIR)
+    ap.add_argument("--out", default=BACKTEST_FILE)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("symbols", nargs="*")
+    r.add_argument("--days", type=int, default=BACKTEST_DAYS)
+    r.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    r.add_argument("--fetch-years", type=float, default=0)
+    s = sub.add_parser("show")
+    s.add_argument("symbol")
+    s.add_argument("--mode", default="swing", choices=MODES)
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        symbols = args.symbols or None
+        if args.fetch_years:
+            from hkbot.precompute import load_universe
+            fill_store(symbols or load_universe(), args.fetch_years, root=args.root)
+        res = run(symbols, root=args.root, days=args.days, workers=args.workers)
+        Results(args.out).save(res)
+        print(json.dumps({"elapsed_s": res["elapsed_s"], "symbols": len(res["symbols"]), "modes": res["modes"]},
+                         ensure_ascii=False, indent=2))
+    else:
+        results = Results(args.out, store=BarStore(args.root))
+        got = results.get(args.symbol)
+        print(format_result(args.symbol, "", got, args.mode, results.overall(args.mode)) if got else "no result")
+
+
+if __name__ == "__main__":
+    main()
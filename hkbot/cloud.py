@@ -1,36 +1,126 @@
 # hkbot/cloud.py
 import os
 import requests
+import httpx
 
-WA_API = "https://graph.facebook.com/v20.0"
+WA_API = os.getenv("WA_API_BASE", "https://graph.facebook.com/v20.0")  # 本機測試可指向假的 Graph API
 
 PHONE_ID = os.getenv("WA_PHONE_NUMBER_ID")  # e.g. 8480475...
 TOKEN    = os.getenv("WA_TOKEN")            # Access Token（先用短期，建議改永久）
 HEADERS  = {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"}
 
-def _post_json(path: str, payload: dict):
+# ---- 連線池設定（同步 / 非同步共用）----
+WA_TIMEOUT      = float(os.getenv("WA_TIMEOUT", "10"))         # 單次呼叫逾時（秒）
+WA_POOL_MAX     = int(os.getenv("WA_POOL_MAX", "20"))          # 最多同時連線數
+WA_POOL_KEEP    = int(os.getenv("WA_POOL_KEEPALIVE", "10"))    # 保留的 keep-alive 連線數
+WA_KEEP_EXPIRY  = float(os.getenv("WA_KEEPALIVE_EXPIRY", "60"))
+WA_HTTP2        = os.getenv("WA_HTTP2", "0") == "1"            # 需要 pip install h2
+WA_TEXT_MAX     = int(os.getenv("WA_TEXT_MAX", "3500"))        # 單則文字上限（官方 4096，留點餘裕）
+
+
+class GraphAPIError(requests.HTTPError):
+    """Graph API 回 4xx/5xx；帶 status_code 讓呼叫端判斷要不要重試。"""
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _error_from(status_code, reason, url, text, headers):
+    ra = headers.get("Retry-After") if headers else None
+    try:
+        ra = float(ra) if ra is not None else None
+    except ValueError:
+        ra = None
+    return GraphAPIError(f"{status_code} {reason}: {url} | {text}", status_code=status_code, retry_after=ra)
+
+# ---------- 同步版（requests.Session 重用連線） ----------
+_session = None
+
+def _get_session():
+    global _session
+    if _session is None:
+        s = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=WA_POOL_MAX)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        s.headers.update(HEADERS)
+        _session = s
+    return _session
+
+def _post_json(path: str, payload: dict, timeout: float = None):
     """統一送出 & 在 4xx/5xx 印出 Graph API 錯誤 body，便於除錯。"""
     url = f"{WA_API}/{PHONE_ID}{path}"
-    r = requests.post(url, json=payload, headers=HEADERS, timeout=10)
+    r = _get_session().post(url, json=payload, timeout=timeout or WA_TIMEOUT)
     if r.status_code >= 400:
         # 回傳更清楚的錯誤訊息（包含 Graph API 的 JSON 內容）
-        raise requests.HTTPError(f"{r.status_code} {r.reason}: {url} | {r.text}")
+        raise _error_from(r.status_code, r.reason, url, r.text, r.headers)
     return r.json()
 
-def send_text(to: str, text: str):
-    data = {
+# ---------- 非同步版（httpx.AsyncClient：keep-alive + 連線池，可選 HTTP/2） ----------
+_aclient = None
+
+def _get_aclient():
+    global _aclient
+    if _aclient is None or _aclient.is_closed:
+        _aclient = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=WA_TIMEOUT,
+            http2=WA_HTTP2,
+            limits=httpx.Limits(max_connections=WA_POOL_MAX,
+                                max_keepalive_connections=WA_POOL_KEEP,
+                                keepalive_expiry=WA_KEEP_EXPIRY),
+        )
+    return _aclient
+
+async def aclose():
+    """關閉非同步連線池（app shutdown 時呼叫）。"""
+    global _aclient
+    if _aclient is not None:
+        await _aclient.aclose()
+        _aclient = None
+
+async def _apost_json(path: str, payload: dict, timeout: float = None, phone_id: str = None):
+    url = f"{WA_API}/{phone_id or PHONE_ID}{path}"
+    r = await _get_aclient().post(url, json=payload, timeout=timeout or WA_TIMEOUT)
+    if r.status_code >= 400:
+        raise _error_from(r.status_code, r.reason_phrase, url, r.text, r.headers)
+    return r.json()
+
+# ---------- 長訊息分段 ----------
+def split_text(text: str, limit: int = WA_TEXT_MAX):
+    """
+    依行切成多則（每則 <= limit 字），不截斷；單行本身超長時才在行內硬切。
+    """
+    chunks, cur, size = [], [], 0
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if cur:
+                chunks.append("\n".join(cur))
+                cur, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        add = len(line) + (1 if cur else 0)
+        if cur and size + add > limit:
+            chunks.append("\n".join(cur))
+            cur, size, add = [], 0, len(line)
+        cur.append(line)
+        size += add
+    if cur:
+        chunks.append("\n".join(cur))
+    return [c for c in chunks if c.strip()] or [text[:limit]]
+
+# ---------- 訊息 payload ----------
+def _text_payload(to: str, text: str):
+    return {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "text",
-        "text": {"body": text[:3500]}
+        "text": {"body": text}
     }
-    return _post_json("/messages", data)
 
-def send_buttons(to: str, body_text: str, buttons: list):
-    """
-    buttons: [{"id":"opt_swing","title":"波段"}, {"id":"opt_short","title":"短線"}]
-    """
-    data = {
+def _buttons_payload(to: str, body_text: str, buttons: list):
+    return {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "interactive",
@@ -43,13 +133,9 @@ def send_buttons(to: str, body_text: str, buttons: list):
             ]}
         }
     }
-    return _post_json("/messages", data)
 
-def send_list(to: str, header: str, body_text: str, sections: list, button_text: str = "選擇"):
-    """
-    sections: [{"title":"期間","rows":[{"id":"days_60","title":"60 天"}, ...]}]
-    """
-    data = {
+def _list_payload(to: str, header: str, body_text: str, sections: list, button_text: str):
+    return {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "interactive",
@@ -60,4 +146,36 @@ def send_list(to: str, header: str, body_text: str, sections: list, button_text:
             "action": {"button": button_text[:20], "sections": sections}
         }
     }
-    return _post_json("/messages", data)
\ No newline at end of file
+
+def send_text(to: str, text: str):
+    """超過 WA_TEXT_MAX 時依行分成多則依序送出；回傳最後一則的回應。"""
+    for chunk in split_text(text):
+        res = _post_json("/messages", _text_payload(to, chunk))
+    return res
+
+def send_buttons(to: str, body_text: str, buttons: list):
+    """
+    buttons: [{"id":"opt_swing","title":"波段"}, {"id":"opt_short","title":"短線"}]
+    """
+    return _post_json("/messages", _buttons_payload(to, body_text, buttons))
+
+def send_list(to: str, header: str, body_text: str, sections: list, button_text: str = "選擇"):
+    """
+    sections: [{"title":"期間","rows":[{"id":"days_60","title":"60 天"}, ...]}]
+    """
+    return _post_json("/messages", _list_payload(to, header, body_text, sections, button_text))
+
+async def asend_text(to: str, text: str, timeout: float = None, phone_id: str = None):
+    """同 send_text；經 outbound 排程時建議先 split_text()，每段各自重試。"""
+    for chunk in split_text(text):
+        res = await _apost_json("/messages", _text_payload(to, chunk), timeout=timeout, phone_id=phone_id)
+    return res
+
+async def asend_buttons(to: str, body_text: str, buttons: list, timeout: float = None, phone_id: str = None):
+    return await _apost_json("/messages", _buttons_payload(to, body_text, buttons),
+                             timeout=timeout, phone_id=phone_id)
+
+async def asend_list(to: str, header: str, body_text: str, sections: list,
+                     button_text: str = "選擇", timeout: float = None, phone_id: str = None):
+    return await _apost_json("/messages", _list_payload(to, header, body_text, sections, button_text),
+                             timeout=timeout, phone_id=phone_id)
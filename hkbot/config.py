@@ -0,0 +1,11 @@
+# hkbot/config.py
+import os
+
+# 本機持久化資料（K 線庫、名稱快取…）的根目錄
+DATA_DIR = os.getenv("HKBOT_DATA_DIR", ".hkbot")
+
+def data_path(*parts):
+    return os.path.join(DATA_DIR, *parts)
+
+# 收市後全市場預先計算（hkbot.precompute）；放這裡讓 app 不必為了讀開關就載入 numpy / pandas
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "1") == "1"
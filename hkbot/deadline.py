@@ -0,0 +1,42 @@
+# hkbot/deadline.py
+"""
+每個請求的時間預算（contextvar，跟 route_var 一樣在 jobs.run_blocking 的 thread 內也看得到）。
+
+    dl = Deadline(12)                 # Twilio 約 15 秒內要回 TwiML，留點餘裕
+    deadline_var.set(dl)
+    fetch(..., timeout=cap(10))       # 單次上游呼叫不超過剩餘預算
+
+HistoryCache 在預算內等不到新資料時，先回快取裡最近的 K 線，記在 dl.stale（symbol → 上次抓取時間），
+並在背景補抓；回覆時據此加上「暫用快取」的標示。沒有設預算（預熱、預先計算）時行為不變。
+"""
+import contextvars
+import time
+
+deadline_var = contextvars.ContextVar("hkbot_deadline", default=None)
+
+
+class Deadline:
+    def __init__(self, seconds, start=None):
+        self.seconds = seconds
+        self.expires_at = (start if start is not None else time.monotonic()) + seconds
+        self.stale = {}          # symbol -> fetched_at（epoch 秒）：暫用快取回覆的檔
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def current():
+    return deadline_var.get()
+
+
+def cap(timeout):
+    """timeout 與目前請求剩餘預算取小；沒有預算時原樣回傳。"""
+    dl = deadline_var.get()
+    if dl is None:
+        return timeout
+    left = dl.remaining()
+    return left if timeout is None else min(timeout, left)
@@ -0,0 +1,155 @@
+# hkbot/dedupe.py
+"""
+WhatsApp message ID 去重：Meta 重送 webhook 時，在任何分析 / 外送之前就擋下來。
+
+- 有上限、依 TTL 淘汰（沿用 hkbot.ttlcache.TTLCache）。
+- 選用持久化：每個新 ID 以一行 "<expires_at> <id>" 追加到檔案，重啟時讀回未過期的；
+  撤銷（discard）追加一行 "- <id>"，讀回時依序套用，重送的訊息重啟後仍能再收；
+  檔案過長時重寫（只留仍有效的）。
+- add() / discard() 在 event loop 上呼叫，只把行放進待寫清單；寫檔、flush、重寫都在背景的
+  writer thread，每 DEDUPE_FLUSH 秒一批。程式當掉時最多少記最後一批（重送會再處理一次）。
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from hkbot.config import data_path
+from hkbot.ttlcache import TTLCache
+
+log = logging.getLogger("uvicorn.error")
+
+DEDUPE_TTL = float(os.getenv("DEDUPE_TTL", str(24 * 3600)))     # Meta 最多重送約一天
+DEDUPE_MAX = int(os.getenv("DEDUPE_MAX", "100000"))
+DEDUPE_FILE = os.getenv("DEDUPE_FILE", data_path("seen_ids.log"))  # 設為空字串即不存檔
+DEDUPE_FLUSH = float(os.getenv("DEDUPE_FLUSH", "0.2"))            # 秒：writer thread 每批寫檔的間隔
+
+
+class SeenSet:
+    def __init__(self, maxsize=DEDUPE_MAX, ttl=DEDUPE_TTL, path=DEDUPE_FILE, flush_every=DEDUPE_FLUSH):
+        self.ttl = ttl
+        self.path = path or None
+        self.flush_every = flush_every
+        self._ids = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._fh = None                # 只有 writer thread 會碰
+        self._lines = 0
+        self._pending = []             # 待寫的行（在 _lock 內追加 / 取走）
+        self._wake = threading.Event()
+        self._closing = False
+        self._writer = None
+        self.batches = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self._load()
+
+    # ---------- 持久化 ----------
+    def _load(self):
+        if not self.path:
+            return
+        now = time.time()
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    exp, _, mid = line.rstrip("\n").partition(" ")
+                    self._lines += 1
+                    if exp == "-":
+                        self._ids.pop(mid)
+                        continue
+                    try:
+                        if mid and float(exp) > now:
+                            self._ids.set(mid, True, expires_at=float(exp))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def _append(self, mid, expires_at):
+        """排進待寫清單（呼叫端持有 _lock）；expires_at 為 None 時寫撤銷（tombstone）行。"""
+        self._pending.append(f"- {mid}\n" if expires_at is None else f"{expires_at:.0f} {mid}\n")
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="hkbot-dedupe", daemon=True)
+            self._writer.start()
+        self._wake.set()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            if not self._closing:
+                time.sleep(self.flush_every)   # 攢一批再寫
+            with self._lock:
+                lines, self._pending = self._pending, []
+                self._wake.clear()
+                closing = self._closing        # close() 在這之後才設的話會再 set 一次 _wake
+            if lines:
+                self._flush(lines)
+            if closing:
+                return
+
+    def _flush(self, lines):
+        try:
+            if self._fh is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._fh = open(self.path, "a", encoding="utf-8")
+            self._fh.writelines(lines)
+            self._fh.flush()
+            self._lines += len(lines)
+            self.batches += 1
+            if self._lines > 2 * self._ids.maxsize:
+                self._rewrite()
+        except OSError as e:
+            log.warning("dedupe persist failed: %r", e)
+
+    def _rewrite(self):
+        live = self._ids.items()
+        d = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-seen-")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            for mid, _, exp in live:
+                fh.write(f"{exp:.0f} {mid}\n")
+        if self._fh is not None:
+            self._fh.close()
+        os.replace(tmp, self.path)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        self._lines = len(live)
+
+    # ---------- 查詢 ----------
+    def add(self, mid):
+        """第一次看到回 True；重送（已看過）回 False。沒有 ID 的一律放行。"""
+        if not mid:
+            return True
+        with self._lock:
+            if self._ids.get(mid) is not None:
+                self.duplicates += 1
+                return False
+            expires_at = time.time() + self.ttl
+            self._ids.set(mid, True, expires_at=expires_at)
+            self.accepted += 1
+            if self.path:
+                self._append(mid, expires_at)
+            return True
+
+    def discard(self, mid):
+        """收下後沒能處理（例如佇列已滿）時撤銷，讓重送可以再進來。"""
+        if not mid:
+            return
+        with self._lock:
+            if self._ids.pop(mid) is not None and self.path:
+                self._append(mid, None)
+
+    def close(self):
+        """寫完待寫的行再關檔。"""
+        with self._lock:
+            writer, self._closing = self._writer, True
+            self._wake.set()
+        if writer is not None:
+            writer.join()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def stats(self):
+        return {"size": len(self._ids), "accepted": self.accepted,
+                "duplicates_dropped": self.duplicates, "persisted": bool(self.path),
+                "write_batches": self.batches}
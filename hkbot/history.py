@@ -0,0 +1,414 @@
+# hkbot/history.py
+"""
+每檔股票的日線快取（process 內）。
+
+- 依港股交易時段判斷新鮮度：盤中用短 TTL；收市後資料已定型，直到下一個交易日開市都算新鮮。
+- 過期時只補抓「最後一根 K 線之後」的資料再接上，不重抓整段。
+- 同一檔以最長的那次下載為準，較短的 days 直接切片。
+- LRU 淘汰，限制最多快取幾檔。
+- single-flight：同時間多個請求要同一檔時，只有一個去下載，其他人等它完成後直接切片。
+- 可接上磁碟 K 線庫（hkbot.store.BarStore）：記憶體沒有時先讀磁碟，新抓的 K 線寫回磁碟。
+- 請求有時間預算（hkbot.deadline）時：上游逾時 = 剩餘預算；來不及就先回快取裡最近的 K 線
+  （stale-while-revalidate，記在 Deadline.stale），並在背景補抓。
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime, timedelta, timezone
+
+import pandas as pd
+
+from hkbot import deadline
+from hkbot.metrics import route_var, SHARED_ERRORS, STALE_SERVED
+
+log = logging.getLogger("uvicorn.error")
+
+HIST_TTL_INTRADAY = float(os.getenv("HIST_TTL_INTRADAY", "60"))   # 盤中快取秒數
+HIST_TTL_MAX = float(os.getenv("HIST_TTL_MAX", str(12 * 3600)))   # 收市後最長保留（保險用）
+HIST_CACHE_MAX = int(os.getenv("HIST_CACHE_MAX", "500"))          # 最多快取幾檔
+HIST_FLIGHT_WAIT = float(os.getenv("HIST_FLIGHT_WAIT", "30"))     # 等別人下載的上限（秒）
+HIST_MIN_FETCH = float(os.getenv("HIST_MIN_FETCH", "1"))          # 剩餘預算少於此就不抓，直接回快取
+HIST_REVALIDATE_THREADS = int(os.getenv("HIST_REVALIDATE_THREADS", "2"))
+
+# ---------- 港股交易時段（HKT 無夏令時間，固定 UTC+8） ----------
+HKT = timezone(timedelta(hours=8), "HKT")
+SESSION_OPEN = dtime(9, 30)
+SESSION_CLOSE = dtime(16, 10)   # 含收市競價
+
+def hk_now():
+    return datetime.now(HKT)
+
+def is_trading_day(d):
+    # 只排除週末；公眾假期抓不到新 K 線也不會出錯，只是多問一次
+    return d.weekday() < 5
+
+def is_market_open(now=None):
+    """開市 ~ 收市競價結束（午休也算盤中：收市價尚未定型）。"""
+    now = now or hk_now()
+    return is_trading_day(now.date()) and SESSION_OPEN <= now.time() < SESSION_CLOSE
+
+def last_close(now=None):
+    """最近一次收市（已定型）的時間點。"""
+    now = now or hk_now()
+    d = now.date()
+    if not (is_trading_day(d) and now.time() >= SESSION_CLOSE):
+        d -= timedelta(days=1)
+    while not is_trading_day(d):
+        d -= timedelta(days=1)
+    return datetime.combine(d, SESSION_CLOSE, tzinfo=HKT)
+
+def window_start(days, now=None):
+    """與 yfinance period=f"{days}d" 相同的語意：往回推 days 個日曆日。"""
+    now = now or hk_now()
+    return pd.Timestamp(now.date() - timedelta(days=max(days, 60)))
+
+def is_fresh(fetched_at, now=None):
+    now = now or hk_now()
+    age = now.timestamp() - fetched_at
+    if age >= HIST_TTL_MAX:
+        return False
+    if is_market_open(now):
+        return age < HIST_TTL_INTRADAY
+    return fetched_at >= last_close(now).timestamp()
+
+
+class _Entry:
+    __slots__ = ("df", "since", "fetched_at")
+
+    def __init__(self, df, since, fetched_at):
+        self.df = df
+        self.since = since            # 已涵蓋的最早日期（要求的起點）
+        self.fetched_at = fetched_at  # 上次成功向上游確認的時間
+
+
+def merge_bars(old, new):
+    """接上新 K 線；同一天以新資料為準（盤中最後一根會變動）。"""
+    if old is None or old.empty:
+        return new
+    if new is None or new.empty:
+        return old
+    df = pd.concat([old, new[old.columns.intersection(new.columns)]])
+    df = df[~df.index.duplicated(keep="last")]
+    return df.sort_index()
+
+
+def _timeout_kw():
+    """有時間預算時，單次上游呼叫的逾時 = 剩餘預算。"""
+    dl = deadline.current()
+    return {"timeout": max(dl.remaining(), 0.1)} if dl is not None else {}
+
+
+def _lock_name(sym):
+    return f"bars:{sym}"
+
+
+class HistoryCache:
+    def __init__(self, fetch, maxsize=HIST_CACHE_MAX, store=None, locks=None):
+        """
+        fetch(symbols, period=None, start=None[, timeout=]) -> {symbol: DataFrame}
+        period 為整段下載（例如 "120d"），start 為增量下載的起日；有時間預算時才會帶 timeout。
+        store: 選用的 BarStore / SharedBarStore（read-through / write-back）。
+        locks: 選用的 hkbot.shared.SharedCache，跨 process 的下載鎖（多 worker 時同一檔只抓一次）。
+        """
+        self._fetch = fetch
+        self.store = store
+        self.locks = locks
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}           # symbol -> threading.Event（下載中）
+        self._revalidating = set()    # 背景補抓中的 symbol
+        self._revalidator = None
+        self._lock = threading.Lock()
+        self.fetches = 0              # 實際向上游發出的下載次數
+        self.coalesced = 0            # 搭上別人進行中下載的 symbol 數（省下的下載）
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.incremental = 0
+        self.evictions = 0
+        self.errors = 0
+        self.stale_served = 0         # 預算內等不到新資料，先回舊 K 線的 symbol 數
+        self.revalidations = 0
+
+    # ---------- 讀取 ----------
+    def get(self, symbols, days=90):
+        if not symbols:
+            return {}
+        now = hk_now()
+        start = window_start(days, now)
+        dl = deadline.current()
+        if self.store is not None:
+            self._load_from_store(symbols)
+
+        waited, unfinished = set(), set()   # unfinished：這次沒抓到（沒時間 / 上游失敗），要背景補
+        for _ in range(3):
+            full, stale, waits, mine = [], [], [], {}
+            with self._lock:
+                for sym in dict.fromkeys(symbols):
+                    e = self._entries.get(sym)
+                    if e is None and sym in waited:
+                        continue            # 別人剛抓過也沒有資料，不再重問
+                    if e is not None and e.since <= start and is_fresh(e.fetched_at, now):
+                        self._entries.move_to_end(sym)
+                        if sym in waited:
+                            self.coalesced += 1   # 搭別人的下載，省下一次
+                        else:
+                            self.hits += 1
+                        continue
+                    flight = self._inflight.get(sym)
+                    if flight is not None:
+                        waits.append(flight)
+                        waited.add(sym)
+                        continue
+                    mine[sym] = self._inflight[sym] = threading.Event()
+                    if e is None or e.since > start:
+                        full.append(sym)
+                    else:
+                        stale.append(sym)
+
+            if dl is not None and dl.remaining() < HIST_MIN_FETCH:
+                unfinished.update(full + stale)
+                full, stale = [], []      # 沒時間抓了：先回快取，背景再補
+            owner, held, busy = None, [], []
+            try:
+                if self.locks is not None and (full or stale):
+                    full, stale, busy, owner, held = self._claim(full, stale, start, now)
+                if full and not self._refresh_full(full, days, start):
+                    unfinished.update(full)
+                if stale and not self._refresh_incremental(stale):
+                    unfinished.update(stale)
+            finally:
+                if held:
+                    self._release(owner, held)
+                with self._lock:
+                    for sym, ev in mine.items():
+                        self._inflight.pop(sym, None)
+                        ev.set()
+
+            if busy:
+                # 別的 worker 正在抓：自己的做完（鎖已放）才等，避免互等；寫完後從共享庫讀回
+                try:
+                    self.locks.wait([_lock_name(s) for s in busy], deadline.cap(HIST_FLIGHT_WAIT))
+                except Exception as e:
+                    log.warning("shared lock wait failed: %r", e)
+                    SHARED_ERRORS.inc(op="lock_wait")
+                if self.store is not None:
+                    self._reload_from_store(busy)
+                waited.update(busy)
+            if not waits and not busy:
+                break
+            if dl is not None and dl.expired:
+                break
+            for ev in waits:
+                ev.wait(deadline.cap(HIST_FLIGHT_WAIT))
+
+        out, served = {}, []
+        with self._lock:
+            for sym in symbols:
+                e = self._entries.get(sym)
+                if e is None:
+                    continue
+                sub = e.df.loc[e.df.index >= start]
+                if not sub.empty:
+                    out[sym] = sub.copy()
+                    if dl is not None and not (e.since <= start and is_fresh(e.fetched_at, now)):
+                        dl.stale[sym] = e.fetched_at
+                        served.append(sym)
+        if dl is not None and (served or unfinished):
+            if served:
+                self.stale_served += len(served)
+                STALE_SERVED.inc(len(served), route=route_var.get())
+            self._revalidate(list(dict.fromkeys(served + list(unfinished))), days)
+        return out
+
+    def _revalidate(self, symbols, days):
+        """在背景（沒有時間預算）把這些 symbol 補抓回來；同一檔同時只排一次。"""
+        with self._lock:
+            todo = [s for s in symbols if s not in self._revalidating]
+            if not todo:
+                return
+            self._revalidating.update(todo)
+            if self._revalidator is None:
+                self._revalidator = ThreadPoolExecutor(max_workers=HIST_REVALIDATE_THREADS,
+                                                       thread_name_prefix="hkbot-revalidate")
+        self.revalidations += 1
+
+        def _run():
+            try:
+                self.get(todo, days=days)    # 新 thread 的 contextvars 是空的：不受原請求預算限制
+            except Exception as e:
+                log.warning("history revalidate failed %s: %r", todo, e)
+            finally:
+                with self._lock:
+                    self._revalidating.difference_update(todo)
+
+        self._revalidator.submit(_run)
+
+    def _load_from_store(self, symbols):
+        with self._lock:
+            missing = [s for s in symbols if s not in self._entries]
+        for sym in missing:
+            try:
+                got = self.store.load(sym)
+            except Exception as e:
+                log.warning("bar store read failed %s: %r", sym, e)
+                continue
+            if got is None:
+                continue
+            df, since, fetched_at = got
+            with self._lock:
+                if sym not in self._entries:
+                    self._put(sym, _Entry(df, since, fetched_at))
+                    self.store_hits += 1
+
+    def _reload_from_store(self, symbols):
+        """共享庫裡比記憶體新的（別的 worker 剛抓過）併回來。"""
+        for sym in symbols:
+            try:
+                got = self.store.load(sym)
+            except Exception as e:
+                log.warning("bar store read failed %s: %r", sym, e)
+                continue
+            if got is None:
+                continue
+            df, since, fetched_at = got
+            with self._lock:
+                e = self._entries.get(sym)
+                if e is None:
+                    self._put(sym, _Entry(df, since, fetched_at))
+                elif fetched_at > e.fetched_at:
+                    e.df = merge_bars(e.df, df)
+                    e.since = min(e.since, since)
+                    e.fetched_at = fetched_at
+                else:
+                    continue
+                self.store_hits += 1
+
+    # ---------- 跨 process 下載鎖 ----------
+    def _claim(self, full, stale, start, now):
+        """
+        拿這些 symbol 的下載鎖（不等待）。拿到的先從共享庫重讀一次（可能別人剛抓完），
+        仍過期的才由自己抓；沒拿到的（busy）交給呼叫端稍後等待。
+        """
+        want = full + stale
+        try:
+            owner, got = self.locks.acquire([_lock_name(s) for s in want])
+        except Exception as e:   # 共享庫有問題就自己抓，不影響回覆
+            log.warning("shared lock acquire failed: %r", e)
+            SHARED_ERRORS.inc(op="lock_acquire")
+            return full, stale, [], None, set()
+        got = {n.split(":", 1)[1] for n in got}
+        busy = [s for s in want if s not in got]
+        if got and self.store is not None:
+            self._reload_from_store(list(got))
+        with self._lock:
+            done = set()
+            for sym in got:
+                e = self._entries.get(sym)
+                if e is not None and e.since <= start and is_fresh(e.fetched_at, now):
+                    done.add(sym)
+            self.coalesced += len(done)
+        self._release(owner, done)
+        keep = got - done
+        return [s for s in full if s in keep], [s for s in stale if s in keep], busy, owner, keep
+
+    def _release(self, owner, symbols):
+        try:
+            self.locks.release(owner, [_lock_name(s) for s in symbols])
+        except Exception as e:   # 租約到期也會自動釋放
+            log.warning("shared lock release failed: %r", e)
+            SHARED_ERRORS.inc(op="lock_release")
+
+    def _write_back(self, sym, df, since, fetched_at):
+        if self.store is None:
+            return
+        try:
+            self.store.append(sym, df, since=since, fetched_at=fetched_at)
+        except Exception as e:
+            log.warning("bar store write failed %s: %r", sym, e)
+
+    # ---------- 下載 ----------
+    def _refresh_full(self, symbols, days, start):
+        self.misses += len(symbols)
+        self.fetches += 1
+        try:
+            got = self._fetch(symbols, period=f"{max(days, 60)}d", **_timeout_kw())
+        except Exception as e:
+            self.errors += 1
+            log.warning("history full fetch failed %s: %r", symbols, e)
+            return False
+        fetched_at = time.time()
+        with self._lock:
+            for sym in symbols:
+                df = got.get(sym)
+                if df is None or df.empty:
+                    continue
+                old = self._entries.get(sym)
+                merged = merge_bars(old.df if old is not None else None, df)
+                self._put(sym, _Entry(merged, start, fetched_at))
+        for sym in symbols:
+            if got.get(sym) is not None:
+                self._write_back(sym, got[sym], start, fetched_at)
+        return True
+
+    def _refresh_incremental(self, symbols):
+        self.incremental += len(symbols)
+        with self._lock:
+            lasts = [self._entries[s].df.index[-1] for s in symbols if s in self._entries]
+        if not lasts:
+            return True
+        # 從最舊的最後一根開始補（含那一天，盤中最後一根要覆寫）
+        since = min(lasts).strftime("%Y-%m-%d")
+        self.fetches += 1
+        try:
+            got = self._fetch(symbols, start=since, **_timeout_kw())
+        except Exception as e:
+            self.errors += 1
+            log.warning("history incremental fetch failed %s: %r", symbols, e)
+            return False
+        fetched_at = time.time()
+        with self._lock:
+            for sym in symbols:
+                e = self._entries.get(sym)
+                if e is None:
+                    continue
+                new = got.get(sym)
+                e.df = merge_bars(e.df, new)
+                e.fetched_at = fetched_at
+                self._entries.move_to_end(sym)
+        for sym in symbols:
+            self._write_back(sym, got.get(sym), None, fetched_at)
+        return True
+
+    def _put(self, sym, entry):
+        self._entries[sym] = entry
+        self._entries.move_to_end(sym)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ---------- 管理 ----------
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "symbols": len(self._entries),
+            "maxsize": self.maxsize,
+            "fetches": self.fetches,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "incremental": self.incremental,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "stale_served": self.stale_served,
+            "revalidations": self.revalidations,
+            "revalidating": len(self._revalidating),
+        }
@@ -0,0 +1,209 @@
+# hkbot/indicators.py
+"""
+串流式指標狀態：每個 (symbol, mode[, 視窗長度]) 保存視窗內已確認的 K 線、EMA 快/慢線、Wilder RSI 的
+上漲/下跌均值、最近 20 根成交量與區間高低；新 K 線進來時 O(1) 更新，不用整段重算。
+
+- 「已確認」的 K 線（最後一根之前）併入狀態；最後一根（盤中會變動）只做暫時計算。
+- 同一根 K 線重複查詢直接回傳上次結果。
+- 視窗以日曆日往前滑（每天起點都會變）：起點往後移時從頭端移除舊 K 線（O(1)），不重建。
+  EMA 以視窗第一根為起點，寫成 y = W + b^count·x_first（W = Σ a·b^age·x），
+  尾端加值、頭端移除都只動 W，結果與整段重算相同（差在浮點捨入，相對誤差 ~1e-15）。
+- 區間高低用單調 deque，隨視窗滑動 O(1)（攤銷）。
+- 視窗起點往前（要更長的期間）或中間資料對不上時才整段重建。
+"""
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+
+from hkbot.signals import mode_params, score_signals, VOL_WINDOW
+
+INDICATOR_STATE_MAX = int(os.getenv("INDICATOR_STATE_MAX", "5000"))
+
+
+class _Ewm:
+    """adjust=False 的 EMA，以第一個值為起點；可在尾端加值、從頭端移除最舊的值。"""
+    __slots__ = ("a", "b", "w", "count")
+
+    def __init__(self, alpha):
+        self.a = alpha
+        self.b = 1.0 - alpha
+        self.w = 0.0
+        self.count = 0
+
+    def push(self, x):
+        self.w = self.b * self.w + self.a * x
+        self.count += 1
+
+    def drop(self, x):
+        """移除最舊的值 x（它的 age 為 count - 1）。"""
+        self.count -= 1
+        self.w -= self.a * self.b ** self.count * x
+
+    def peek(self, x, first):
+        """暫時加入 x 之後的 EMA（first 為加入後視窗內的第一個值）。"""
+        return self.b * self.w + self.a * x + self.b ** (self.count + 1) * first
+
+
+class IndicatorState:
+    __slots__ = ("ema_f", "ema_s", "up", "down", "bars", "seq", "vols", "hi", "lo", "memo")
+
+    def __init__(self, ema_fast, ema_slow, rsi_p):
+        self.ema_f = _Ewm(2.0 / (ema_fast + 1))
+        self.ema_s = _Ewm(2.0 / (ema_slow + 1))
+        self.up = _Ewm(1.0 / rsi_p)
+        self.down = _Ewm(1.0 / rsi_p)
+        self.bars = deque()        # 視窗內已確認的 (date, close)
+        self.seq = 0               # 已併入過的 K 線總數（單調 deque 的序號）
+        self.vols = deque(maxlen=VOL_WINDOW)
+        self.hi = deque()          # (seq, close)，close 遞減
+        self.lo = deque()          # (seq, close)，close 遞增
+        self.memo = None           # ((start, date, close, volume), result)
+
+    @property
+    def start(self):
+        return self.bars[0][0] if self.bars else None
+
+    @property
+    def last_date(self):
+        return self.bars[-1][0] if self.bars else None
+
+    @property
+    def n(self):
+        return len(self.bars)
+
+    def push(self, date, close, volume):
+        """把一根已確認的 K 線併入狀態（O(1)）。"""
+        if self.bars:
+            d = close - self.bars[-1][1]
+            self.up.push(max(d, 0.0))
+            self.down.push(-min(d, 0.0))
+        self.ema_f.push(close)
+        self.ema_s.push(close)
+        self.bars.append((date, close))
+        self.vols.append(volume)
+        while self.hi and self.hi[-1][1] <= close:
+            self.hi.pop()
+        self.hi.append((self.seq, close))
+        while self.lo and self.lo[-1][1] >= close:
+            self.lo.pop()
+        self.lo.append((self.seq, close))
+        self.seq += 1
+
+    def drop(self):
+        """視窗起點往後移：移除最舊的一根（O(1)）。"""
+        _, close = self.bars.popleft()
+        self.ema_f.drop(close)
+        self.ema_s.drop(close)
+        if self.bars:
+            d = self.bars[0][1] - close
+            self.up.drop(max(d, 0.0))
+            self.down.drop(-min(d, 0.0))
+        first = self.seq - len(self.bars)      # 留下的最舊一根的序號
+        while self.hi and self.hi[0][0] < first:
+            self.hi.popleft()
+        while self.lo and self.lo[0][0] < first:
+            self.lo.popleft()
+
+    def values(self, close, volume):
+        """以目前狀態 + 最後一根（暫時）算出 price/ema/rsi/vol/voln/hi/lo。"""
+        first = self.bars[0][1] if self.bars else close
+        ema_f = self.ema_f.peek(close, first)
+        ema_s = self.ema_s.peek(close, first)
+        if self.bars:
+            d = close - self.bars[-1][1]
+            d0 = (self.bars[1][1] if len(self.bars) > 1 else close) - first   # 第一個漲跌
+            up = self.up.peek(max(d, 0.0), max(d0, 0.0))
+            down = self.down.peek(-min(d, 0.0), -min(d0, 0.0))
+            down = down if down != 0 else 1e-9
+            rsi = 100 - (100 / (1 + up / down))
+        else:
+            rsi = math.nan
+        voln = None
+        if len(self.vols) >= VOL_WINDOW - 1:
+            window = list(self.vols)[-(VOL_WINDOW - 1):] + [volume]
+            voln = sum(window) / VOL_WINDOW
+        hi = max(self.hi[0][1], close) if self.hi else close
+        lo = min(self.lo[0][1], close) if self.lo else close
+        return {
+            "price": close, "ema_f": ema_f, "ema_s": ema_s, "rsi": rsi,
+            "vol": volume, "voln": voln, "hi": hi, "lo": lo,
+        }
+
+
+class IndicatorEngine:
+    def __init__(self, maxsize=INDICATOR_STATE_MAX):
+        self.maxsize = maxsize
+        self._states = OrderedDict()   # (symbol, mode, window) -> IndicatorState
+        self._lock = threading.Lock()
+        self.memo_hits = 0
+        self.incremental = 0
+        self.slid = 0                  # 因視窗滑動從頭端移除的 K 線數
+        self.rebuilds = 0
+
+    def _state_for(self, key, mode, df):
+        """找可以接續的狀態（必要時先把視窗起點往後滑）；找不到就從頭建立。回傳 (state, 需要補併的起點)。"""
+        st = self._states.get(key)
+        if st is not None and st.bars:
+            start = df.index[0]
+            while st.bars and st.start < start:
+                st.drop()
+                self.slid += 1
+            k = st.n
+            ok = (k and st.start == start and k <= len(df) - 1 and df.index[k - 1] == st.last_date
+                  and float(df["Close"].iat[k - 1]) == st.bars[-1][1])
+            if ok:
+                self._states.move_to_end(key)
+                return st, k
+        st = IndicatorState(*mode_params(mode)[:3])
+        self._states[key] = st
+        self._states.move_to_end(key)
+        while len(self._states) > self.maxsize:
+            self._states.popitem(last=False)
+        self.rebuilds += 1
+        return st, 0
+
+    def evaluate(self, symbol, df, mode="swing", window=None):
+        """
+        回傳最後一根 K 線的指標值（dict）；資料不足回 None。
+        window：視窗長度（天），不同長度的查詢各自保存狀態，互不重建。
+        """
+        if df is None or df.empty:
+            return None
+        with self._lock:
+            st, k = self._state_for((symbol, mode, window), mode, df)
+            close, vol = df["Close"], df["Volume"]
+            if 0 < k < len(df) - 1:
+                self.incremental += 1
+            for i in range(k, len(df) - 1):
+                st.push(df.index[i], float(close.iat[i]), float(vol.iat[i]))
+            return st.values(float(close.iat[-1]), float(vol.iat[-1]))
+
+    def recommend(self, symbol, df, mode="swing", window=None):
+        """與 ai_recommendation 相同的輸出（label / reason），多了 score。"""
+        if df is None or df.empty:
+            return {"label": "持有", "reason": "資料不足", "score": 0}
+        ema_fast, ema_slow, _, _, min_rows = mode_params(mode)
+        if len(df) < min_rows:
+            return {"label": "持有", "reason": f"資料不足（<{min_rows} 筆）", "score": 0}
+        key = (symbol, mode, window)
+        bar = (df.index[0], df.index[-1], float(df["Close"].iat[-1]), float(df["Volume"].iat[-1]))
+        with self._lock:
+            st = self._states.get(key)
+            if (st is not None and st.memo is not None and st.memo[0] == bar
+                    and st.n == len(df) - 1 and st.last_date == df.index[-2]):
+                self.memo_hits += 1
+                return st.memo[1]
+        v = self.evaluate(symbol, df, mode, window)
+        score, label, reason = score_signals(v["price"], v["ema_f"], v["ema_s"], v["rsi"], v["vol"],
+                                             v["voln"], v["hi"], v["lo"], ema_fast, ema_slow)
+        res = {"label": label, "reason": reason, "score": score}
+        with self._lock:
+            st = self._states.get(key)
+            if st is not None:
+                st.memo = (bar, res)
+        return res
+
+    def stats(self):
+        return {"states": len(self._states), "memo_hits": self.memo_hits,
+                "incremental": self.incremental, "slid": self.slid, "rebuilds": self.rebuilds}
@@ -0,0 +1,306 @@
+# hkbot/intraday.py
+"""
+盤中分鐘 K 線（1m / 5m / 15m）：每個 (symbol, interval) 一個預先配置好的環形緩衝區，記憶體固定。
+
+    9988 700 interval=5m [mode=short]
+
+- RingBuffer：一個 (6, 2 × capacity) float64 陣列（列同 hkbot.store：time, OHLCV；time 為香港時間的
+  「牆上時間」秒數），每根 K 線寫兩次（位置 i 與 i + capacity）。最近 size 根永遠是一段連續的 slice，
+  寫入只動新的欄（連續 slice），讀取不用重排；算指標時只把 close / volume 兩列複製成一個矩陣。
+  記憶體：每個 buffer 96 × capacity bytes（預設 400 根 ≈ 38 KB），最多 INTRADAY_MAX 個
+  （預設 300 ≈ 11 MB），超過時淘汰最久沒用的。
+- 第一次用到才整段下載（INTRADAY_SEED：1m 抓 5 天、5m / 15m 抓 1 個月，夠填滿 buffer）；
+  之後只從 buffer 最後一根開始補抓（最後一根是進行中的 K 線，會被覆寫），更新成本只跟新 K 線數有關。
+- 盤中每 INTRADAY_TTL 秒最多補抓一次；收市後抓過一次就一直用到下次開市。
+- 同一批缺資料 / 過期的檔合併成一次下載；同時間多個請求要同一檔時只有一個去抓（single-flight）。
+- 有請求時間預算時（hkbot.deadline）：剩不到 HIST_MIN_FETCH 秒就不抓，直接用 buffer 裡的舊 K 線；
+  沒抓到新資料的檔記在 dl.stale，回覆時加「暫用快取」的標示（與 HistoryCache 相同）。
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+from hkbot import deadline
+from hkbot.history import HIST_MIN_FETCH, HKT, _timeout_kw, hk_now, is_market_open, last_close
+from hkbot.metrics import route_var, STALE_SERVED
+from hkbot.signals import recommend_batch
+
+log = logging.getLogger("uvicorn.error")
+
+INTERVALS = {"1m": 60, "5m": 300, "15m": 900}                       # 支援的週期（秒）
+INTRADAY_SEED = {"1m": "5d", "5m": "1mo", "15m": "1mo"}            # 第一次整段下載的長度
+INTRADAY_BARS = int(os.getenv("INTRADAY_BARS", "400"))            # 每個 buffer 保留幾根（1m ≈ 1.2 個交易日）
+INTRADAY_MAX = int(os.getenv("INTRADAY_MAX", "300"))              # 最多幾個 (symbol, interval) buffer
+INTRADAY_TTL = float(os.getenv("INTRADAY_TTL", "30"))             # 盤中補抓間隔（秒）
+INTRADAY_FLIGHT_WAIT = float(os.getenv("INTRADAY_FLIGHT_WAIT", "15"))
+
+_FIELDS = 6   # time, Open, High, Low, Close, Volume
+
+
+def frame_to_bars(df):
+    """OHLCV DataFrame → (6, n) 陣列；index 帶時區（例如 UTC）時先換成香港時間，無時區視為香港時間。"""
+    arr = np.full((_FIELDS, len(df)), np.nan)
+    index = df.index
+    if getattr(index, "tz", None) is not None:
+        index = index.tz_convert("Asia/Hong_Kong").tz_localize(None)
+    arr[0] = index.values.astype("datetime64[s]").astype(np.int64)
+    for i, c in enumerate(("Open", "High", "Low", "Close", "Volume"), start=1):
+        if c in df.columns:
+            arr[i] = df[c].to_numpy(dtype=np.float64)
+    return arr
+
+
+def to_datetime(ts):
+    """buffer 裡的時間（香港牆上時間秒數）→ 帶 HKT 時區的 datetime。"""
+    return datetime.fromtimestamp(int(ts), timezone.utc).replace(tzinfo=HKT)
+
+
+class RingBuffer:
+    """固定容量的 K 線環形緩衝區；append 只寫新的欄，view() 不複製。"""
+    __slots__ = ("capacity", "size", "_buf", "_w")
+
+    def __init__(self, capacity=INTRADAY_BARS):
+        self.capacity = capacity
+        self.size = 0
+        self._buf = np.full((_FIELDS, 2 * capacity), np.nan)
+        self._w = capacity - 1          # 最後寫入的位置（0 ~ capacity-1）
+
+    @property
+    def nbytes(self):
+        return self._buf.nbytes
+
+    @property
+    def last_time(self):
+        return float(self._buf[0, self._w]) if self.size else None
+
+    def extend(self, bars):
+        """
+        併入 (6, n) 新 K 線（時間遞增）：與最後一根同時間的覆寫（進行中的 K 線），
+        更早的略過，之後的依序寫入。回傳新增幾根。
+        覆寫與新增合成一段連續寫入（繞回時分兩段 slice），不用 fancy index。
+        """
+        n = bars.shape[1]
+        if n == 0:
+            return 0
+        cap, buf, w = self.capacity, self._buf, self._w
+        k, overwrite = 0, False
+        if self.size:
+            last, t = buf[0, w], bars[0]
+            first = t[0]
+            if first > last:
+                pass                                              # 全部都是新的
+            elif first == last and (n == 1 or t[1] > last):
+                overwrite = True                                  # 常見情況：從進行中的那根開始
+            else:
+                k = int(t.searchsorted(last, "right"))           # bars[:, k:] 都比最後一根新
+                if k and t[k - 1] == last:
+                    k, overwrite = k - 1, True
+                elif k == n:
+                    return 0
+        added = n - k - overwrite
+        start = w if overwrite else (w + 1) % cap
+        m = n - k
+        if m > cap:
+            k, m = n - cap, cap
+        head = min(m, cap - start)
+        buf[:, start:start + head] = buf[:, start + cap:start + cap + head] = bars[:, k:k + head]
+        if head < m:
+            buf[:, :m - head] = buf[:, cap:cap + m - head] = bars[:, k + head:n]
+        self._w = (start + m - 1) % cap
+        self.size = min(self.size + added, cap)
+        return added
+
+    def view(self):
+        """最近 size 根，時間由舊到新：_buf[:, w+cap-size+1 : w+cap+1]（連續 slice，不複製）。"""
+        end = self._w + self.capacity + 1
+        return self._buf[:, end - self.size:end]
+
+
+class _Entry:
+    __slots__ = ("ring", "fetched_at")
+
+    def __init__(self, capacity):
+        self.ring = RingBuffer(capacity)
+        self.fetched_at = 0.0
+
+
+def is_fresh(fetched_at, ttl=INTRADAY_TTL, now=None):
+    now = now or hk_now()
+    if is_market_open(now):
+        return now.timestamp() - fetched_at < ttl
+    return fetched_at >= last_close(now).timestamp()
+
+
+class IntradayCache:
+    def __init__(self, fetch, capacity=INTRADAY_BARS, maxsize=INTRADAY_MAX, ttl=INTRADAY_TTL):
+        """
+        fetch(symbols, interval=, period=None, start=None[, timeout=]) -> {symbol: DataFrame}
+        period 為第一次整段下載，start 為增量下載的起點（帶 HKT 時區的 datetime）。
+        """
+        self._fetch = fetch
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()     # (symbol, interval) -> _Entry
+        self._inflight = {}               # (symbol, interval) -> threading.Event
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.seeded = 0                   # 整段下載的 buffer 數
+        self.appended = 0                 # 增量補進來的 K 線數
+        self.hits = 0
+        self.evictions = 0
+        self.errors = 0
+        self.stale_served = 0             # 預算內沒抓到新資料，先回舊 K 線的 symbol 數
+        self.update_seconds = 0.0         # 寫入 buffer 的累計時間（不含下載）
+
+    # ---------- 更新 ----------
+    def refresh(self, symbols, interval):
+        """確保這些檔的 buffer 夠新：缺的整段抓，過期的從最後一根補抓；各一次下載。"""
+        if interval not in INTERVALS:
+            raise ValueError(f"unsupported interval: {interval}")
+        now = hk_now()
+        dl = deadline.current()
+        for _ in range(2):
+            seed, stale, waits, mine = [], [], [], {}
+            with self._lock:
+                for sym in dict.fromkeys(symbols):
+                    key = (sym, interval)
+                    e = self._entries.get(key)
+                    if e is not None and e.ring.size and is_fresh(e.fetched_at, self.ttl, now):
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        continue
+                    flight = self._inflight.get(key)
+                    if flight is not None:
+                        waits.append(flight)
+                        continue
+                    mine[key] = self._inflight[key] = threading.Event()
+                    (stale if e is not None and e.ring.size else seed).append(sym)
+            if dl is not None and dl.remaining() < HIST_MIN_FETCH:
+                seed, stale = [], []          # 沒時間抓了：先回 buffer 裡的舊 K 線
+            try:
+                if seed:
+                    self._download(seed, interval, period=INTRADAY_SEED[interval])
+                if stale:
+                    with self._lock:
+                        since = min(self._entries[(s, interval)].ring.last_time for s in stale)
+                    self._download(stale, interval, start=to_datetime(since))
+            finally:
+                with self._lock:
+                    for key, ev in mine.items():
+                        self._inflight.pop(key, None)
+                        ev.set()
+            if not waits or (dl is not None and dl.expired):
+                break
+            for ev in waits:
+                ev.wait(deadline.cap(INTRADAY_FLIGHT_WAIT))
+        if dl is not None:
+            self._mark_stale(symbols, interval, now, dl)
+
+    def _mark_stale(self, symbols, interval, now, dl):
+        """這次沒更新到的 buffer（沒時間 / 上游失敗）記在 dl.stale，回覆時標示暫用快取。"""
+        served = 0
+        with self._lock:
+            for sym in dict.fromkeys(symbols):
+                e = self._entries.get((sym, interval))
+                if e is not None and e.ring.size and not is_fresh(e.fetched_at, self.ttl, now):
+                    dl.stale[sym] = e.fetched_at
+                    served += 1
+            self.stale_served += served
+        if served:
+            STALE_SERVED.inc(served, route=route_var.get())
+
+    def _download(self, symbols, interval, period=None, start=None):
+        self.fetches += 1
+        kw = {"period": period} if period else {"start": start}
+        kw.update(_timeout_kw())
+        try:
+            got = self._fetch(symbols, interval=interval, **kw)
+        except Exception as e:
+            self.errors += 1
+            log.warning("intraday fetch failed %s %s: %r", interval, symbols, e)
+            return
+        fetched_at = time.time()
+        with self._lock:
+            t0 = time.perf_counter()
+            for sym in symbols:
+                key = (sym, interval)
+                e = self._entries.get(key)
+                if e is None:
+                    e = self._entries[key] = _Entry(self.capacity)
+                    self.seeded += 1
+                df = got.get(sym)
+                if df is not None and not df.empty:
+                    self.appended += e.ring.extend(frame_to_bars(df))
+                e.fetched_at = fetched_at
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self.update_seconds += time.perf_counter() - t0
+
+    # ---------- 讀取 / 指標 ----------
+    def bars(self, symbols, interval, convert=np.copy):
+        """
+        {symbol: convert((6, n) view)}。convert 在鎖內對 buffer 的 view 執行（例如直接組成 DataFrame），
+        buffer 只被複製這一次；預設回傳陣列複本。
+        """
+        self.refresh(symbols, interval)
+        with self._lock:
+            out = {}
+            for sym in symbols:
+                e = self._entries.get((sym, interval))
+                if e is not None and e.ring.size:
+                    out[sym] = convert(e.ring.view())
+            return out
+
+    def recommend(self, symbols, interval, mode="short"):
+        """
+        {symbol: {'time','last','chg','label','reason'}}；沒資料的檔不在結果內。
+        chg 為相對前一個交易日最後一根的漲跌 %（buffer 內沒有前一天就是 None）。
+        指標要一次向量化算所有檔，所以把各 view 的 close / volume 列複製進一個右對齊的矩陣
+        （每檔 2 × 8 × n bytes；比每檔各算一次快，見 bench/intraday.py）；其餘都直接讀 view。
+        """
+        self.refresh(symbols, interval)
+        rows, syms = [], []
+        with self._lock:
+            views = [(s, self._entries.get((s, interval))) for s in dict.fromkeys(symbols)]
+            views = [(s, e.ring.view()) for s, e in views if e is not None and e.ring.size]
+            n = max((v.shape[1] for _, v in views), default=0)
+            close = np.full((len(views), n), np.nan)
+            volume = np.full((len(views), n), np.nan)
+            for i, (sym, v) in enumerate(views):
+                k, t = v.shape[1], v[0]
+                close[i, n - k:] = v[4]
+                volume[i, n - k:] = v[5]
+                prev = int(t.searchsorted(t[-1] - t[-1] % 86400, "left")) - 1   # 前一個交易日的最後一根
+                chg = (v[4, -1] / v[4, prev] - 1) * 100.0 if prev >= 0 else None
+                rows.append({"time": float(t[-1]), "last": float(v[4, -1]), "chg": chg})
+                syms.append(sym)
+        if not syms:
+            return {}
+        for row, ai in zip(rows, recommend_batch(close, volume, mode=mode)):
+            row.update(label=ai["label"], reason=ai["reason"])
+        return dict(zip(syms, rows))
+
+    # ---------- 管理 ----------
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            buffers = len(self._entries)
+            per = _FIELDS * 2 * self.capacity * 8
+        return {
+            "buffers": buffers, "maxsize": self.maxsize, "capacity": self.capacity,
+            "bytes_per_buffer": per, "bytes": buffers * per, "bytes_max": self.maxsize * per,
+            "fetches": self.fetches, "seeded": self.seeded, "appended": self.appended,
+            "hits": self.hits, "evictions": self.evictions, "errors": self.errors,
+            "stale_served": self.stale_served, "update_ms": round(1000 * self.update_seconds, 3),
+        }
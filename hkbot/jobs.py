@@ -0,0 +1,153 @@
+# hkbot/jobs.py
+"""
+背景工作佇列：webhook 只負責收件 & 排隊，分析與外送在 worker 內執行。
+
+- worker 為 asyncio task（數量可設定），阻塞型函式（yfinance / requests）
+  透過 run_blocking() 丟到專用的 thread pool，避免卡住 event loop。
+- stats() 回傳佇列深度、等待時間、執行時間，方便依尖峰訊息量調整 worker 數。
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("uvicorn.error")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))               # 同時處理的 job 數
+JOB_THREADS = int(os.getenv("JOB_THREADS", "8"))               # 阻塞呼叫用的 thread 數
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))        # 佇列上限（滿了直接拒收）
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    i = min(len(s) - 1, int(round(q * (len(s) - 1))))
+    return s[i]
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, threads=JOB_THREADS, maxsize=JOB_QUEUE_MAX, sample_n=1000):
+        self.workers = max(1, int(workers))
+        self.threads = max(1, int(threads))
+        self.maxsize = maxsize
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+        # 統計
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.running = 0
+        self.max_depth = 0
+        self._waits = deque(maxlen=sample_n)   # 秒：入列 → 開始執行
+        self._runs = deque(maxlen=sample_n)    # 秒：開始執行 → 完成
+
+    # ---------- 生命週期 ----------
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="hkbot-job")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        log.info("job queue started: workers=%d threads=%d maxsize=%d", self.workers, self.threads, self.maxsize)
+
+    async def stop(self, drain_timeout=10.0):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning("job queue stop: %d jobs left undone", self._queue.qsize())
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=False)
+
+    @property
+    def started(self):
+        return bool(self._tasks)
+
+    # ---------- 排隊 ----------
+    def submit(self, fn, *args, **kwargs):
+        """
+        排入一個 async 函式，立即回傳 asyncio.Future（需要結果時可 await）。
+        佇列已滿時丟 JobQueueFull。
+        """
+        if not self._tasks:
+            raise RuntimeError("job queue not started")
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((time.monotonic(), fn, args, kwargs, fut))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull(f"job queue full ({self.maxsize})")
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return fut
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """在 job 專用 thread pool 執行阻塞函式（帶上目前的 contextvars，例如路由標籤）。"""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, lambda: ctx.run(fn, *args, **kwargs))
+
+    async def _worker(self, idx):
+        while True:
+            enq_at, fn, args, kwargs, fut = await self._queue.get()
+            start = time.monotonic()
+            self._waits.append(start - enq_at)
+            self.running += 1
+            try:
+                res = await fn(*args, **kwargs)
+                self.completed += 1
+                if not fut.done():
+                    fut.set_result(res)
+            except asyncio.CancelledError:
+                if not fut.done():
+                    fut.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                log.exception("job %s failed: %r", getattr(fn, "__name__", fn), e)
+                if not fut.done():
+                    fut.set_exception(e)
+                    fut.exception()  # 沒人 await 時避免 "exception never retrieved"
+            finally:
+                self.running -= 1
+                self._runs.append(time.monotonic() - start)
+                self._queue.task_done()
+
+    # ---------- 統計 ----------
+    def stats(self):
+        waits, runs = list(self._waits), list(self._runs)
+        return {
+            "workers": self.workers,
+            "threads": self.threads,
+            "depth": self._queue.qsize() if self._queue else 0,
+            "max_depth": self.max_depth,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "avg": round(1000 * sum(waits) / len(waits), 2) if waits else 0.0,
+                "p95": round(1000 * _pct(waits, 0.95), 2),
+                "max": round(1000 * max(waits), 2) if waits else 0.0,
+            },
+            "run_ms": {
+                "avg": round(1000 * sum(runs) / len(runs), 2) if runs else 0.0,
+                "p95": round(1000 * _pct(runs, 0.95), 2),
+                "max": round(1000 * max(runs), 2) if runs else 0.0,
+            },
+        }
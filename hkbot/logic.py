@@ -1,77 +1,142 @@
 # hkbot/logic.py
 
+import hashlib
+import logging
+import os
 import re
-import requests
+from datetime import datetime
 import pandas as pd
-import yfinance as yf
+
+from hkbot import backtest, deadline, providers, universe
+from hkbot.history import HKT, HistoryCache, is_market_open
+from hkbot.names import NAMES_TIMEOUT, NameResolver
+from hkbot.indicators import IndicatorEngine
+from hkbot.intraday import INTERVALS, IntradayCache, to_datetime
+from hkbot.metrics import span, SHARED_ERRORS, UPSTREAM_ERRORS
+from hkbot import portfolio
+from hkbot.precompute import Precomputer
+from hkbot.signals import mode_params, recommend_frames, score_signals
+from hkbot.shared import SHARED_CACHE_ENABLED, SharedBarStore, SharedCache
+from hkbot.store import BarStore
+from hkbot.ttlcache import TTLCache
+
+log = logging.getLogger("uvicorn.error")
+
+BAR_STORE_ENABLED = os.getenv("HKBOT_BAR_STORE", "1") == "1"   # 磁碟 K 線庫（重啟免重抓）
 
 # ---------- 代碼驗證 ----------
+# 港股代碼總表（hkbot.universe）：總表完整時擋掉未上市代碼，也能用中 / 英文名稱找代碼
+_universe = universe.default()
+
 def validate_hk_stock_code(input_code: str):
-    if not input_code:
+    sym = universe.to_symbol(input_code)               # 06618 → 6618.HK（Yahoo 的寫法）
+    if sym is None:
         return None
-    code = input_code.strip().upper().replace('.HK','')
-    if not code.isdigit() or len(code) > 5:
-        return None
-    return f"{code.zfill(4)}.HK"
+    return sym if _universe.is_listed(sym) else None   # 未上市（價錢、日期、打錯）不下載
+
+# 1~5 位數字（不是價錢 12.5、日期 2024-01-05、時間 10:30 的一部分）、一段中文、一段英文字
+_TOKENS = re.compile(r"(?<![0-9A-Za-z_.:/-])(\d{1,5})(?![0-9A-Za-z_:/-]|\.\d)"
+                     r"|([\u3400-\u9fff\uf900-\ufaff]+)|([A-Za-z][A-Za-z&'.-]*(?:[ \t]+[A-Za-z][A-Za-z&'.-]*)*)")
+_PARAMS = re.compile(r"\b[A-Za-z]+\s*=\s*\S+")
 
 def parse_codes_from_text(text: str, max_n=5):
-    # 抓 1~5 位數字，避免把電話號碼吃進來；你也可要求用逗號分隔
-    cands = re.findall(r'\b(\d{1,5})\b', text)
+    # 依出現順序收代碼或完整名稱（「騰訊 阿里 1810」）；mode= / days= 等參數先拿掉，避免數字被當成代碼
+    # 名稱只認完整名稱 / 別名，一般聊天不會變成代碼；部分名稱請用 find 指令（search_text）
     codes = []
-    for c in cands:
-        sym = validate_hk_stock_code(c)
-        if sym and sym not in codes:
-            codes.append(sym)
+    for m in _TOKENS.finditer(_PARAMS.sub(" ", text)):
+        digits, zh, phrase = m.groups()
+        if digits:
+            found = [validate_hk_stock_code(digits)]
+        elif zh:
+            found = _universe.match_run(zh)
+        else:
+            found = _universe.match_phrase(phrase)
+        for sym in found:
+            if sym and sym not in codes:
+                codes.append(sym)
         if len(codes) >= max_n:
             break
-    return codes
+    return codes[:max_n]
+
+# 多 worker 共用的 SQLite 快取（K 線 / 名稱 / 摘要 + 跨 process 下載鎖），HKBOT_SHARED_CACHE=1 開啟
+_shared = SharedCache() if SHARED_CACHE_ENABLED else None
+
+# ---------- 行情來源（hkbot.providers：yfinance / 本機檔案，hedge + circuit breaker） ----------
+_market = providers.from_env()
+
+# ---------- 名稱查詢（Yahoo API 批次 + 長效快取，找不到就回 symbol） ----------
+_names = NameResolver(fetch=_market.names, shared=_shared)
+
+def search_text(query: str, limit=8):
+    """find 指令：名稱片段（中文子字串 / 英文前綴）→ 候選代碼清單文字。"""
+    hits = _universe.search(query, limit=limit)
+    if not hits:
+        return f"🔎 找不到「{query}」，請輸入代碼或完整名稱。"
+    lines = [f"🔎 「{query}」可能是："] + [f"{s.split('.')[0]} {_universe.names.get(s, s)}" for s in hits]
+    return "\n".join(lines)
+
+def get_stock_names_batch(symbols):
+    try:
+        return _names.resolve(symbols, timeout=deadline.cap(NAMES_TIMEOUT))
+    except Exception as e:
+        log.warning("name lookup failed %s: %r", symbols, e)
+        return {s: s for s in symbols}
 
-# ---------- 名稱查詢（Yahoo API，找不到就回 symbol） ----------
 def get_stock_names(symbol: str):
+    return get_stock_names_batch([symbol]).get(symbol, symbol)
+
+# ---------- 批次下載 ----------
+_split_download = providers.split_download
+
+def _download(symbols, period=None, start=None, timeout=None, interval="1d"):
+    """經行情來源下載（period 整段 / start 增量；interval 1d 或盤中 1m / 5m / 15m）；錯誤往上丟，由快取層處理。"""
     try:
-        r = requests.get(
-            "https://query1.finance.yahoo.com/v7/finance/quote",
-            params={"symbols": symbol, "lang": "zh-Hant-TW", "region": "TW"},
-            timeout=6
-        )
-        res = (r.json().get("quoteResponse") or {}).get("result") or []
-        if res:
-            name = res[0].get("shortName") or res[0].get("longName") or res[0].get("displayName")
-            return name or symbol
+        with span("download"):
+            return _market.download(symbols, period=period, start=start, timeout=timeout, interval=interval)
     except Exception:
-        pass
-    return symbol
+        UPSTREAM_ERRORS.inc(upstream="market")
+        raise
+
+# 各檔日線快取：重複查詢直接切片，過期時只補抓最新 K 線；冷啟動先讀磁碟 K 線庫
+# 開啟共享快取時 K 線改存在共享 SQLite，並用跨 process 鎖讓同一檔只有一個 worker 去抓
+if _shared is not None:
+    _store = SharedBarStore(_shared)
+else:
+    _store = BarStore() if BAR_STORE_ENABLED else None
+_history = HistoryCache(_download, store=_store, locks=_shared)
+# 盤中分鐘 K 線：每檔一個固定大小的環形緩衝區，只補抓新 K 線
+_intraday = IntradayCache(_download)
 
-# ---------- yfinance 批次下載 ----------
-def get_multiple_stocks_data(symbols, days=90):
+def get_multiple_stocks_data(symbols, days=90, interval="1d"):
     if not symbols:
         return {}
-    data = {}
+    if interval != "1d":
+        try:
+            return _intraday.bars(symbols, interval, convert=_bars_frame)
+        except Exception as e:
+            log.warning("intraday data failed %s %s: %r", interval, symbols, e)
+            return {}
     try:
-        df = yf.download(
-            tickers=" ".join(symbols),
-            period=f"{max(days, 60)}d",  # 至少 60 天，避免資料過少
-            interval="1d",
-            group_by="ticker",
-            auto_adjust=False,
-            progress=False,
-            threads=True
-        )
-        for sym in symbols:
-            if isinstance(df.columns, pd.MultiIndex):
-                if sym in df.columns.levels[0]:
-                    sub = df[sym].dropna().copy()
-                else:
-                    continue
-            else:
-                sub = df.copy()
-            if not sub.empty:
-                need = [c for c in ['Open','High','Low','Close','Volume'] if c in sub.columns]
-                if len(need) >= 4:
-                    data[sym] = sub[need].copy()
-    except Exception:
-        pass
-    return data
+        return _history.get(symbols, days=max(days, 60))  # 至少 60 天，避免資料過少
+    except Exception as e:
+        log.warning("history data failed %s: %r", symbols, e)
+        return {}
+
+def _bars_frame(arr):
+    df = pd.DataFrame({c: arr[i] for i, c in enumerate(["Open", "High", "Low", "Close", "Volume"], start=1)},
+                      index=pd.DatetimeIndex(arr[0].astype("datetime64[s]")))
+    df.index.name = "Datetime"
+    return df
+
+def cache_stats():
+    out = {"history": _history.stats(), "intraday": _intraday.stats(), "names": _names.stats(), "indicators": _indicators.stats(),
+           "summary": {**_summaries.stats(), "shared_hits": _summary_shared["hits"]}}
+    if _store is not None:
+        out["bar_store"] = _store.stats()
+    out["precompute"] = _precomputed.stats()
+    out["backtest"] = _backtests.stats()
+    out["providers"] = _market.stats()
+    return out
 
 # ---------- AI 建議（沿用你 V9.4 的簡化版） ----------
 def _rsi(series: pd.Series, period=14):
@@ -87,12 +152,7 @@ def _rsi(series: pd.Series, period=14):
 def ai_recommendation(df: pd.DataFrame, mode="swing"):
     if df is None or df.empty:
         return {'label': '持有', 'reason': '資料不足'}
-    if mode == "short":
-        ema_fast, ema_slow, rsi_p, vol_n, min_rows = 10, 20, 7, 10, 30
-    elif mode == "position":
-        ema_fast, ema_slow, rsi_p, vol_n, min_rows = 50, 100, 14, 50, 80
-    else:
-        ema_fast, ema_slow, rsi_p, vol_n, min_rows = 20, 50, 14, 20, 50
+    ema_fast, ema_slow, rsi_p, vol_n, min_rows = mode_params(mode)
     if len(df) < min_rows:
         return {'label': '持有', 'reason': f'資料不足（<{min_rows} 筆）'}
     data = df.copy().astype(float)
@@ -110,59 +170,268 @@ def ai_recommendation(df: pd.DataFrame, mode="swing"):
     voln = float(last['VOLN']) if pd.notna(last['VOLN']) else None
 
     hi, lo = float(data['Close'].max()), float(data['Close'].min())
-    pos = (price - lo) / (hi - lo + 1e-9)
-
-    score, reasons = 0, []
-    if price > ema_f > ema_s:
-        score += 2; reasons.append(f"價格>EMA{ema_fast}>EMA{ema_slow}（多頭）")
-    elif price < ema_f < ema_s:
-        score -= 2; reasons.append(f"價格<EMA{ema_fast}<EMA{ema_slow}（空頭）")
-    else:
-        reasons.append("均線訊號混合")
-    if rsi < 35:
-        score += 1; reasons.append(f"RSI={rsi:.1f} 偏低")
-    elif rsi > 65:
-        score -= 1; reasons.append(f"RSI={rsi:.1f} 偏高")
-    if voln and voln > 0:
-        ratio = vol / max(1.0, voln)
-        if ratio >= 1.5:
-            score += 1; reasons.append(f"量能放大（{ratio:.2f}×）")
-        elif ratio <= 0.7:
-            score -= 1; reasons.append(f"量能偏弱（{ratio:.2f}×）")
-    if pos >= 0.85:
-        score -= 1; reasons.append("接近區間高位")
-    elif pos <= 0.15:
-        score += 1; reasons.append("接近區間低位")
-
-    if score >= 2: label = "買入"
-    elif score <= -2: label = "賣出"
-    else: label = "持有"
-    return {'label': label, 'reason': "；".join(reasons[:4])}
+    _, label, reason = score_signals(price, ema_f, ema_s, rsi, vol, voln, hi, lo, ema_fast, ema_slow)
+    return {'label': label, 'reason': reason}
+
+# 串流式指標：每個 (symbol, mode) 保存遞迴狀態，新 K 線 O(1) 更新、重複查詢直接命中
+_indicators = IndicatorEngine()
 
 # ---------- 把結果組成 WhatsApp 短訊 ----------
-def build_whatsapp_summary(symbols, days=90, mode="swing"):
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "600"))
+SUMMARY_CACHE_MAX = int(os.getenv("SUMMARY_CACHE_MAX", "5000"))
+SUMMARY_CACHE_BYTES = int(os.getenv("SUMMARY_CACHE_BYTES", str(8 * 1024 * 1024)))
+MODE_NAMES = {'short': '短線', 'swing': '波段', 'position': '中長線'}
+
+def _lines_size(lines):
+    return sum(len(k) + len(v.encode("utf-8")) + 64 for k, v in lines.items())
+
+# 已組好的每檔文字：key = (symbol 集合, mode, days, 各檔最後一根 K 線)，新 K 線進來自然失效
+# 逐檔回覆：每幾檔送一則（0 = 全部好了才送）
+SUMMARY_STREAM_GROUP = int(os.getenv("SUMMARY_STREAM_GROUP", "2"))
+SUMMARY_FOOTER = "— 本訊息僅供參考，非投資建議 —"
+NO_DATA_TEXT = "查無有效數據，請確認代碼或稍後再試。"
+
+_summaries = TTLCache(maxsize=SUMMARY_CACHE_MAX, ttl=SUMMARY_CACHE_TTL,
+                      max_bytes=SUMMARY_CACHE_BYTES, sizeof=_lines_size)
+_summary_shared = {"hits": 0}   # 本機快取沒有、共享快取（別的 worker 算好的）有
+
+def _summary_get(key):
+    rendered = _summaries.get(key)
+    if rendered is None and _shared is not None:
+        try:
+            rendered = _shared.get("summary", _shared_key(key))
+        except Exception as e:
+            log.warning("shared summary read failed: %r", e)
+            SHARED_ERRORS.inc(op="summary_read")
+            rendered = None
+        if rendered is not None:
+            _summary_shared["hits"] += 1
+            _summaries.set(key, rendered)
+    return rendered
+
+def _summary_set(key, rendered):
+    _summaries.set(key, rendered)
+    if _shared is not None:
+        try:
+            _shared.set("summary", _shared_key(key), rendered, ttl=SUMMARY_CACHE_TTL)
+        except Exception as e:
+            log.warning("shared summary write failed: %r", e)
+            SHARED_ERRORS.inc(op="summary_write")
+
+def _shared_key(key):
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+def _summary_key(symbols, data, days, mode):
+    bars = tuple(
+        (sym, str(data[sym].index[-1]), float(data[sym]['Close'].iat[-1]), float(data[sym]['Volume'].iat[-1]))
+        if sym in data else (sym,)
+        for sym in sorted(set(symbols))
+    )
+    return (mode, max(days, 60), bars)
+
+def _format_line(sym, name, last, chg, ai):
+    chg_str = f"{chg:+.2f}%" if chg is not None else "---"
+    return f"• {sym} {name}｜收 HK${last:.2f}（日變{chg_str}）｜AI：{ai['label']}（{ai['reason']}）"
+
+def _render_lines(symbols, data, mode, days):
+    """每檔一行：{symbol: line}。"""
+    with span("names"):
+        names = get_stock_names_batch([s for s in symbols if s in data])  # 一次問完
+    out = {}
+    for sym in dict.fromkeys(symbols):
+        df = data.get(sym)
+        if df is None or df.empty:
+            out[sym] = f"{sym}：無資料"
+            continue
+        last = df.iloc[-1]['Close']
+        chg = (last / df.iloc[-2]['Close'] - 1) * 100.0 if len(df) >= 2 else None
+        with span("recommend"):
+            ai = _indicators.recommend(sym, df, mode=mode, window=max(days, 60))
+        out[sym] = _format_line(sym, names.get(sym, sym), last, chg, ai)
+    return out
+
+# ---------- 收市後全市場預先計算（查表） ----------
+_precomputed = Precomputer(_download, locks=_shared)
+
+def precompute_market():
+    """重建全市場查表（排程 / CLI 呼叫）。"""
+    return _precomputed.run()
+
+def _table_covers(symbols, days):
+    table = _precomputed.table
+    return table.is_current() and table.covers(symbols, days)
+
+def _lines_from_table(symbols, days, mode):
+    """表有效且涵蓋所有代碼時直接組字（不下載、不算指標）；否則 None。"""
+    table = _precomputed.table
+    if not _table_covers(symbols, days):
+        return None
+    names = get_stock_names_batch(list(symbols))
+    out = {}
+    for sym in dict.fromkeys(symbols):
+        last, chg, ai = table.row(sym, mode)
+        out[sym] = _format_line(sym, names.get(sym, sym), last, chg, ai)
+    return out
+
+def top_signals_text(side="buy", mode="swing", n=10):
+    """全市場買入 / 賣出訊號排行（讀預先計算的表）。"""
+    table = _precomputed.table
+    if not len(table):
+        return "全市場資料尚未準備好（每個交易日收市後更新），請稍後再試。"
+    picks = table.top(mode, n=n, side=side)
+    title = "買入" if side == "buy" else "賣出"
+    lines = [f"🏆 {title}訊號排行｜模式：{MODE_NAMES.get(mode, '波段')}｜{table.session} 收市（共 {len(table)} 檔）"]
+    if not picks:
+        lines.append(f"目前沒有{title}訊號。")
+    names = get_stock_names_batch(picks) if picks else {}
+    for sym in picks:
+        last, chg, ai = table.row(sym, mode)
+        lines.append(_format_line(sym, names.get(sym, sym), last, chg, ai) + f"｜分數 {ai['score']:+d}")
+    lines.append(SUMMARY_FOOTER)
+    return "\n".join(lines)
+
+def _summary_header(days, mode):
+    return f"📊 期間：最近 {max(days,60)} 天｜模式：{ MODE_NAMES.get(mode,'波段') }"
+
+def _rendered_for(symbols, days, mode):
+    """{symbol: line}（查表優先，其次摘要快取）；整組都抓不到資料回 None。"""
+    rendered = _lines_from_table(symbols, days, mode)
+    if rendered is not None:
+        return rendered
     data = get_multiple_stocks_data(symbols, days=days)
     if not data:
-        return "查無有效數據，請確認代碼或稍後再試。"
+        return None
+    key = _summary_key(symbols, data, days, mode)
+    rendered = _summary_get(key)
+    if rendered is None:
+        rendered = _render_lines(symbols, data, mode, days)
+        _summary_set(key, rendered)
+    return rendered
+
+def _stale_note(symbols):
+    """請求預算內等不到新 K 線、暫用快取的代碼 → 一行標示；沒有回 None。"""
+    dl = deadline.current()
+    stale = [s for s in symbols if dl is not None and s in dl.stale]
+    if not stale:
+        return None
+    when = datetime.fromtimestamp(min(dl.stale[s] for s in stale), HKT).strftime("%m-%d %H:%M")
+    who = " ".join(stale) if len(stale) <= 8 else f"{len(stale)} 檔"
+    return f"⏳ 行情更新較慢：{who} 暫用 {when} 的快取資料，稍後再查會是最新。"
+
+def iter_whatsapp_summary(symbols, days=90, mode="swing", group=SUMMARY_STREAM_GROUP):
+    """
+    逐組產生回覆的行（list[str]）：每 group 檔的資料 / 指標一好就交出去，先回第一批。
+    標題跟第一組有資料的一起出，免責聲明跟最後一組一起出；抓不到的檔併到下一批。
+    查表涵蓋全部代碼時不用下載，一次出完。
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if group <= 0 or _table_covers(symbols, days):
+        group = len(symbols) or 1
+    groups = [symbols[i:i + group] for i in range(0, len(symbols), group)] or [[]]
+    started, pending = False, []
+    for i, grp in enumerate(groups):
+        last = i == len(groups) - 1
+        rendered = _rendered_for(grp, days, mode)
+        if rendered is None:
+            pending.extend(f"{sym}：無資料" for sym in grp)
+        else:
+            pending.extend(rendered[sym] for sym in grp)   # 依使用者輸入的順序排
+            note = _stale_note(grp)
+            if note:
+                pending.append(note)
+            if not started:
+                pending.insert(0, _summary_header(days, mode))
+                started = True
+        if last:
+            yield pending + [SUMMARY_FOOTER] if started else [NO_DATA_TEXT]
+        elif rendered is not None:
+            yield pending
+            pending = []
 
+def build_whatsapp_summary(symbols, days=90, mode="swing"):
+    """整份摘要一次組好（一次下載全部代碼）；不截斷，送出時由 cloud.split_text() 分則。"""
     lines = []
-    lines.append(f"📊 期間：最近 {max(days,60)} 天｜模式：{ {'short':'短線','swing':'波段','position':'中長線'}.get(mode,'波段') }")
-    for sym in symbols:
-        df = data.get(sym)
-        if df is None or df.empty: 
+    for part in iter_whatsapp_summary(symbols, days=days, mode=mode, group=0):
+        lines.extend(part)
+    return "\n".join(lines)
+
+# ---------- 盤中分鐘 K 線（1m / 5m / 15m；指標直接在環形緩衝區上算） ----------
+def build_intraday_summary(symbols, interval="5m", mode="short"):
+    if interval not in INTERVALS:
+        return f"不支援的週期：{interval}（可用 {' / '.join(INTERVALS)}）"
+    with span("download"):
+        rows = _intraday.recommend(symbols, interval, mode=mode)
+    if not rows:
+        return NO_DATA_TEXT
+    with span("names"):
+        names = get_stock_names_batch([s for s in symbols if s in rows])
+    lines = [f"⏱️ 盤中 {interval} K 線｜模式：{ MODE_NAMES.get(mode,'波段') }"]
+    if not is_market_open():
+        lines.append("（非交易時段：顯示最近一節的 K 線）")
+    for sym in dict.fromkeys(symbols):
+        r = rows.get(sym)
+        if r is None:
             lines.append(f"{sym}：無資料")
             continue
-        name = get_stock_names(sym)
-        last = df.iloc[-1]['Close']
-        if len(df) >= 2:
-            prev = df.iloc[-2]['Close']
-            chg = (last/prev - 1) * 100.0
-            chg_str = f"{chg:+.2f}%"
-        else:
-            chg_str = "---"
-        ai = ai_recommendation(df, mode=mode)
-        lines.append(f"• {sym} {name}｜收 HK${last:.2f}（日變{chg_str}）｜AI：{ai['label']}（{ai['reason']}）")
-    lines.append("— 本訊息僅供參考，非投資建議 —")
-    txt = "\n".join(lines)
-    # WhatsApp 單則訊息最好 < 4096 chars
-    return txt[:3500]
\ No newline at end of file
+        chg = f"{r['chg']:+.2f}%" if r["chg"] is not None else "---"
+        at = to_datetime(r["time"]).strftime("%m-%d %H:%M")
+        lines.append(f"• {sym} {names.get(sym, sym)}｜{at} HK${r['last']:.2f}（較昨收 {chg}）"
+                     f"｜AI：{r['label']}（{r['reason']}）")
+    note = _stale_note([s for s in symbols if s in rows])
+    return "\n".join(lines + [note, SUMMARY_FOOTER] if note else lines + [SUMMARY_FOOTER])
+
+# ---------- 組合 / 自選清單（大量代碼：分批平行下載 + 向量化評分 + 分頁） ----------
+def build_portfolio_summary(symbols, days=120, mode="swing", page=1):
+    if not symbols:
+        return "清單是空的：輸入 pf 加代碼（例如 pf 700 9988 1810），或 pf save 加代碼存成自選清單。"
+    ranked = portfolio.rank(get_multiple_stocks_data, symbols, days=days, mode=mode, table=_precomputed.table)
+    if not ranked.rows:
+        return NO_DATA_TEXT
+    start = (max(1, page) - 1) * portfolio.PORTFOLIO_PAGE
+    shown = [r[0] for r in ranked.rows[start:start + portfolio.PORTFOLIO_PAGE]] or [r[0] for r in ranked.rows]
+    with span("names"):
+        names = get_stock_names_batch(shown)   # 只查這一頁
+    header = f"📁 組合排行｜期間：最近 {max(days,60)} 天｜模式：{ MODE_NAMES.get(mode,'波段') }"
+    note = _stale_note(symbols)
+    text = portfolio.format_page(ranked, names, page=page, header=header)
+    return "\n".join([text, note, SUMMARY_FOOTER] if note else [text, SUMMARY_FOOTER])
+
+# 提醒 watcher 每輪的報價：所有有提醒的檔一次整批抓（走同一個 K 線快取），訊號一次向量化算
+ALERT_DAYS = int(os.getenv("ALERT_DAYS", "120"))
+
+def alert_quotes(symbols, modes):
+    """(symbols, {mode: [symbol]}) → ({symbol: 最新收市 / 現價}, {(symbol, mode): AI 建議})。"""
+    frames = get_multiple_stocks_data(symbols, days=ALERT_DAYS)
+    prices = {s: float(df["Close"].iloc[-1]) for s, df in frames.items() if df is not None and not df.empty}
+    labels = {}
+    for mode, syms in modes.items():
+        got = recommend_frames({s: frames[s] for s in syms if s in prices}, mode=mode)
+        labels.update({(s, mode): r["label"] for s, r in got.items()})
+    return prices, labels
+
+# 回測結果：讀 python -m hkbot.backtest run 的輸出；表內沒有的檔用 K 線庫現有資料即時算（只放記憶體）
+BACKTEST_MAX = int(os.getenv("BACKTEST_MAX", "5"))
+_backtests = backtest.Results(store=_store)
+
+def backtest_text(symbols, mode="swing"):
+    if not symbols:
+        return "請在 backtest 後面加代碼，例如：backtest 9988 mode=swing"
+    symbols = symbols[:BACKTEST_MAX]
+    names = get_stock_names_batch(symbols)
+    overall = _backtests.overall(mode)
+    parts = []
+    for sym in symbols:
+        with span("backtest"):
+            res = _backtests.get(sym)
+        if res is None:
+            parts.append(f"🧪 {sym} {names.get(sym, '')}：暫無回測資料（K 線庫沒有這檔的歷史）")
+            continue
+        if mode not in res or not any(v["n"] for v in res[mode]["labels"].values()):
+            have = f"只有 {res['bars']} 根日 K，" if "bars" in res else ""
+            parts.append(f"🧪 {sym} {names.get(sym, '')}：歷史不足，無法回測（{have}此模式至少要 "
+                         f"{backtest.min_bars(mode)} 根）。管理員可先執行 "
+                         f"python -m hkbot.backtest run --fetch-years N（例如 3）把多年日 K 抓進 K 線庫。")
+            continue
+        parts.append(backtest.format_result(sym, names.get(sym, ""), res, mode, overall,
+                                            mode_name=MODE_NAMES.get(mode, "波段")))
+    return "\n\n".join(parts + ["— 過去表現不代表未來，非投資建議 —"])
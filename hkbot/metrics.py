@@ -0,0 +1,186 @@
+# hkbot/metrics.py
+"""
+輕量的 Prometheus 指標（不依賴 prometheus_client）：Counter / Histogram + 分段計時。
+
+    with span("download"):          # 記錄到 hkbot_stage_seconds{stage="download",route=...}
+        ...
+    route_var.set("wa")              # 目前請求的路由（contextvar，thread pool 內也看得到）
+
+/metrics 端點呼叫 render() 輸出文字格式；其他模組的 stats() 透過 register_collector() 併入。
+每次記錄只是一次 bisect + 兩個加法（持鎖），可以常開。
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+route_var = contextvars.ContextVar("hkbot_route", default="-")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name, help_, labels=()):
+        self.name, self.help, self.labels = name, help_, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_num(v)}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name, help_, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help_, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}   # key -> [counts per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, row in items:
+            acc = 0
+            for b, c in zip(self.buckets, row):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, {'le': _fmt_num(b)})} {acc}")
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, {'le': '+Inf'})} {row[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_num(row[-2])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {row[-1]}")
+        return out
+
+
+# ---------- 內建指標 ----------
+STAGE_SECONDS = Histogram("hkbot_stage_seconds", "Time spent per pipeline stage", ("route", "stage"))
+STAGE_ERRORS = Counter("hkbot_stage_errors_total", "Exceptions raised per pipeline stage", ("route", "stage"))
+REQUEST_SECONDS = Histogram("hkbot_request_seconds", "End-to-end latency of code queries",
+                            ("route", "mode", "symbols"))
+REQUESTS = Counter("hkbot_requests_total", "Handled messages by route and kind", ("route", "kind"))
+UPSTREAM_ERRORS = Counter("hkbot_upstream_errors_total", "Failed upstream calls", ("upstream",))
+STALE_SERVED = Counter("hkbot_stale_served_total", "Symbols answered from stale cached bars within the deadline",
+                       ("route",))
+SHARED_ERRORS = Counter("hkbot_shared_cache_errors_total",
+                        "Failed shared-cache (SQLite) operations; the request continues without it", ("op",))
+DEADLINE_EXCEEDED = Counter("hkbot_deadline_exceeded_total", "Requests that ran out of time budget", ("route",))
+PROVIDER_SECONDS = Histogram("hkbot_provider_seconds", "Market-data provider call latency",
+                             ("provider", "op", "outcome"))
+PROVIDER_HEDGES = Counter("hkbot_provider_hedges_total", "Hedged / failover requests sent to a backup provider",
+                          ("op", "reason"))
+PROVIDER_FAST_FAILS = Counter("hkbot_provider_fast_fails_total", "Calls skipped because the circuit was open",
+                              ("provider", "op"))
+
+_metrics = [STAGE_SECONDS, STAGE_ERRORS, REQUEST_SECONDS, REQUESTS, UPSTREAM_ERRORS, STALE_SERVED,
+            SHARED_ERRORS, DEADLINE_EXCEEDED, PROVIDER_SECONDS, PROVIDER_HEDGES, PROVIDER_FAST_FAILS]
+_collectors = []
+
+
+def symbols_bucket(n):
+    if n <= 1:
+        return "1"
+    if n <= 5:
+        return "2-5"
+    if n <= 20:
+        return "6-20"
+    return "21+"
+
+
+@contextmanager
+def span(stage, route=None):
+    """分段計時；例外會計入 hkbot_stage_errors_total 後照樣往上丟。"""
+    r = route or route_var.get()
+    t = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(route=r, stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - t, route=r, stage=stage)
+
+
+def register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(prefix, fn):
+    """fn() 回傳 {section: {key: number}}（各模組的 stats()），以 gauge 形式輸出。"""
+    _collectors.append((prefix, fn))
+
+
+def _flatten(prefix, obj, out):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            _flatten(f"{prefix}_{k}", v, out)
+    elif isinstance(obj, bool):
+        out.append((prefix, int(obj)))
+    elif isinstance(obj, (int, float)):
+        out.append((prefix, obj))
+
+
+def render():
+    lines = []
+    for m in _metrics:
+        lines.extend(m.render())
+    for prefix, fn in _collectors:
+        try:
+            data = fn()
+        except Exception:
+            continue
+        flat = []
+        for section, stats in data.items():
+            _flatten(f"{prefix}_{section}", stats, flat)
+        seen = set()
+        for name, value in flat:
+            name = "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+            if name not in seen:
+                lines.append(f"# TYPE {name} gauge")
+                seen.add(name)
+            lines.append(f"{name} {_fmt_num(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,203 @@
+# hkbot/names.py
+"""
+股票名稱查詢：一次批次問 Yahoo，結果放長效快取（可存檔），並用內附的港股中文名稱表預先填好。
+查不到或逾時一律回 symbol，不拖慢回覆。
+"""
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from hkbot.config import data_path
+from hkbot.metrics import SHARED_ERRORS, UPSTREAM_ERRORS
+from hkbot.ttlcache import TTLCache
+from hkbot.universe import to_symbol
+
+log = logging.getLogger("uvicorn.error")
+
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+NAMES_TTL = float(os.getenv("NAMES_TTL", str(30 * 86400)))      # 名稱幾乎不變：預設 30 天
+NAMES_NEG_TTL = float(os.getenv("NAMES_NEG_TTL", "600"))        # 查不到的 symbol 暫不重問
+NAMES_TIMEOUT = float(os.getenv("NAMES_TIMEOUT", "3"))          # 整批只等這麼久
+NAMES_CACHE_FILE = os.getenv("NAMES_CACHE_FILE", data_path("names.json"))
+BUNDLED_NAMES = os.path.join(os.path.dirname(__file__), "data", "hk_names.csv")
+_MISS = object()
+
+
+def load_bundled(path=BUNDLED_NAMES):
+    """讀內附的 code→中文名稱表，回傳 {"0700.HK": "騰訊控股", ...}。"""
+    out = {}
+    try:
+        with open(path, encoding="utf-8") as fh:
+            for row in csv.DictReader(fh):
+                sym = to_symbol(row.get("code"))
+                name = (row.get("name_zh") or row.get("name_en") or "").strip()
+                if sym and name:
+                    out[sym] = name
+    except FileNotFoundError:
+        pass
+    return out
+
+
+def fetch_quote_names(symbols, timeout=NAMES_TIMEOUT):
+    """一次 Yahoo quote 請求查多檔；回傳查得到的 {symbol: name}。"""
+    r = requests.get(
+        QUOTE_URL,
+        params={"symbols": ",".join(symbols), "lang": "zh-Hant-TW", "region": "TW"},
+        timeout=timeout
+    )
+    res = (r.json().get("quoteResponse") or {}).get("result") or []
+    out = {}
+    for q in res:
+        sym = q.get("symbol")
+        name = q.get("shortName") or q.get("longName") or q.get("displayName")
+        if sym and name:
+            out[sym] = name
+    return out
+
+
+class NameResolver:
+    def __init__(self, path=NAMES_CACHE_FILE, ttl=NAMES_TTL, fetch=fetch_quote_names, seed=True, shared=None):
+        """shared: 選用的 hkbot.shared.SharedCache（多 worker 共用查過的名稱）。"""
+        self.path = path
+        self.shared = shared
+        self.cache = TTLCache(maxsize=50000, ttl=ttl)
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.shared_hits = 0
+        if seed:
+            for sym, name in load_bundled().items():
+                self.cache.set(sym, name)
+        self._load()
+
+    # ---------- 持久化 ----------
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                saved = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return
+        now = time.time()
+        for sym, (name, expires_at) in saved.items():
+            if expires_at > now:
+                self.cache.set(sym, name, expires_at=expires_at)
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            snap = {k: [v, exp] for k, v, exp in self.cache.items() if v is not None}
+            self._dirty = False
+        try:
+            d = os.path.dirname(self.path) or "."
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-names-")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(snap, fh, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("names cache save failed: %r", e)
+
+    # ---------- 查詢 ----------
+    def resolve(self, symbols, timeout=NAMES_TIMEOUT):
+        """回傳 {symbol: name}；快取沒有的整批問一次，失敗就回 symbol。"""
+        out, missing = {}, []
+        for sym in dict.fromkeys(symbols):
+            name = self.cache.get(sym, _MISS)
+            if name is _MISS:
+                missing.append(sym)
+                name = None
+            out[sym] = name or sym
+        if not missing:
+            return out
+        if timeout is not None and timeout < 0.1:
+            return out   # 請求的時間預算用完：先顯示代碼，不問上游
+        if self.shared is None:
+            self._lookup(missing, out, timeout)
+            return out
+
+        # 多 worker：先讀共享快取；仍缺的拿鎖自己問，別的 worker 正在問的等它寫回
+        missing = self._from_shared(missing, out)
+        if not missing:
+            return out
+        try:
+            owner, held = self.shared.acquire([f"names:{s}" for s in missing], ttl=timeout + 5)
+        except Exception as e:
+            log.warning("shared lock acquire failed: %r", e)
+            SHARED_ERRORS.inc(op="lock_acquire")
+            owner, held = None, [f"names:{s}" for s in missing]
+        mine = [n.split(":", 1)[1] for n in held]
+        busy = [s for s in missing if s not in set(mine)]
+        try:
+            if mine:
+                self._lookup(mine, out, timeout)
+        finally:
+            if owner and held:
+                try:
+                    self.shared.release(owner, held)
+                except Exception as e:
+                    log.warning("shared lock release failed: %r", e)
+                    SHARED_ERRORS.inc(op="lock_release")
+        if busy:
+            try:
+                self.shared.wait([f"names:{s}" for s in busy], timeout)
+            except Exception as e:
+                log.warning("shared lock wait failed: %r", e)
+                SHARED_ERRORS.inc(op="lock_wait")
+            self._from_shared(busy, out)
+        return out
+
+    def _lookup(self, missing, out, timeout):
+        """向上游整批問一次，寫回本機（與共享）快取。"""
+        try:
+            self.upstream_calls += 1
+            got = self._fetch(missing, timeout=timeout)
+        except Exception as e:
+            self.upstream_errors += 1
+            UPSTREAM_ERRORS.inc(upstream="yahoo_quote")
+            log.warning("name lookup failed %s: %r", missing, e)
+            return
+        for sym in missing:
+            name = got.get(sym)
+            if name:
+                self.cache.set(sym, name)
+                out[sym] = name
+            else:
+                self.cache.set(sym, None, ttl=NAMES_NEG_TTL)   # 負面快取：短時間內不重問
+        self._dirty = True
+        self.save()
+        if self.shared is not None:
+            try:
+                self.shared.set_many("names", {s: got[s] for s in missing if got.get(s)}, ttl=self.cache.ttl)
+                self.shared.set_many("names", {s: None for s in missing if not got.get(s)}, ttl=NAMES_NEG_TTL)
+            except Exception as e:
+                log.warning("shared names write failed: %r", e)
+                SHARED_ERRORS.inc(op="names_write")
+
+    def _from_shared(self, missing, out):
+        """先問共享快取（別的 worker 可能查過）；回傳仍然沒有的。"""
+        try:
+            found = self.shared.get_many("names", missing)
+        except Exception as e:
+            log.warning("shared names read failed: %r", e)
+            SHARED_ERRORS.inc(op="names_read")
+            return missing
+        for sym, name in found.items():
+            self.cache.set(sym, name, ttl=None if name else NAMES_NEG_TTL)
+            out[sym] = name or sym
+        self.shared_hits += len(found)
+        return [s for s in missing if s not in found]
+
+    def stats(self):
+        return {**self.cache.stats(), "upstream_calls": self.upstream_calls,
+                "upstream_errors": self.upstream_errors, "shared_hits": self.shared_hits}
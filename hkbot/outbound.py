@@ -0,0 +1,232 @@
+# hkbot/outbound.py
+"""
+外送排程器：所有 Graph API 發送都經過這裡。
+
+- Token bucket 限速：全域一個，另外每個 phone number ID 各一個。先看號碼的 bucket：被限速的號碼
+  延後重排（不佔 worker、不扣全域額度），其他號碼照常送；號碼有額度才拿全域 token。
+- 可重試的錯誤（429 / 5xx / 連線逾時）以指數退避 + 抖動重排，會參考 Retry-After。
+- 優先順序：QUICK（ping、help 選單、確認訊息）先於 NORMAL，再先於 BULK（長篇分析）。
+"""
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+
+import httpx
+
+from hkbot.cloud import GraphAPIError, PHONE_ID
+from hkbot.metrics import span, route_var, UPSTREAM_ERRORS
+
+log = logging.getLogger("uvicorn.error")
+
+PRIORITY_QUICK, PRIORITY_NORMAL, PRIORITY_BULK = 0, 1, 2
+LANES = {PRIORITY_QUICK: "quick", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "bulk"}
+
+OUT_WORKERS = int(os.getenv("OUT_WORKERS", "8"))
+OUT_RATE_GLOBAL = float(os.getenv("OUT_RATE_GLOBAL", "80"))      # 每秒則數（<=0 不限）
+OUT_RATE_PER_PHONE = float(os.getenv("OUT_RATE_PER_PHONE", "20"))
+OUT_MAX_RETRIES = int(os.getenv("OUT_MAX_RETRIES", "4"))
+OUT_BACKOFF_BASE = float(os.getenv("OUT_BACKOFF_BASE", "0.5"))
+OUT_BACKOFF_MAX = float(os.getenv("OUT_BACKOFF_MAX", "8"))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0          # 累計因限速而等待的秒數
+
+    def _take(self):
+        """有 token 就拿一個回 0；沒有就回需要等幾秒（不拿）。"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            d = self._take()
+            if d <= 0:
+                return
+            self.waited += d
+            await asyncio.sleep(d)
+
+
+def is_retryable(e):
+    if isinstance(e, GraphAPIError):
+        return e.status_code == 429 or (e.status_code or 0) >= 500
+    return isinstance(e, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class _Item:
+    __slots__ = ("fn", "args", "kwargs", "fut", "phone_id", "priority", "attempt", "enq_at", "route")
+
+    def __init__(self, fn, args, kwargs, fut, phone_id, priority):
+        self.fn, self.args, self.kwargs, self.fut = fn, args, kwargs, fut
+        self.phone_id, self.priority = phone_id, priority
+        self.attempt = 0
+        self.enq_at = time.monotonic()
+        self.route = route_var.get()
+
+
+class OutboundScheduler:
+    def __init__(self, workers=OUT_WORKERS, global_rate=OUT_RATE_GLOBAL, per_phone_rate=OUT_RATE_PER_PHONE,
+                 max_retries=OUT_MAX_RETRIES, backoff_base=OUT_BACKOFF_BASE, backoff_max=OUT_BACKOFF_MAX):
+        self.workers = max(1, int(workers))
+        self.per_phone_rate = per_phone_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._global = TokenBucket(global_rate)
+        self._buckets = {}
+        self._queue = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self._pending_retries = set()
+        self.sent = 0
+        self.retried = 0
+        self.deferred = 0          # 號碼被限速、延後重排的次數
+        self.failed = 0
+        self._depth = {name: 0 for name in LANES.values()}
+        self.lane_sent = {name: 0 for name in LANES.values()}
+        self.lane_wait = {name: 0.0 for name in LANES.values()}
+
+    # ---------- 生命週期 ----------
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout=10.0):
+        if not self._tasks:
+            return
+        async def _drain():
+            while True:
+                await self._queue.join()
+                if not self._pending_retries:
+                    return
+                await asyncio.sleep(0.05)   # 還有排定的重試
+
+        try:
+            await asyncio.wait_for(_drain(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning("outbound stop: %d sends left undone",
+                        self._queue.qsize() + len(self._pending_retries))
+        for h in self._pending_retries:
+            h.cancel()
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- 發送 ----------
+    def submit(self, fn, *args, priority=PRIORITY_NORMAL, phone_id=None, **kwargs):
+        """排入一次發送（fn 為 hkbot.cloud.asend_* 之一），回傳 asyncio.Future。"""
+        if not self._tasks:
+            raise RuntimeError("outbound scheduler not started")
+        fut = asyncio.get_running_loop().create_future()
+        if phone_id:
+            kwargs["phone_id"] = phone_id
+        self._put(_Item(fn, args, kwargs, fut, phone_id or PHONE_ID, priority))
+        return fut
+
+    async def send(self, fn, *args, priority=PRIORITY_NORMAL, phone_id=None, **kwargs):
+        return await self.submit(fn, *args, priority=priority, phone_id=phone_id, **kwargs)
+
+    def _put(self, item):
+        self._depth[LANES.get(item.priority, "normal")] += 1
+        self._queue.put_nowait((item.priority, next(self._seq), item))
+
+    def _bucket(self, phone_id):
+        b = self._buckets.get(phone_id)
+        if b is None:
+            b = self._buckets[phone_id] = TokenBucket(self.per_phone_rate)
+        return b
+
+    def _backoff(self, item, e):
+        d = min(self.backoff_max, self.backoff_base * (2 ** (item.attempt - 1)))
+        d *= random.uniform(0.5, 1.0)
+        ra = getattr(e, "retry_after", None)
+        return max(d, ra) if ra else d
+
+    def _retry_later(self, item, delay):
+        loop = asyncio.get_running_loop()
+
+        def _requeue():
+            self._pending_retries.discard(h)
+            self._put(item)
+
+        h = loop.call_later(delay, _requeue)
+        self._pending_retries.add(h)
+
+    async def _worker(self):
+        while True:
+            _, _, item = await self._queue.get()
+            lane = LANES.get(item.priority, "normal")
+            self._depth[lane] -= 1
+            try:
+                if item.fut.done():       # 呼叫端已取消
+                    continue
+                # 先看自己號碼的 bucket，再拿全域 token：號碼被限速時不扣全域額度、也不佔著 worker，
+                # 排到可以送的時候再回佇列，worker 先去送其他號碼
+                bucket = self._bucket(item.phone_id)
+                wait = bucket._take()
+                if wait > 0:
+                    bucket.waited += wait
+                    self.deferred += 1
+                    self._retry_later(item, wait)
+                    continue
+                await self._global.acquire()
+                if item.attempt == 0:
+                    self.lane_wait[lane] += time.monotonic() - item.enq_at
+                try:
+                    with span("send", route=item.route):
+                        res = await item.fn(*item.args, **item.kwargs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    UPSTREAM_ERRORS.inc(upstream="graph")
+                    item.attempt += 1
+                    if is_retryable(e) and item.attempt <= self.max_retries:
+                        self.retried += 1
+                        delay = self._backoff(item, e)
+                        log.info("outbound retry %d/%d in %.2fs: %r", item.attempt, self.max_retries, delay, e)
+                        self._retry_later(item, delay)
+                    else:
+                        self.failed += 1
+                        if not item.fut.done():
+                            item.fut.set_exception(e)
+                            item.fut.exception()
+                    continue
+                self.sent += 1
+                self.lane_sent[lane] += 1
+                if not item.fut.done():
+                    item.fut.set_result(res)
+            finally:
+                self._queue.task_done()
+
+    # ---------- 統計 ----------
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "depth": dict(self._depth),
+            "retry_pending": len(self._pending_retries),
+            "sent": self.sent,
+            "retried": self.retried,
+            "deferred": self.deferred,
+            "failed": self.failed,
+            "lane_sent": dict(self.lane_sent),
+            "lane_wait_avg_ms": {k: round(1000 * self.lane_wait[k] / self.lane_sent[k], 2) if self.lane_sent[k] else 0.0
+                                 for k in self.lane_wait},
+            "throttled_s": round(self._global.waited + sum(b.waited for b in self._buckets.values()), 3),
+        }
@@ -0,0 +1,136 @@
+# hkbot/portfolio.py
+"""
+大量代碼（組合 / 自選清單，30 ~ 100 檔）一次查：
+
+- 下載切成每批 PORTFOLIO_CHUNK 檔，在共用的 thread pool（PORTFOLIO_PARALLEL 條）平行跑，
+  所有查詢加起來同時最多這麼多批打上游；每批照樣經過 HistoryCache（快取 / single-flight / 共享鎖）。
+- 整體有上限 PORTFOLIO_TIMEOUT：逾時的批次列為「逾時」先回其他的，背景抓完仍會進快取。
+- 收市後的查表（SignalTable）有的檔直接用表，其餘一次向量化評分（hkbot.signals.recommend_frames）。
+- 依分數排序，每檔一行精簡格式，分頁輸出（page=2…）。
+"""
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from hkbot import deadline
+from hkbot.metrics import span
+from hkbot.signals import recommend_frames
+
+log = logging.getLogger("uvicorn.error")
+
+PORTFOLIO_CHUNK = int(os.getenv("PORTFOLIO_CHUNK", "20"))           # 每批下載幾檔
+PORTFOLIO_PARALLEL = int(os.getenv("PORTFOLIO_PARALLEL", "4"))      # 同時幾批（全 process 共用）
+PORTFOLIO_TIMEOUT = float(os.getenv("PORTFOLIO_TIMEOUT", "20"))     # 秒：整體下載上限
+PORTFOLIO_PAGE = int(os.getenv("PORTFOLIO_PAGE", "25"))             # 每頁幾檔
+
+_pool = None
+
+
+def _executor(parallel=PORTFOLIO_PARALLEL):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="hkbot-portfolio")
+    return _pool
+
+
+def fetch_chunked(get, symbols, days, chunk=PORTFOLIO_CHUNK, timeout=PORTFOLIO_TIMEOUT, pool=None):
+    """
+    get(symbols, days=...) → {symbol: DataFrame}（即 logic.get_multiple_stocks_data）。
+    回傳 (frames, timed_out_symbols)。
+    """
+    chunks = [symbols[i:i + chunk] for i in range(0, len(symbols), max(1, chunk))]
+    if len(chunks) <= 1:
+        return (get(symbols, days=days) if symbols else {}), []
+    pool = pool or _executor()
+    # 每批帶上目前的 contextvars（路由標籤、時間預算），整體等待也不超過剩餘預算
+    futs = {pool.submit(contextvars.copy_context().run, get, part, days=days): part for part in chunks}
+    done, pending = wait(futs, timeout=deadline.cap(timeout))
+    frames, late = {}, []
+    for f in done:
+        try:
+            frames.update(f.result() or {})
+        except Exception as e:
+            log.warning("portfolio chunk failed (%d symbols): %r", len(futs[f]), e)
+    for f in pending:
+        late.extend(futs[f])
+    if late:
+        log.warning("portfolio fetch timed out after %.1fs: %d symbols", timeout, len(late))
+    return frames, late
+
+
+class Ranked:
+    """排序好的結果：rows 為 (symbol, close, chg 或 None, ai)，missing / late 為沒資料 / 逾時的代碼。"""
+
+    __slots__ = ("rows", "missing", "late", "elapsed_s")
+
+    def __init__(self, rows, missing, late, elapsed_s):
+        self.rows = rows
+        self.missing = missing
+        self.late = late
+        self.elapsed_s = elapsed_s
+
+    def counts(self):
+        out = {}
+        for _, _, _, ai in self.rows:
+            out[ai["label"]] = out.get(ai["label"], 0) + 1
+        return out
+
+
+def rank(get, symbols, days=120, mode="swing", table=None, chunk=PORTFOLIO_CHUNK, timeout=PORTFOLIO_TIMEOUT,
+         pool=None):
+    """
+    table: 選用的 SignalTable（有效時表內的檔直接查表，不下載）。
+    pool: 選用的 executor（預設共用的 PORTFOLIO_PARALLEL 條 thread）。
+    依 score 高到低排序，同分依使用者輸入順序。
+    """
+    t0 = time.perf_counter()
+    symbols = list(dict.fromkeys(symbols))
+    from_table = {}
+    if table is not None and table.is_current() and table.covers([], days):
+        from_table = {s: table.row(s, mode) for s in symbols if s in table.index}
+    need = [s for s in symbols if s not in from_table]
+
+    with span("portfolio_fetch"):
+        frames, late = fetch_chunked(get, need, days, chunk=chunk, timeout=timeout, pool=pool)
+    with span("recommend"):
+        recs = recommend_frames(frames, [s for s in need if s in frames], mode=mode)
+
+    rows = []
+    for sym in symbols:
+        if sym in from_table:
+            rows.append((sym, *from_table[sym]))
+        elif sym in recs:
+            df = frames[sym]
+            close = df["Close"].to_numpy(dtype=np.float64)
+            chg = (close[-1] / close[-2] - 1) * 100.0 if len(close) >= 2 else None
+            rows.append((sym, float(close[-1]), chg, recs[sym]))
+    order = {s: i for i, s in enumerate(symbols)}
+    rows.sort(key=lambda r: (-r[3]["score"], order[r[0]]))
+    late_set = set(late)
+    missing = [s for s in symbols if s not in from_table and s not in recs and s not in late_set]
+    return Ranked(rows, missing, late, time.perf_counter() - t0)
+
+
+def format_page(ranked, names, page=1, page_size=PORTFOLIO_PAGE, header=""):
+    """一頁精簡排行：「序. 代碼 名稱｜收 價（日變）｜建議 分數」；回傳文字。"""
+    pages = max(1, -(-len(ranked.rows) // page_size))
+    page = min(max(1, page), pages)
+    counts = ranked.counts()
+    lines = [f"{header}｜第 {page}/{pages} 頁",
+             f"共 {len(ranked.rows)} 檔：買入 {counts.get('買入', 0)}｜持有 {counts.get('持有', 0)}｜賣出 {counts.get('賣出', 0)}"]
+    start = (page - 1) * page_size
+    for i, (sym, close, chg, ai) in enumerate(ranked.rows[start:start + page_size], start + 1):
+        chg_str = f"{chg:+.2f}%" if chg is not None else "---"
+        lines.append(f"{i}. {sym} {names.get(sym, sym)}｜{close:.2f}（{chg_str}）｜{ai['label']} {ai['score']:+d}")
+    if page == pages:
+        if ranked.missing:
+            lines.append("無資料：" + " ".join(ranked.missing))
+        if ranked.late:
+            lines.append("逾時未取得（稍後再查）：" + " ".join(ranked.late))
+    if page < pages:
+        lines.append(f"下一頁：同一指令加 page={page + 1}")
+    return "\n".join(lines)
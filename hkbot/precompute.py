@@ -0,0 +1,301 @@
+# hkbot/precompute.py
+"""
+收市後全市場預先計算：整個港股名單分批平行下載日 K，三個模式的 AI 建議一次算好，
+存成精簡的查表（SignalTable），一般代碼查詢直接讀記憶體，也讓「全市場排行」這類指令可行。
+
+    python -m hkbot.precompute run        # 手動跑一次（也可放 cron）
+    python -m hkbot.precompute top buy    # 看排行
+
+- 名單：PRECOMPUTE_UNIVERSE 指向的 CSV（需有 code 欄），預設用內附的 hk_names.csv。
+- 表只在「收市後 ~ 下次開市前」且建表的收市日 = 最近一次收市時有效；盤中一律回到即時計算。
+- app 內由 scheduler() 在每個交易日 PRECOMPUTE_AT（HKT）後自動跑一次。
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from hkbot.config import data_path
+from hkbot.history import HKT, hk_now, is_market_open, is_trading_day, last_close, window_start
+from hkbot.signals import MODE_PARAMS, recommend_frames
+from hkbot.universe import UNIVERSE_FILE, to_symbol
+
+log = logging.getLogger("uvicorn.error")
+
+PRECOMPUTE_AT = os.getenv("PRECOMPUTE_AT", "16:30")                 # HKT，收市競價之後
+PRECOMPUTE_DAYS = int(os.getenv("PRECOMPUTE_DAYS", "120"))          # 與一般查詢預設 days 相同
+PRECOMPUTE_CHUNK = int(os.getenv("PRECOMPUTE_CHUNK", "100"))        # 每次 yf.download 幾檔
+PRECOMPUTE_PARALLEL = int(os.getenv("PRECOMPUTE_PARALLEL", "4"))    # 同時幾批
+PRECOMPUTE_UNIVERSE = os.getenv("PRECOMPUTE_UNIVERSE", UNIVERSE_FILE)   # 預設與代碼總表同一個檔
+SIGNAL_TABLE_FILE = os.getenv("SIGNAL_TABLE_FILE", data_path("signals.json"))
+
+MODES = tuple(MODE_PARAMS)
+LABELS = ("賣出", "持有", "買入")
+
+
+def load_universe(path=PRECOMPUTE_UNIVERSE):
+    """讀 CSV 的 code 欄 → ["0001.HK", ...]。"""
+    out = []
+    try:
+        with open(path, encoding="utf-8") as fh:
+            for row in csv.DictReader(fh):
+                sym = to_symbol(row.get("code"))
+                if sym:
+                    out.append(sym)
+    except FileNotFoundError:
+        log.warning("precompute universe not found: %s", path)
+    return list(dict.fromkeys(out))
+
+
+# ---------- 查表 ----------
+class SignalTable:
+    """
+    每檔一列：收市價、日變幅，加上每個模式的 score / label / reason。
+    數值放 numpy 陣列（int8 / float32），symbol → 列號用 dict。
+    """
+
+    def __init__(self, symbols=(), days=PRECOMPUTE_DAYS, session=None, bar_date=None,
+                 close=None, chg=None, scores=None, labels=None, reasons=None, built_at=None):
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        n = len(self.symbols)
+        self.days = days
+        self.session = session          # 建表時「最近一次收市」的日期（YYYY-MM-DD）
+        self.bar_date = bar_date or [""] * n
+        self.close = np.asarray(close if close is not None else np.zeros(n), dtype=np.float64)
+        self.chg = np.asarray(chg if chg is not None else np.full(n, np.nan), dtype=np.float32)
+        self.scores = {m: np.asarray((scores or {}).get(m, np.zeros(n)), dtype=np.int8) for m in MODES}
+        self.labels = {m: np.asarray((labels or {}).get(m, np.ones(n)), dtype=np.int8) for m in MODES}
+        self.reasons = {m: list((reasons or {}).get(m, [""] * n)) for m in MODES}
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def is_current(self, now=None):
+        """收市後 ~ 下次開市前，且表是最近一次收市後建的。"""
+        now = now or hk_now()
+        return bool(self.symbols) and not is_market_open(now) and self.session == last_close(now).date().isoformat()
+
+    def covers(self, symbols, days):
+        return max(days, 60) == max(self.days, 60) and all(s in self.index for s in symbols)
+
+    def row(self, sym, mode):
+        """回傳 (close, chg 或 None, {'label','reason','score'})；沒有就 None。"""
+        i = self.index.get(sym)
+        if i is None:
+            return None
+        chg = float(self.chg[i])
+        ai = {"label": LABELS[int(self.labels[mode][i])], "reason": self.reasons[mode][i],
+              "score": int(self.scores[mode][i])}
+        return float(self.close[i]), (None if np.isnan(chg) else chg), ai
+
+    def top(self, mode, n=10, side="buy"):
+        """依 score 排序（買：高到低，只取買入；賣：低到高，只取賣出），同分依代碼。"""
+        want = 2 if side == "buy" else 0
+        idx = np.flatnonzero(self.labels[mode] == want)
+        sign = -1 if side == "buy" else 1
+        order = sorted(idx, key=lambda i: (sign * int(self.scores[mode][i]), self.symbols[i]))
+        return [self.symbols[i] for i in order[:n]]
+
+    # ---------- 持久化 ----------
+    def to_dict(self):
+        return {
+            "days": self.days, "session": self.session, "built_at": self.built_at,
+            "symbols": self.symbols, "bar_date": self.bar_date,
+            "close": [round(float(x), 4) for x in self.close],
+            "chg": [None if np.isnan(x) else round(float(x), 4) for x in self.chg],
+            "modes": {m: {"score": self.scores[m].tolist(), "label": self.labels[m].tolist(),
+                          "reason": self.reasons[m]} for m in MODES},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        modes = d.get("modes") or {}
+        return cls(d["symbols"], days=d.get("days", PRECOMPUTE_DAYS), session=d.get("session"),
+                   bar_date=d.get("bar_date"), close=d.get("close"),
+                   chg=[np.nan if x is None else x for x in d.get("chg") or []],
+                   scores={m: v["score"] for m, v in modes.items()},
+                   labels={m: v["label"] for m, v in modes.items()},
+                   reasons={m: v["reason"] for m, v in modes.items()},
+                   built_at=d.get("built_at"))
+
+    def save(self, path=SIGNAL_TABLE_FILE):
+        d = os.path.dirname(path) or "."
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-signals-")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(self.to_dict(), fh, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=SIGNAL_TABLE_FILE):
+        try:
+            with open(path, encoding="utf-8") as fh:
+                return cls.from_dict(json.load(fh))
+        except FileNotFoundError:
+            return cls()
+        except Exception as e:
+            log.warning("signal table load failed: %r", e)
+            return cls()
+
+    def stats(self):
+        return {"symbols": len(self), "days": self.days, "session": self.session,
+                "current": self.is_current(), "built_at": self.built_at}
+
+
+# ---------- 批次計算 ----------
+def build_table(download, symbols, days=PRECOMPUTE_DAYS, chunk=PRECOMPUTE_CHUNK,
+                parallel=PRECOMPUTE_PARALLEL, now=None):
+    """
+    download(symbols, period=...) → {symbol: DataFrame}（即 hkbot.logic._download）。
+    分批平行下載，切成與一般查詢相同的視窗，再對三個模式各做一次向量化評分。
+    """
+    now = now or hk_now()
+    chunks = [symbols[i:i + chunk] for i in range(0, len(symbols), chunk)]
+    frames, failed = {}, 0
+
+    def _one(part):
+        try:
+            return download(part, period=f"{max(days, 60)}d")
+        except Exception as e:
+            log.warning("precompute chunk failed (%d symbols): %r", len(part), e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="hkbot-precompute") as pool:
+        for got in pool.map(_one, chunks):
+            if got is None:
+                failed += 1
+                continue
+            frames.update(got)
+
+    start = window_start(days, now)
+    frames = {s: df[df.index >= start] for s, df in frames.items() if df is not None and not df.empty}
+    frames = {s: df for s, df in frames.items() if not df.empty}
+    syms = [s for s in symbols if s in frames]
+
+    close = np.array([float(frames[s]["Close"].iat[-1]) for s in syms])
+    chg = np.array([(float(frames[s]["Close"].iat[-1]) / float(frames[s]["Close"].iat[-2]) - 1) * 100.0
+                    if len(frames[s]) >= 2 else np.nan for s in syms])
+    scores, labels, reasons = {}, {}, {}
+    for mode in MODES:
+        recs = recommend_frames(frames, syms, mode=mode)
+        scores[mode] = [recs[s]["score"] for s in syms]
+        labels[mode] = [LABELS.index(recs[s]["label"]) for s in syms]
+        reasons[mode] = [recs[s]["reason"] for s in syms]
+
+    table = SignalTable(syms, days=days, session=last_close(now).date().isoformat(),
+                        bar_date=[str(frames[s].index[-1].date()) for s in syms],
+                        close=close, chg=chg, scores=scores, labels=labels, reasons=reasons,
+                        built_at=now.isoformat(timespec="seconds"))
+    return table, {"requested": len(symbols), "symbols": len(syms), "chunks": len(chunks), "failed_chunks": failed}
+
+
+class Precomputer:
+    """持有目前的 SignalTable；run() 重建並換上（讀取端不需要鎖，整張表一次替換）。"""
+
+    def __init__(self, download, path=SIGNAL_TABLE_FILE, universe=None, locks=None):
+        """locks: 選用的 hkbot.shared.SharedCache；多 worker 時只有一個去算，其他讀它存好的檔。"""
+        self.download = download
+        self.locks = locks
+        self.path = path
+        self.universe = universe
+        self.table = SignalTable.load(path) if path else SignalTable()
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.last_run_s = 0.0
+        self.last_result = {}
+
+    def run(self, now=None):
+        if self.locks is None or not self.path:
+            return self._run(now)
+        owner, got = self.locks.acquire(["precompute"], ttl=3600)
+        if not got:
+            self.locks.wait(["precompute"], 3600)
+        try:
+            # 可能別的 worker 剛算完：讀檔就好
+            table = SignalTable.load(self.path)
+            if table.is_current(now):
+                self.table = table
+                return {"reloaded": len(table)}
+            if not got:
+                return {"reloaded": 0}
+            return self._run(now)
+        finally:
+            if got:
+                self.locks.release(owner, got)
+
+    def _run(self, now=None):
+        with self._lock:
+            t0 = time.perf_counter()
+            universe = self.universe if self.universe is not None else load_universe()
+            table, result = build_table(self.download, universe, now=now)
+            if len(table):
+                self.table = table
+                if self.path:
+                    try:
+                        table.save(self.path)
+                    except OSError as e:
+                        log.warning("signal table save failed: %r", e)
+            self.runs += 1
+            self.last_run_s = round(time.perf_counter() - t0, 2)
+            self.last_result = result
+            log.info("precompute done in %.1fs: %s", self.last_run_s, result)
+            return result
+
+    def stats(self):
+        return {**self.table.stats(), "runs": self.runs, "last_run_s": self.last_run_s, **self.last_result}
+
+
+# ---------- 排程 ----------
+def next_run(now=None, at=PRECOMPUTE_AT):
+    """下一個交易日 at（HKT）的時間點。"""
+    now = now or hk_now()
+    hh, mm = (int(x) for x in at.split(":"))
+    d = now.date()
+    while True:
+        t = datetime(d.year, d.month, d.day, hh, mm, tzinfo=HKT)
+        if is_trading_day(d) and t > now:
+            return t
+        d += timedelta(days=1)
+
+
+async def scheduler(pre, run_blocking=None):
+    """app 背景 task：啟動時表已過期（且已收市）就先跑一次，之後每個交易日收市後跑。"""
+    run_blocking = run_blocking or asyncio.to_thread
+    while True:
+        now = hk_now()
+        if not pre.table.is_current(now) and not is_market_open(now):
+            try:
+                await run_blocking(pre.run)
+            except Exception as e:
+                log.exception("precompute failed: %r", e)
+        delay = (next_run(hk_now()) - hk_now()).total_seconds()
+        await asyncio.sleep(max(1.0, delay))
+
+
+def main():
+    import argparse
+    from hkbot import logic
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cmd", choices=("run", "top"))
+    ap.add_argument("side", nargs="?", default="buy", choices=("buy", "sell"))
+    ap.add_argument("--mode", default="swing", choices=MODES)
+    ap.add_argument("-n", type=int, default=10)
+    args = ap.parse_args()
+    if args.cmd == "run":
+        print(logic.precompute_market())
+    print(logic.top_signals_text(args.side, mode=args.mode, n=args.n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# hkbot/providers.py
+"""
+行情來源（provider）抽象：K 線下載與名稱查詢走同一個介面，可換後端、可備援。
+
+    MARKET_PROVIDERS=yfinance,file      # 第一個是主要來源，其餘依序為備援
+    MARKET_FILE_DIR=/path/to/fixtures   # file 後端：<symbol>.npy（K 線庫格式）或 <symbol>.csv
+
+- 介面與 HistoryCache / NameResolver 要的 fetch 相同：
+    download(symbols, period=None, start=None, timeout=None, interval="1d") -> {symbol: DataFrame}
+    names(symbols, timeout=None) -> {symbol: name}
+- Router 對每個呼叫：
+  - hedge：主要來源超過它自己最近延遲的 PROVIDER_HEDGE_PCT 百分位（至少 PROVIDER_HEDGE_MIN 秒）
+    還沒回，就同時問下一個來源，先成功的先用；主要來源直接失敗時立刻改問備援。
+  - circuit breaker：每個來源連續失敗 PROVIDER_CB_FAILURES 次就「斷開」PROVIDER_CB_COOLDOWN 秒，
+    期間直接跳過（不用等逾時）；冷卻後放一個試探請求，成功才恢復。
+  - 每個來源的延遲（p50 / p95 / p99）、錯誤數、斷路狀態由 stats() 回報（/stats、/metrics）。
+- 只設一個來源時不 hedge，行為與直接呼叫相同（仍有 circuit breaker）。
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from hkbot.metrics import PROVIDER_FAST_FAILS, PROVIDER_HEDGES, PROVIDER_SECONDS
+from hkbot.names import BUNDLED_NAMES, fetch_quote_names, load_bundled
+from hkbot.store import BAR_STORE_DIR, COLUMNS, BarStore, array_to_frame
+
+log = logging.getLogger("uvicorn.error")
+
+MARKET_PROVIDERS = os.getenv("MARKET_PROVIDERS", "yfinance")
+MARKET_FILE_DIR = os.getenv("MARKET_FILE_DIR", BAR_STORE_DIR)
+PROVIDER_HEDGE_PCT = float(os.getenv("PROVIDER_HEDGE_PCT", "0.9"))     # 主要來源超過這個百分位就 hedge
+PROVIDER_HEDGE_MIN = float(os.getenv("PROVIDER_HEDGE_MIN", "0.25"))     # hedge 前至少等幾秒
+PROVIDER_HEDGE_DEFAULT = float(os.getenv("PROVIDER_HEDGE_DEFAULT", "3"))  # 樣本不夠時的 hedge 等待
+PROVIDER_WINDOW = int(os.getenv("PROVIDER_WINDOW", "200"))              # 每個來源保留幾筆最近延遲
+PROVIDER_MIN_SAMPLES = 20
+PROVIDER_CB_FAILURES = int(os.getenv("PROVIDER_CB_FAILURES", "5"))
+PROVIDER_CB_COOLDOWN = float(os.getenv("PROVIDER_CB_COOLDOWN", "30"))
+PROVIDER_THREADS = int(os.getenv("PROVIDER_THREADS", "16"))
+
+
+class ProviderUnavailable(RuntimeError):
+    """所有來源都斷路中（或都失敗）。"""
+
+
+# ---------- 後端 ----------
+def split_download(df, symbols):
+    """把 yf.download 的結果拆成 {symbol: OHLCV DataFrame}。"""
+    data = {}
+    if df is None or df.empty:
+        return data
+    for sym in symbols:
+        if isinstance(df.columns, pd.MultiIndex):
+            if sym in df.columns.levels[0]:
+                sub = df[sym].dropna().copy()
+            else:
+                continue
+        else:
+            sub = df.dropna().copy()
+        if not sub.empty:
+            need = [c for c in COLUMNS if c in sub.columns]
+            if len(need) >= 4:
+                sub = sub[need].copy()
+                if getattr(sub.index, "tz", None) is not None:
+                    sub.index = sub.index.tz_localize(None)
+                data[sym] = sub
+    return data
+
+
+class YFinanceProvider:
+    """yf.download（K 線）+ Yahoo v7 quote（名稱）。"""
+    name = "yfinance"
+
+    def download(self, symbols, period=None, start=None, timeout=None, interval="1d"):
+        import yfinance as yf
+        kw = {"start": start} if start else {"period": period or "60d"}
+        if timeout is not None:
+            kw["timeout"] = timeout
+        df = yf.download(tickers=" ".join(symbols), interval=interval, group_by="ticker",
+                         auto_adjust=False, progress=False, threads=True, **kw)
+        return split_download(df, symbols)
+
+    def names(self, symbols, timeout=None):
+        return fetch_quote_names(symbols, timeout=timeout)
+
+
+_PERIOD = re.compile(r"^(\d+)(d|mo|y)$")
+_OFFSET = re.compile(r"(?:[+-]\d\d:?\d\d|Z)$")
+
+
+def _hk_index(index):
+    """CSV 的時間欄 → 無時區的香港時間（與 yfinance 結果一致）；帶 UTC offset 的先換算。"""
+    text = index.astype(str)
+    if text.str.contains(_OFFSET).any():
+        return pd.to_datetime(text, utc=True).tz_convert("Asia/Hong_Kong").tz_localize(None)
+    return pd.to_datetime(text)
+
+
+class FileProvider:
+    """
+    本機檔案 / fixture：root 下的 <symbol>.npy（hkbot.store 格式）或 <symbol>.csv（Date,Open,High,Low,Close,Volume）；
+    盤中週期讀 <symbol>_<interval>.csv。period 以檔案最後一根往回算（fixture 可能是舊資料）。
+    名稱用內附名稱表。
+    """
+    name = "file"
+
+    def __init__(self, root=MARKET_FILE_DIR, names_file=BUNDLED_NAMES):
+        self.root = root
+        self.names_file = names_file
+        self._names = None
+        self._frames = {}          # path -> (mtime, DataFrame)
+        self._lock = threading.Lock()
+
+    def _read(self, sym, interval):
+        base = os.path.join(self.root, sym.replace("/", "_"))
+        paths = [base + ".npy", base + ".csv"] if interval == "1d" else [f"{base}_{interval}.csv"]
+        for path in paths:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            with self._lock:
+                hit = self._frames.get(path)
+            if hit is not None and hit[0] == mtime:
+                return hit[1]
+            if path.endswith(".npy"):
+                arr = BarStore(self.root).read_array(sym)
+                df = array_to_frame(arr) if arr is not None else None
+            else:
+                df = pd.read_csv(path, index_col=0)
+                df.index = _hk_index(df.index)
+            if df is None or df.empty:
+                return None
+            with self._lock:
+                self._frames[path] = (mtime, df)
+            return df
+        return None
+
+    def download(self, symbols, period=None, start=None, timeout=None, interval="1d"):
+        out = {}
+        for sym in symbols:
+            df = self._read(sym, interval)
+            if df is None:
+                continue
+            if start is not None:
+                ts = pd.Timestamp(start)
+                if ts.tzinfo is not None:
+                    ts = ts.tz_convert("Asia/Hong_Kong").tz_localize(None)
+                df = df[df.index >= ts]
+            else:
+                m = _PERIOD.match(str(period or "60d"))
+                if m:
+                    n, unit = int(m.group(1)), m.group(2)
+                    delta = pd.DateOffset(days=n) if unit == "d" else \
+                        pd.DateOffset(months=n) if unit == "mo" else pd.DateOffset(years=n)
+                    df = df[df.index > df.index[-1] - delta]
+            if not df.empty:
+                out[sym] = df.copy()
+        return out
+
+    def names(self, symbols, timeout=None):
+        if self._names is None:
+            self._names = load_bundled(self.names_file)
+        return {s: self._names[s] for s in symbols if s in self._names}
+
+
+BACKENDS = {"yfinance": YFinanceProvider, "file": FileProvider}
+
+
+# ---------- 健康狀態 ----------
+class Health:
+    """單一來源：最近延遲（成功的呼叫）+ circuit breaker。"""
+
+    def __init__(self, name, failures=PROVIDER_CB_FAILURES, cooldown=PROVIDER_CB_COOLDOWN, window=PROVIDER_WINDOW):
+        self.name = name
+        self.failure_limit = failures
+        self.cooldown = cooldown
+        self._lat = {}              # op -> deque[秒]
+        self.window = window
+        self._lock = threading.Lock()
+        self.state = "closed"       # closed / open / half_open
+        self.opened_at = 0.0
+        self.consecutive = 0
+        self.calls = 0
+        self.errors = 0
+        self.opens = 0
+        self.fast_fails = 0
+        self._probing = False
+
+    def allow(self):
+        """closed 放行；open 冷卻完轉 half_open，只放一個試探請求。"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.fast_fails += 1
+            return False
+
+    def record(self, op, seconds, ok):
+        with self._lock:
+            self.calls += 1
+            self._probing = False
+            if ok:
+                self._lat.setdefault(op, deque(maxlen=self.window)).append(seconds)
+                self.consecutive = 0
+                if self.state != "closed":
+                    log.info("provider %s recovered", self.name)
+                self.state = "closed"
+                return
+            self.errors += 1
+            self.consecutive += 1
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive >= self.failure_limit):
+                if self.state == "closed":
+                    self.opens += 1
+                    log.warning("provider %s circuit open after %d failures", self.name, self.consecutive)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def percentile(self, op, q):
+        with self._lock:
+            lat = sorted(self._lat.get(op) or ())
+        if not lat:
+            return None
+        return lat[min(len(lat) - 1, int(round(q * (len(lat) - 1))))]
+
+    def hedge_delay(self, op, q=PROVIDER_HEDGE_PCT, floor=PROVIDER_HEDGE_MIN, default=PROVIDER_HEDGE_DEFAULT):
+        with self._lock:
+            n = len(self._lat.get(op) or ())
+        if n < PROVIDER_MIN_SAMPLES:
+            return default
+        return max(floor, self.percentile(op, q))
+
+    def stats(self):
+        out = {"state": self.state, "calls": self.calls, "errors": self.errors, "opens": self.opens,
+               "fast_fails": self.fast_fails}
+        for op in list(self._lat):
+            for q in (0.5, 0.95, 0.99):
+                out[f"{op}_p{int(q * 100)}_ms"] = round(1000 * self.percentile(op, q), 1)
+            out[f"{op}_hedge_after_ms"] = round(1000 * self.hedge_delay(op), 1)
+        return out
+
+
+# ---------- Router ----------
+class Router:
+    def __init__(self, providers, threads=PROVIDER_THREADS, hedge=True):
+        """providers: [provider, ...]，第一個為主要來源。"""
+        self.providers = list(providers)
+        self.health = {p.name: Health(p.name) for p in self.providers}
+        self.hedge = hedge and len(self.providers) > 1
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="provider")
+        self.hedges = 0
+        self.failovers = 0
+        self.backup_wins = 0
+
+    def download(self, symbols, period=None, start=None, timeout=None, interval="1d"):
+        return self._call("download", (symbols,),
+                          {"period": period, "start": start, "timeout": timeout, "interval": interval})
+
+    def names(self, symbols, timeout=None):
+        return self._call("names", (symbols,), {"timeout": timeout})
+
+    def _submit(self, provider, op, args, kwargs):
+        health = self.health[provider.name]
+        t0 = time.monotonic()
+
+        def _run():
+            try:
+                res = getattr(provider, op)(*args, **kwargs)
+            except Exception:
+                dt = time.monotonic() - t0
+                health.record(op, dt, ok=False)
+                PROVIDER_SECONDS.observe(dt, provider=provider.name, op=op, outcome="error")
+                raise
+            dt = time.monotonic() - t0
+            health.record(op, dt, ok=True)
+            PROVIDER_SECONDS.observe(dt, provider=provider.name, op=op, outcome="ok")
+            return res
+
+        return self._pool.submit(_run)
+
+    def _next(self, queue, op):
+        """下一個斷路器放行的來源（跳過的記 fast fail）。"""
+        while queue:
+            p = queue.pop(0)
+            if self.health[p.name].allow():
+                return p
+            PROVIDER_FAST_FAILS.inc(provider=p.name, op=op)
+        return None
+
+    def _call(self, op, args, kwargs):
+        timeout = kwargs.get("timeout")
+        queue = list(self.providers)
+        first = self._next(queue, op)
+        if first is None:
+            raise ProviderUnavailable(f"all providers unavailable for {op}")
+        end = time.monotonic() + timeout if timeout is not None else None
+        pending = {self._submit(first, op, args, kwargs): first}
+        hedge_at = time.monotonic() + self.health[first.name].hedge_delay(op) if self.hedge else None
+        last_error = None
+        while pending:
+            now = time.monotonic()
+            limits = [t - now for t in (hedge_at, end) if t is not None]
+            done, _ = wait(pending, timeout=max(0.0, min(limits)) if limits else None,
+                           return_when=FIRST_COMPLETED)
+            for fut in done:
+                provider = pending.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    last_error = e
+                    log.warning("provider %s %s failed: %r", provider.name, op, e)
+                    continue
+                if provider is not first:
+                    self.backup_wins += 1
+                return res
+            if end is not None and time.monotonic() >= end:
+                break
+            reason = None
+            if done and not pending:
+                reason = "failover"          # 全部都失敗了：馬上換下一個
+            elif not done and hedge_at is not None and time.monotonic() >= hedge_at:
+                reason = "hedge"             # 主要來源太慢：加問下一個，誰先回用誰
+            if reason:
+                backup = self._next(queue, op)
+                hedge_at = None
+                if backup is not None:
+                    PROVIDER_HEDGES.inc(op=op, reason=reason)
+                    if reason == "hedge":
+                        self.hedges += 1
+                    else:
+                        self.failovers += 1
+                    pending[self._submit(backup, op, args, kwargs)] = backup
+                    if queue and self.hedge:
+                        hedge_at = time.monotonic() + self.health[backup.name].hedge_delay(op)
+        if last_error is not None and not pending:
+            raise last_error
+        raise TimeoutError(f"{op} timed out after {timeout:.2f}s")
+
+    def stats(self):
+        return {"providers": {name: h.stats() for name, h in self.health.items()},
+                "hedges": self.hedges, "failovers": self.failovers, "backup_wins": self.backup_wins}
+
+
+def from_env(spec=MARKET_PROVIDERS):
+    """"yfinance,file" → Router；不認得的名稱略過（寫 log）。"""
+    providers = []
+    for name in (s.strip() for s in spec.split(",")):
+        if not name:
+            continue
+        cls = BACKENDS.get(name)
+        if cls is None:
+            log.warning("unknown market provider %r (known: %s)", name, ", ".join(BACKENDS))
+            continue
+        providers.append(cls())
+    return Router(providers or [YFinanceProvider()])
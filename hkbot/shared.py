@@ -0,0 +1,244 @@
+# hkbot/shared.py
+"""
+多 worker（uvicorn --workers N）共用的本機快取：一個 SQLite 檔（WAL 模式），放
+K 線、股票名稱、已組好的摘要，外加跨 process 的下載鎖（同一檔同時只有一個 worker 去抓）。
+
+    HKBOT_SHARED_CACHE=1                      # 開啟（預設關）
+    HKBOT_SHARED_CACHE_FILE=.hkbot/shared.db  # 檔案位置（所有 worker 要指向同一個；要在本機磁碟，不要放 NFS）
+    HKBOT_SHARED_BUSY_TIMEOUT=5               # 秒：寫入等別的 worker 的寫鎖，超過就丟 sqlite3.OperationalError
+    HKBOT_SHARED_LOCK_TTL=60                  # 秒：下載鎖租約長度（要比一次下載的最長時間長）
+
+- WAL：讀者不擋寫者，多個 process 同時讀不互相等待。
+- 每個 thread 各自一條連線；寫入用 BEGIN IMMEDIATE，搭配 busy_timeout 排隊。
+- 下載鎖是有期限的租約（locks 表：name, owner, expires_at）：
+  - acquire(names) 不等待，一個交易內先刪掉過期的租約、INSERT OR IGNORE 自己的，回傳實際拿到的 names；
+    owner 是每次 acquire 新產生的 token（pid + 亂數），release 只刪自己 owner 的列，不會放掉別人的鎖。
+  - 沒拿到的檔呼叫 wait(names, timeout) 輪詢到租約消失（release 或過期）再從共享庫讀回。
+  - worker 當掉 / 卡住時不用清理：租約 TTL 到期後別人就能拿；反過來，下載超過 TTL 時
+    別的 worker 可能重抓同一檔（只多一次下載，寫入是讀-改-寫合併，不會壞資料）。
+  - 提醒 watcher 用 name="alerts"、ttl=檢查間隔、刻意不 release：每一輪只有一個 worker 檢查。
+- 所有呼叫端把 SharedCache 的錯誤當成「沒有共享快取」：記 log 並計入
+  hkbot_shared_cache_errors_total{op=...}，請求照常用本機快取 / 直接下載。
+- K 線以 hkbot.store 的 (6, N) float64 欄式陣列存成 BLOB；SharedBarStore 介面與 BarStore 相同。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from hkbot.config import data_path
+from hkbot.store import COLUMNS, _merge, array_to_frame, frame_to_array
+
+log = logging.getLogger("uvicorn.error")
+
+SHARED_CACHE_ENABLED = os.getenv("HKBOT_SHARED_CACHE", "0") == "1"
+SHARED_CACHE_FILE = os.getenv("HKBOT_SHARED_CACHE_FILE", data_path("shared.db"))
+SHARED_BUSY_TIMEOUT = float(os.getenv("HKBOT_SHARED_BUSY_TIMEOUT", "5"))   # 秒：等寫鎖
+SHARED_LOCK_TTL = float(os.getenv("HKBOT_SHARED_LOCK_TTL", "60"))          # 秒：下載鎖租約
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT, expires_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bars (
+    sym TEXT PRIMARY KEY, data BLOB NOT NULL, since TEXT, fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SharedCache:
+    def __init__(self, path=SHARED_CACHE_FILE, busy_timeout=SHARED_BUSY_TIMEOUT, lock_ttl=SHARED_LOCK_TTL):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.lock_ttl = lock_ttl
+        self._local = threading.local()
+        self.reads = 0
+        self.writes = 0
+        self.lock_waits = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db().executescript(_SCHEMA)   # executescript 自己會 commit
+
+    # ---------- 連線 ----------
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    class _Tx:
+        def __init__(self, db):
+            self.db = db
+
+        def __enter__(self):
+            self.db.execute("BEGIN IMMEDIATE")
+            return self.db
+
+        def __exit__(self, exc_type, *exc):
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def _tx(self):
+        return self._Tx(self._db())
+
+    # ---------- key / value（名稱、摘要） ----------
+    def get_many(self, ns, keys):
+        """回傳未過期的 {key: value}（value 為 JSON 解回的物件）。"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        now = time.time()
+        out = {}
+        for i in range(0, len(keys), 500):   # SQLite 參數上限
+            part = keys[i:i + 500]
+            rows = self._db().execute(
+                f"SELECT key, value FROM kv WHERE ns=? AND expires_at>? AND key IN ({','.join('?' * len(part))})",
+                (ns, now, *part)).fetchall()
+            out.update((k, json.loads(v)) for k, v in rows)
+        self.reads += 1
+        return out
+
+    def get(self, ns, key, default=None):
+        return self.get_many(ns, [key]).get(key, default)
+
+    def set_many(self, ns, items, ttl):
+        """items: {key: value} 或 [(key, value, expires_at)]。"""
+        exp = time.time() + ttl if ttl is not None else None
+        rows = [(ns, k, json.dumps(v, ensure_ascii=False), exp) for k, v in items.items()] \
+            if isinstance(items, dict) else [(ns, k, json.dumps(v, ensure_ascii=False), e) for k, v, e in items]
+        if not rows:
+            return
+        with self._tx() as db:
+            db.executemany("INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)", rows)
+        self.writes += 1
+
+    def set(self, ns, key, value, ttl):
+        self.set_many(ns, {key: value}, ttl)
+
+    def purge(self):
+        """刪掉過期的 key 與租約。"""
+        now = time.time()
+        with self._tx() as db:
+            n = db.execute("DELETE FROM kv WHERE expires_at<=?", (now,)).rowcount
+            db.execute("DELETE FROM locks WHERE expires_at<=?", (now,))
+        return n
+
+    # ---------- 下載鎖 ----------
+    def acquire(self, names, ttl=None):
+        """盡量拿下這些鎖（不等待）；回傳 (owner token, 拿到的 names)。"""
+        names = list(dict.fromkeys(names))
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        now = time.time()
+        exp = now + (ttl or self.lock_ttl)
+        if not names:
+            return owner, []
+        with self._tx() as db:
+            marks = ",".join("?" * len(names))
+            db.execute(f"DELETE FROM locks WHERE expires_at<=? AND name IN ({marks})", (now, *names))
+            db.executemany("INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                           [(n, owner, exp) for n in names])
+            got = {r[0] for r in db.execute(f"SELECT name FROM locks WHERE owner=? AND name IN ({marks})",
+                                            (owner, *names))}
+        return owner, [n for n in names if n in got]
+
+    def release(self, owner, names):
+        names = list(names)
+        if not names:
+            return
+        with self._tx() as db:
+            db.execute(f"DELETE FROM locks WHERE owner=? AND name IN ({','.join('?' * len(names))})",
+                       (owner, *names))
+
+    def wait(self, names, timeout):
+        """等到這些鎖都被放掉（或過期 / 逾時）；回傳是否等到。"""
+        names = list(names)
+        if not names:
+            return True
+        self.lock_waits += 1
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        sql = f"SELECT COUNT(*) FROM locks WHERE expires_at>? AND name IN ({','.join('?' * len(names))})"
+        while True:
+            if self._db().execute(sql, (time.time(), *names)).fetchone()[0] == 0:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    # ---------- 統計 ----------
+    def stats(self):
+        db = self._db()
+        now = time.time()
+        return {
+            "file": self.path,
+            "keys": db.execute("SELECT COUNT(*) FROM kv WHERE expires_at>?", (now,)).fetchone()[0],
+            "bars": db.execute("SELECT COUNT(*) FROM bars").fetchone()[0],
+            "locks": db.execute("SELECT COUNT(*) FROM locks WHERE expires_at>?", (now,)).fetchone()[0],
+            "reads": self.reads, "writes": self.writes, "lock_waits": self.lock_waits,
+        }
+
+
+class SharedBarStore:
+    """K 線存在 SharedCache 的 bars 表；load / append / touch 與 hkbot.store.BarStore 相同。"""
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.reads = 0
+        self.writes = 0
+
+    def _read(self, db, sym):
+        row = db.execute("SELECT data, since, fetched_at FROM bars WHERE sym=?", (sym,)).fetchone()
+        if row is None:
+            return None
+        arr = np.frombuffer(row[0], dtype=np.float64).reshape(1 + len(COLUMNS), -1)
+        return arr, row[1], row[2]
+
+    def load(self, sym):
+        """回傳 (DataFrame, since, fetched_at)；沒有資料則 None。"""
+        got = self._read(self.shared._db(), sym)
+        if got is None or got[0].shape[1] == 0:
+            return None
+        self.reads += 1
+        arr, since, fetched_at = got
+        df = array_to_frame(arr)
+        return df, (pd.Timestamp(since) if since else df.index[0]), float(fetched_at)
+
+    def fetched_at(self, sym):
+        row = self.shared._db().execute("SELECT fetched_at FROM bars WHERE sym=?", (sym,)).fetchone()
+        return float(row[0]) if row else None
+
+    def append(self, sym, df, since=None, fetched_at=None):
+        """把新 K 線併入（同日覆寫）；同一個交易內讀-改-寫，多個 worker 同時寫也不會互蓋。"""
+        if df is None or df.empty:
+            return self.touch(sym, fetched_at)
+        new = frame_to_array(df)
+        with self.shared._tx() as db:
+            old = self._read(db, sym)
+            arr = _merge(old[0] if old is not None else None, new)
+            s = old[1] if old is not None else None
+            if since is not None:
+                ts = pd.Timestamp(since)
+                if not s or ts < pd.Timestamp(s):
+                    s = ts.strftime("%Y-%m-%d")
+            db.execute("INSERT OR REPLACE INTO bars (sym, data, since, fetched_at) VALUES (?, ?, ?, ?)",
+                       (sym, np.ascontiguousarray(arr).tobytes(), s, fetched_at or time.time()))
+        self.writes += 1
+
+    def touch(self, sym, fetched_at=None):
+        with self.shared._tx() as db:
+            db.execute("UPDATE bars SET fetched_at=? WHERE sym=?", (fetched_at or time.time(), sym))
+
+    def stats(self):
+        return {"backend": "sqlite", "reads": self.reads, "writes": self.writes, **self.shared.stats()}
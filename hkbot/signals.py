@@ -0,0 +1,170 @@
+# hkbot/signals.py
+"""
+AI 建議的向量化版本：一次計算多檔（symbols × days 矩陣）的 EMA / RSI / 量能 / 區間位置，
+輸出與 hkbot.logic.ai_recommendation 相同的 label / reason。
+
+矩陣為「右對齊」：每列是一檔股票自己的 K 線，最後一欄是各自最新一根，
+較短的歷史在左邊補 NaN（用 stack_frames() 產生）。
+"""
+import numpy as np
+
+# 各模式參數：ema_fast, ema_slow, rsi_p, vol_n, min_rows
+MODE_PARAMS = {
+    "short":    (10, 20, 7, 10, 30),
+    "swing":    (20, 50, 14, 20, 50),
+    "position": (50, 100, 14, 50, 80),
+}
+VOL_WINDOW = 20   # 量能均線固定 20 日（與原版一致）
+
+
+def mode_params(mode):
+    return MODE_PARAMS.get(mode, MODE_PARAMS["swing"])
+
+
+def score_signals(price, ema_f, ema_s, rsi, vol, voln, hi, lo, ema_fast, ema_slow):
+    """單檔評分規則（ai_recommendation / 批次 / 串流共用）。回傳 (score, label, reason)。"""
+    pos = (price - lo) / (hi - lo + 1e-9)
+
+    score, reasons = 0, []
+    if price > ema_f > ema_s:
+        score += 2; reasons.append(f"價格>EMA{ema_fast}>EMA{ema_slow}（多頭）")
+    elif price < ema_f < ema_s:
+        score -= 2; reasons.append(f"價格<EMA{ema_fast}<EMA{ema_slow}（空頭）")
+    else:
+        reasons.append("均線訊號混合")
+    if rsi < 35:
+        score += 1; reasons.append(f"RSI={rsi:.1f} 偏低")
+    elif rsi > 65:
+        score -= 1; reasons.append(f"RSI={rsi:.1f} 偏高")
+    if voln and voln > 0:
+        ratio = vol / max(1.0, voln)
+        if ratio >= 1.5:
+            score += 1; reasons.append(f"量能放大（{ratio:.2f}×）")
+        elif ratio <= 0.7:
+            score -= 1; reasons.append(f"量能偏弱（{ratio:.2f}×）")
+    if pos >= 0.85:
+        score -= 1; reasons.append("接近區間高位")
+    elif pos <= 0.15:
+        score += 1; reasons.append("接近區間低位")
+
+    if score >= 2: label = "買入"
+    elif score <= -2: label = "賣出"
+    else: label = "持有"
+    return score, label, "；".join(reasons[:4])
+
+
+# ---------- 矩陣準備 ----------
+def stack_frames(frames, symbols=None):
+    """
+    {symbol: OHLCV DataFrame} → (symbols, close, volume)，右對齊、左補 NaN。
+    """
+    symbols = list(symbols if symbols is not None else frames)
+    n = max((len(frames[s]) for s in symbols if frames.get(s) is not None), default=0)
+    close = np.full((len(symbols), n), np.nan)
+    volume = np.full((len(symbols), n), np.nan)
+    for i, sym in enumerate(symbols):
+        df = frames.get(sym)
+        if df is None or df.empty:
+            continue
+        k = len(df)
+        close[i, n - k:] = df["Close"].to_numpy(dtype=np.float64)
+        volume[i, n - k:] = df["Volume"].to_numpy(dtype=np.float64)
+    return symbols, close, volume
+
+
+# ---------- 向量化指標（一次處理所有股票） ----------
+def ewm_last(x, alpha):
+    """
+    等同 pandas ewm(alpha=alpha, adjust=False).mean() 的最後一個值（逐列）；左側 NaN 會略過。
+    只有左側 NaN 的列（一般情況）用展開式一次算完：
+        y = Σ_{t>=s} a·b^(n-1-t)·x_t + b^(n-s)·x_s   （s 為第一個有值的欄，b = 1 - a）
+    中間有 NaN 的列才沿時間軸逐欄遞迴。
+    """
+    rows, n = x.shape
+    y = np.full(rows, np.nan)
+    if n == 0:
+        return y
+    a, b = alpha, 1.0 - alpha
+    valid = ~np.isnan(x)
+    count = valid.sum(axis=1)
+    start = valid.argmax(axis=1)
+    closed = (count > 0) & (count == n - start)      # 從 start 起都有值
+    w = a * b ** np.arange(n - 1, -1, -1)
+    if closed.all() and not start.any():
+        return x @ w + b ** n * x[:, 0]
+    if closed.any():
+        s = start[closed]
+        xc = np.where(valid[closed], x[closed], 0.0)
+        y[closed] = xc @ w + b ** (n - s) * xc[np.arange(len(s)), s]
+    rest = np.flatnonzero(~closed & (count > 0))
+    if rest.size:
+        xr, yr = x[rest], np.full(rest.size, np.nan)
+        for t in range(n):
+            xt = xr[:, t]
+            yr = np.where(np.isnan(yr), xt, np.where(np.isnan(xt), yr, a * xt + b * yr))
+        y[rest] = yr
+    return y
+
+
+def rsi_last(close, period):
+    """等同 hkbot.logic._rsi(...) 的最後一個值（逐列）。"""
+    delta = np.diff(close, axis=1)
+    up = np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0))
+    down = np.where(np.isnan(delta), np.nan, -np.minimum(delta, 0.0))
+    roll_up = ewm_last(up, 1.0 / period)
+    roll_down = ewm_last(down, 1.0 / period)
+    roll_down = np.where(roll_down == 0, 1e-9, roll_down)
+    rs = roll_up / roll_down
+    return 100 - (100 / (1 + rs))
+
+
+def recommend_batch(close, volume, mode="swing", symbols=None):
+    """
+    close / volume: shape (n_symbols, n_days)，右對齊。
+    回傳 list[{'label','reason','score'}]，順序同輸入列。
+    """
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    n_sym = close.shape[0]
+    ema_fast, ema_slow, rsi_p, vol_n, min_rows = mode_params(mode)
+
+    lengths = (~np.isnan(close)).sum(axis=1)
+    out = [None] * n_sym
+    ok = lengths >= min_rows
+    for i in np.flatnonzero(~ok):
+        reason = "資料不足" if lengths[i] == 0 else f"資料不足（<{min_rows} 筆）"
+        out[i] = {"label": "持有", "reason": reason, "score": 0}
+    if not ok.any():
+        return out
+
+    idx = np.flatnonzero(ok)
+    c, v = (close, volume) if ok.all() else (close[idx], volume[idx])   # 全部夠資料時不複製
+    # 截掉全部都是 NaN 的左側欄位，少做幾輪遞迴
+    first = c.shape[1] - int(lengths[idx].max())
+    c, v = c[:, first:], v[:, first:]
+
+    price = c[:, -1]
+    ema_f = ewm_last(c, 2.0 / (ema_fast + 1))
+    ema_s = ewm_last(c, 2.0 / (ema_slow + 1))
+    rsi = rsi_last(c, rsi_p)
+    vol = v[:, -1]
+    voln = v[:, -VOL_WINDOW:].sum(axis=1) / VOL_WINDOW if v.shape[1] >= VOL_WINDOW else np.full(len(idx), np.nan)
+    hi = np.nanmax(c, axis=1)
+    lo = np.nanmin(c, axis=1)
+
+    for j, i in enumerate(idx):
+        vn = float(voln[j])
+        score, label, reason = score_signals(
+            float(price[j]), float(ema_f[j]), float(ema_s[j]), float(rsi[j]),
+            float(vol[j]), None if np.isnan(vn) else vn,
+            float(hi[j]), float(lo[j]), ema_fast, ema_slow)
+        out[i] = {"label": label, "reason": reason, "score": score}
+    return out
+
+
+def recommend_frames(frames, symbols=None, mode="swing"):
+    """{symbol: DataFrame} → {symbol: {'label','reason','score'}}（一次向量化計算）。"""
+    symbols, close, volume = stack_frames(frames, symbols)
+    if not symbols:
+        return {}
+    return dict(zip(symbols, recommend_batch(close, volume, mode=mode)))
@@ -0,0 +1,275 @@
+# hkbot/store.py
+"""
+磁碟上的日線 K 線庫（欄式 + memory-map），讓重啟 / 多個 uvicorn worker 不用重抓 Yahoo。
+
+每檔一個 <symbol>.npy，shape = (6, N) float64，每列是一個欄位（連續存放）：
+    0 date（1970-01-01 起的日數）, 1 Open, 2 High, 3 Low, 4 Close, 5 Volume
+讀取用 np.load(mmap_mode="r")，多個 process 共用同一份 page cache（檔案本身不重複佔記憶體）：
+- read_array() 回傳 mmap 陣列本身，不複製（回測、FileProvider 直接在上面算）；
+- load() 要給 HistoryCache 用的 DataFrame，會把數值複製一次成自己的陣列（O(N)，N 為根數）。
+寫入一律「寫暫存檔 → os.replace」，讀者只會看到完整的新檔或舊檔；append 每次重寫整個檔
+（O(N)，每檔幾千根 ≈ 幾十 KB，換來不需要就地修改的簡單一致性）。
+旁邊的 <symbol>.json 記錄涵蓋起日與上次向上游確認的時間。
+
+維護指令：
+    python -m hkbot.store compact [--keep-days 1500]
+    python -m hkbot.store prune --unused-days 30
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from hkbot.config import data_path
+
+try:
+    import fcntl
+except ImportError:  # Windows：只保留 process 內的鎖
+    fcntl = None
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+BAR_STORE_DIR = os.getenv("HKBOT_BAR_STORE_DIR", data_path("bars"))
+
+
+def _to_days(index):
+    return index.values.astype("datetime64[D]").astype(np.int64).astype(np.float64)
+
+
+def _to_index(days):
+    return pd.DatetimeIndex(np.asarray(days, dtype=np.int64).astype("datetime64[D]"))
+
+
+def frame_to_array(df):
+    arr = np.full((1 + len(COLUMNS), len(df)), np.nan)
+    arr[0] = _to_days(df.index)
+    for i, c in enumerate(COLUMNS, start=1):
+        if c in df.columns:
+            arr[i] = df[c].to_numpy(dtype=np.float64)
+    return arr
+
+
+def array_to_frame(arr):
+    """(6, N) 陣列（可以是唯讀 mmap）→ DataFrame；數值只複製一次（整塊 5 × N），不逐欄各複製。"""
+    values = np.array(arr[1:], dtype=np.float64)
+    df = pd.DataFrame(values.T, columns=COLUMNS, index=_to_index(arr[0]), copy=False)
+    df.index.name = "Date"
+    return df
+
+
+def _merge(old, new):
+    """依日期合併兩個 (6, N) 陣列，同一天以 new 為準。"""
+    if old is None or old.shape[1] == 0:
+        arr = new
+    else:
+        arr = np.concatenate([old, new], axis=1)
+    # 反轉後 unique 取第一個 → 等於保留最後出現（new）的那筆
+    rev = arr[:, ::-1]
+    _, first = np.unique(rev[0], return_index=True)
+    return np.ascontiguousarray(rev[:, first])   # unique 已依日期排序
+
+
+class BarStore:
+    def __init__(self, root=BAR_STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()      # 只保護 _sym_locks
+        self._sym_locks = {}               # sym -> threading.Lock：不同檔的寫入互不等待
+        self.reads = 0
+        self.writes = 0
+
+    # ---------- 路徑 / 鎖 ----------
+    def _path(self, sym, ext=".npy"):
+        return os.path.join(self.root, sym.replace("/", "_") + ext)
+
+    def _sym_lock(self, sym):
+        with self._lock:
+            lock = self._sym_locks.get(sym)
+            if lock is None:
+                lock = self._sym_locks[sym] = threading.Lock()
+            return lock
+
+    @contextmanager
+    def _locked(self, sym):
+        """同一檔的寫入互斥（process 內：每檔一個 threading.Lock；跨 process：flock）。"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._sym_lock(sym):
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(sym, ".lock"), "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _atomic_write(self, path, write):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=os.path.splitext(path)[1])
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                write(fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    # ---------- 讀 ----------
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(f[:-4] for f in os.listdir(self.root) if f.endswith(".npy") and not f.startswith("."))
+
+    def read_array(self, sym):
+        """回傳 memory-mapped (6, N) 陣列；沒有則 None。"""
+        try:
+            return np.load(self._path(sym), mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def read_meta(self, sym):
+        try:
+            with open(self._path(sym, ".json"), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def load(self, sym):
+        """回傳 (DataFrame, since, fetched_at)；沒有資料則 None。"""
+        arr = self.read_array(sym)
+        if arr is None or arr.shape[1] == 0:
+            return None
+        self.reads += 1
+        df = array_to_frame(arr)
+        meta = self.read_meta(sym)
+        since = pd.Timestamp(meta["since"]) if meta.get("since") else df.index[0]
+        fetched_at = float(meta.get("fetched_at") or os.path.getmtime(self._path(sym)))
+        return df, since, fetched_at
+
+    # ---------- 寫 ----------
+    def _write_meta(self, sym, meta):
+        self._atomic_write(self._path(sym, ".json"),
+                           lambda fh: fh.write(json.dumps(meta).encode("utf-8")))
+
+    def append(self, sym, df, since=None, fetched_at=None):
+        """把新 K 線併入（同日覆寫），原子替換檔案。"""
+        if df is None or df.empty:
+            return self.touch(sym, fetched_at)
+        new = frame_to_array(df)
+        with self._locked(sym):
+            old = self.read_array(sym)
+            arr = _merge(np.array(old) if old is not None else None, new)
+            self._atomic_write(self._path(sym), lambda fh: np.save(fh, arr))
+            meta = self.read_meta(sym)
+            if since is not None:
+                s = pd.Timestamp(since)
+                if not meta.get("since") or s < pd.Timestamp(meta["since"]):
+                    meta["since"] = s.strftime("%Y-%m-%d")
+            meta["fetched_at"] = fetched_at or time.time()
+            self._write_meta(sym, meta)
+        self.writes += 1
+
+    def touch(self, sym, fetched_at=None):
+        """沒有新 K 線，只更新「上次確認」時間。"""
+        if self.read_array(sym) is None:
+            return
+        with self._locked(sym):
+            meta = self.read_meta(sym)
+            meta["fetched_at"] = fetched_at or time.time()
+            self._write_meta(sym, meta)
+
+    def delete(self, sym):
+        for ext in (".npy", ".json", ".lock"):
+            try:
+                os.unlink(self._path(sym, ext))
+            except FileNotFoundError:
+                pass
+
+    # ---------- 維護 ----------
+    def compact(self, keep_days=None):
+        """去重、排序、丟掉無收市價的列，並可只保留最近 keep_days 天；清掉殘留暫存檔。"""
+        removed_tmp = 0
+        for f in (os.listdir(self.root) if os.path.isdir(self.root) else []):
+            if f.startswith(".tmp-"):
+                try:
+                    os.unlink(os.path.join(self.root, f))
+                    removed_tmp += 1
+                except FileNotFoundError:
+                    pass
+        cutoff = None
+        if keep_days:
+            cutoff = float((pd.Timestamp.today().normalize() - pd.Timedelta(days=keep_days)).value // 86400_000_000_000)
+        rows_before = rows_after = 0
+        for sym in self.symbols():
+            with self._locked(sym):
+                old = self.read_array(sym)
+                if old is None:
+                    continue
+                arr = _merge(None, np.array(old))
+                arr = arr[:, ~np.isnan(arr[4])]
+                if cutoff is not None:
+                    arr = arr[:, arr[0] >= cutoff]
+                rows_before += old.shape[1]
+                rows_after += arr.shape[1]
+                if arr.shape[1] == 0:
+                    self.delete(sym)
+                    continue
+                if arr.shape != old.shape:
+                    self._atomic_write(self._path(sym), lambda fh: np.save(fh, arr))
+                    if cutoff is not None:
+                        meta = self.read_meta(sym)
+                        first = _to_index(arr[0][:1])[0]
+                        if meta.get("since") and pd.Timestamp(meta["since"]) < first:
+                            meta["since"] = first.strftime("%Y-%m-%d")
+                            self._write_meta(sym, meta)
+        return {"rows_before": rows_before, "rows_after": rows_after, "tmp_removed": removed_tmp}
+
+    def prune(self, unused_days):
+        """刪除超過 unused_days 天沒向上游確認過的股票。"""
+        limit = time.time() - unused_days * 86400
+        gone = []
+        for sym in self.symbols():
+            meta = self.read_meta(sym)
+            ts = float(meta.get("fetched_at") or os.path.getmtime(self._path(sym)))
+            if ts < limit:
+                self.delete(sym)
+                gone.append(sym)
+        return gone
+
+    def stats(self):
+        return {"root": self.root, "reads": self.reads, "writes": self.writes}
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m hkbot.store")
+    ap.add_argument("--root", default=BAR_STORE_DIR)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact")
+    c.add_argument("--keep-days", type=int, default=None)
+    p = sub.add_parser("prune")
+    p.add_argument("--unused-days", type=int, required=True)
+    sub.add_parser("ls")
+    args = ap.parse_args()
+
+    store = BarStore(args.root)
+    if args.cmd == "compact":
+        print(store.compact(keep_days=args.keep_days))
+    elif args.cmd == "prune":
+        gone = store.prune(args.unused_days)
+        print(f"pruned {len(gone)}: {' '.join(gone)}")
+    else:
+        for sym in store.symbols():
+            arr = store.read_array(sym)
+            last = _to_index(arr[0][-1:])[0].date() if arr.shape[1] else "-"
+            print(f"{sym}\t{arr.shape[1]}\t{last}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# hkbot/ttlcache.py
+"""簡單的 LRU + TTL 快取（thread-safe），可設記憶體上限，附命中率統計。"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300.0, max_bytes=None, sizeof=None):
+        """
+        max_bytes: 記憶體預算（以 sizeof(value) 估算）；超過時從最久沒用的開始淘汰。
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda v: 0)
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._sizes = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                self._drop(key)
+                self.expired += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        size = self._sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (expires_at, value)
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes
+                                                     and len(self._data) > 1):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        item = self._data.pop(key, _MISSING)
+        self.bytes -= self._sizes.pop(key, 0)
+        return item
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._drop(key)
+        return default if item is _MISSING else item[1]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """未過期的 (key, value, expires_at)，供持久化用。"""
+        now = time.time()
+        with self._lock:
+            return [(k, v, exp) for k, (exp, v) in self._data.items() if exp > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
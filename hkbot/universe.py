@@ -0,0 +1,264 @@
+# hkbot/universe.py
+"""
+港股代碼總表（記憶體索引）：驗證代碼是否上市、用中 / 英文名稱找代碼。
+
+    UNIVERSE_FILE=/path/to/hkex_listed.csv   # code,name_zh,name_en[,aliases]（aliases 以 | 分隔）
+    python -m hkbot.universe 騰訊 阿里        # 查查看
+
+- 代碼：dict 查表。總表夠完整（>= UNIVERSE_STRICT_MIN 檔，或 UNIVERSE_STRICT=1）時，
+  不在表內的代碼（價錢、日期、打錯字）直接擋掉，不會去 yfinance 下載；
+  只有內附的小名單時維持舊行為（1~5 位數字都接受）。
+- 名稱（自由文字）：只認「完整」的中文名稱 / 別名（一段中文必須整段都由名稱組成，中間只容許「和」「及」等連接字）
+  （可省略「集團」「控股」等字尾）與整組英文全名 / 別名（可省略 Holdings、Group 等字尾）；同一個名稱對到多檔時不猜。
+  一般聊天（「I want 700」「香港天氣」「恒生指數」）不會被當成股票名稱去下載。
+- 名稱（明確查詢：find / 搜尋 指令、python -m hkbot.universe）：中文子字串（>= 2 字）、英文前綴（>= 3 字母）
+  都放進 dict，值為已排好序的代碼（完全相同 > 開頭相同 > 名稱較短 > 代碼），查詢就是一次 dict 查表。
+- 檔案更新後自動重讀（最多每 UNIVERSE_CHECK_S 秒看一次 mtime），不用重啟。
+"""
+import csv
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+log = logging.getLogger("uvicorn.error")
+
+UNIVERSE_FILE = os.getenv("UNIVERSE_FILE", os.path.join(os.path.dirname(__file__), "data", "hk_names.csv"))
+UNIVERSE_STRICT = os.getenv("UNIVERSE_STRICT", "auto")               # auto / 1 / 0
+UNIVERSE_STRICT_MIN = int(os.getenv("UNIVERSE_STRICT_MIN", "1000"))  # auto：總表至少幾檔才擋
+UNIVERSE_CHECK_S = float(os.getenv("UNIVERSE_CHECK_S", "60"))
+
+_CJK = re.compile(r"[㐀-鿿豈-﫿]+")
+_WORD = re.compile(r"[a-z0-9&]+")
+_MAX_CJK = 8          # 中文名稱子字串最長幾字
+_JOIN = set("和及與与同跟、，,")      # 一段中文裡容許夾在名稱之間的連接字
+# 英文全名可省略的字尾（HSBC Holdings → hsbc、MTR Corporation → mtr）
+_ZH_SUFFIX = ("集團", "控股", "股份", "公司")
+_EN_SUFFIX = ("holdings", "holding", "group", "corporation", "corp", "company", "co", "limited", "ltd", "inc")
+# 自由文字裡不拿來配對名稱的英文字（常見字 / 太多公司共用的字）
+_EN_STOP = {"and", "the", "for", "with", "check", "please", "stock", "stocks", "price", "buy", "sell",
+            "hold", "china", "hong", "kong", "bank", "group", "holdings", "international", "properties", "land"}
+
+
+def to_symbol(code):
+    """
+    港股代碼 → Yahoo symbol（全部模組共用這一個寫法）：
+    "700" / "0700" / "00700" / "0700.HK" → "0700.HK"；不是 1~5 位數字回 None。
+    """
+    code = (code or "").strip().upper()
+    if code.endswith(".HK"):
+        code = code[:-3]
+    if not code.isdigit() or len(code) > 5:
+        return None
+    return f"{(code.lstrip('0') or '0').zfill(4)}.HK"
+
+
+def _exact(index, key, sym):
+    index.setdefault(key, set()).add(sym)
+
+
+def _en_keys(text):
+    """英文名稱 → 完全比對用的 key：全部單字接起來，另加去掉公司字尾的版本。"""
+    words = _WORD.findall(text.lower())
+    keys = {"".join(words)}
+    while len(words) > 1 and words[-1] in _EN_SUFFIX:
+        words = words[:-1]
+        keys.add("".join(words))
+    return {k for k in keys if len(k) >= 3 and k not in _EN_STOP}
+
+
+def _add(index, key, sym, text, full=None):
+    # 完全相同 > 開頭相同 > 其他；同級時名稱（全名）越短越優先；同一檔有多個名稱 / 別名時取最好的
+    rank = (0 if key == text else 1 if text.startswith(key) else 2, len(full or text))
+    hits = index.setdefault(key, {})
+    if rank < hits.get(sym, (9, 0)):
+        hits[sym] = rank
+
+
+class Universe:
+    def __init__(self, path=UNIVERSE_FILE, strict=UNIVERSE_STRICT, strict_min=UNIVERSE_STRICT_MIN,
+                 check_every=UNIVERSE_CHECK_S):
+        self.path = path
+        self.strict_setting = strict
+        self.strict_min = strict_min
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self.names = {}        # symbol -> 顯示名稱
+        self._zh = {}          # 子字串 -> [symbol, ...]（已排序）
+        self._en = {}          # 英文前綴 -> [symbol, ...]（已排序）
+        self._zh_exact = {}    # 完整中文名稱 / 別名 -> (symbol, ...)
+        self._en_exact = {}    # 完整英文名稱 / 別名（單字接起來）-> (symbol, ...)
+        self._zh_max = 0
+        self._en_max = 0       # 英文全名最多幾個單字
+        self.loads = 0
+        self.rejected = 0
+        self.load()
+
+    # ---------- 建表 ----------
+    def load(self):
+        """讀總表並重建索引（整組替換，讀取端不用鎖）。"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding="utf-8") as fh:
+                rows = list(csv.DictReader(fh))
+        except OSError as e:
+            log.warning("universe load failed %s: %r", self.path, e)
+            return False
+        names, zh, en, zh_exact, en_exact = {}, {}, {}, {}, {}
+        en_max = 1
+        for row in rows:
+            sym = to_symbol(row.get("code"))
+            if sym is None:
+                continue
+            name_zh = (row.get("name_zh") or "").strip()
+            name_en = (row.get("name_en") or "").strip()
+            names[sym] = name_zh or name_en or sym
+            aliases = [a.strip() for a in (row.get("aliases") or "").split("|") if a.strip()]
+            for alias in [name_zh] + aliases:
+                for run in _CJK.findall(alias):
+                    _exact(zh_exact, run, sym)
+                    for suffix in _ZH_SUFFIX:       # 小米集團 → 小米
+                        if run.endswith(suffix) and len(run) - len(suffix) >= 2:
+                            _exact(zh_exact, run[:-len(suffix)], sym)
+                    for i in range(len(run)):
+                        for j in range(i + 2, min(len(run), i + _MAX_CJK) + 1):
+                            _add(zh, run[i:j], sym, run)
+            words = _WORD.findall(name_en.lower())
+            full = "".join(words)
+            en_aliases = [a for a in aliases if a.isascii()]
+            for text in words + [full] + [a.lower() for a in en_aliases]:
+                for j in range(3, len(text) + 1):
+                    _add(en, text[:j], sym, text, full)
+            for text in [name_en] + en_aliases:
+                en_max = max(en_max, len(_WORD.findall(text.lower())))
+                for key in _en_keys(text):
+                    _exact(en_exact, key, sym)
+        order = lambda d: {k: [s for s, _ in sorted(v.items(), key=lambda kv: (kv[1], kv[0]))] for k, v in d.items()}
+        self.names, self._zh, self._en = names, order(zh), order(en)
+        self._zh_exact = {k: tuple(sorted(v)) for k, v in zh_exact.items()}
+        self._en_exact = {k: tuple(sorted(v)) for k, v in en_exact.items()}
+        self._zh_max = max(map(len, zh_exact), default=0)
+        self._en_max = en_max
+        self._mtime = mtime
+        self.loads += 1
+        log.info("universe loaded: %d symbols from %s", len(names), self.path)
+        return True
+
+    def refresh(self, force=False):
+        """檔案改過就重讀；平常最多每 check_every 秒 stat 一次。"""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_every:
+            return False
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return False
+            if force or mtime != self._mtime:
+                return self.load()
+        return False
+
+    # ---------- 查詢 ----------
+    @property
+    def strict(self):
+        if self.strict_setting == "auto":
+            return len(self.names) >= self.strict_min
+        return self.strict_setting == "1"
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, symbol):
+        return symbol in self.names
+
+    def is_listed(self, symbol):
+        """總表夠完整時只認表內代碼；否則一律放行。"""
+        self.refresh()
+        if not self.strict or symbol in self.names:
+            return True
+        self.rejected += 1
+        return False
+
+    def search(self, text, limit=5):
+        """中文子字串 / 英文前綴 → [symbol, ...]（最相符的在前）。"""
+        text = text.strip()
+        if not text:
+            return []
+        hit = self._zh.get(text) if _CJK.fullmatch(text) else self._en.get(text.lower().replace(" ", ""))
+        return list(hit[:limit]) if hit else []
+
+    def match_run(self, run):
+        """
+        一段連續中文（例如「騰訊阿里」或「騰訊和阿里」）由左到右取最長的完整名稱 / 別名：
+        回傳 [symbol, ...]。整段必須都是名稱（或連接字），有其他字、或名稱對到多檔時回 []。
+        """
+        out, i = [], 0
+        while i < len(run):
+            for j in range(min(len(run), i + self._zh_max), i + 1, -1):
+                hit = self._zh_exact.get(run[i:j])
+                if hit:
+                    if len(hit) > 1:
+                        return []
+                    out.append(hit[0])
+                    i = j
+                    break
+            else:
+                if run[i] not in _JOIN:
+                    return []
+                i += 1
+        return out
+
+    def match_phrase(self, phrase):
+        """
+        一段英文（例如「check tencent and hsbc holdings」）：由左到右找與完整英文名稱 / 別名
+        相同的連續單字（取最長），其他單字略過；對到多檔的名稱不算。回傳 [symbol, ...]。
+        """
+        words = _WORD.findall(phrase.lower())
+        out, i = [], 0
+        while i < len(words):
+            for j in range(min(len(words), i + self._en_max), i, -1):
+                hit = self._en_exact.get("".join(words[i:j]))
+                if hit and len(hit) == 1:
+                    out.append(hit[0])
+                    i = j
+                    break
+            else:
+                i += 1
+        return out
+
+    def stats(self):
+        return {"symbols": len(self.names), "strict": self.strict, "zh_keys": len(self._zh),
+                "en_keys": len(self._en), "exact_keys": len(self._zh_exact) + len(self._en_exact), "loads": self.loads, "rejected": self.rejected, "file": self.path}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """process 內共用的總表（第一次用到才讀檔）。"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Universe()
+    return _default
+
+
+def main():
+    u = default()
+    print(u.stats())
+    for q in sys.argv[1:]:
+        t = time.perf_counter()
+        hits = u.search(q)
+        us = 1e6 * (time.perf_counter() - t)
+        print(f"{q}: {[(s, u.names[s]) for s in hits]}  ({us:.1f} µs)")
+
+
+if __name__ == "__main__":
+    main()
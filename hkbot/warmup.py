@@ -0,0 +1,109 @@
+# hkbot/warmup.py
+"""
+分析模組（pandas / yfinance / numpy）延遲載入 + 背景預熱。
+
+app 啟動只載入 webhook 需要的東西，/health 與 GET 驗證馬上可用；
+hkbot.logic 第一次被 analytics() 取用時才 import（或由 warm() 在背景先做）。
+
+- WARMUP_ENABLED=1（預設）：啟動後在背景 import，並替 WARMUP_WATCHLIST 預先抓 K 線、
+  名稱與三個模式的摘要，完成後 /ready 才回 200。
+- WARMUP_ENABLED=0：完全延遲到第一個查詢，/ready 直接回 ready（state=lazy）。
+  背景工作也跟著等：收市後預先計算排程在第一個查詢後才開始；提醒 watcher 只有檔案裡已有提醒時才在啟動時載入。
+"""
+import asyncio
+import importlib
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("uvicorn.error")
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_WATCHLIST = os.getenv("WARMUP_WATCHLIST", "")          # 例如 "0700,9988,0005"
+WARMUP_DAYS = int(os.getenv("WARMUP_DAYS", "120"))              # 與一般查詢預設 days 相同
+WARMUP_MODES = ("short", "swing", "position")
+
+_module = None
+_lock = threading.Lock()
+_on_load = []
+import_s = None   # import hkbot.logic 花的秒數
+
+
+def loaded():
+    return _module is not None
+
+
+def on_load(fn):
+    """登記 hkbot.logic 載入後要跑的 fn(module)（壓測替換行情來源用）；已載入則立即執行。"""
+    _on_load.append(fn)
+    if _module is not None:
+        fn(_module)
+
+
+def analytics():
+    """回傳 hkbot.logic（第一次呼叫時才 import；thread-safe）。"""
+    global _module, import_s
+    if _module is not None:
+        return _module
+    with _lock:
+        if _module is None:
+            t0 = time.perf_counter()
+            mod = importlib.import_module("hkbot.logic")
+            import_s = round(time.perf_counter() - t0, 3)
+            for fn in _on_load:
+                fn(mod)
+            _module = mod
+            log.info("analytics loaded in %.2fs", import_s)
+    return _module
+
+
+class Warmup:
+    def __init__(self, enabled=WARMUP_ENABLED, watchlist=WARMUP_WATCHLIST, days=WARMUP_DAYS):
+        self.enabled = enabled
+        self.watchlist = watchlist
+        self.days = days
+        self.state = "cold" if enabled else "lazy"
+        self.warm_s = None
+        self.symbols = 0
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.state in ("ready", "lazy")
+
+    def _watchlist(self, logic):
+        return logic.parse_codes_from_text(self.watchlist.replace(",", " "), max_n=1000)
+
+    def _fill(self, logic, symbols):
+        """預先抓 K 線（一次）、名稱（一次），再把每個模式的摘要算進快取。"""
+        logic.get_multiple_stocks_data(symbols, days=self.days)
+        logic.get_stock_names_batch(symbols)
+        for mode in WARMUP_MODES:
+            for i in range(0, len(symbols), 5):
+                logic.build_whatsapp_summary(symbols[i:i + 5], days=self.days, mode=mode)
+
+    async def run(self, run_blocking=None):
+        """背景執行：import → 預熱 watchlist；失敗只記錄，不影響服務（查詢時照常延遲載入）。"""
+        if not self.enabled:
+            return
+        run_blocking = run_blocking or asyncio.to_thread
+        t0 = time.perf_counter()
+        try:
+            self.state = "importing"
+            logic = await run_blocking(analytics)
+            symbols = self._watchlist(logic)
+            if symbols:
+                self.state = "warming"
+                await run_blocking(self._fill, logic, symbols)
+            self.symbols = len(symbols)
+            self.state = "ready"
+        except Exception as e:
+            self.state, self.error = "failed", repr(e)
+            log.exception("warm-up failed: %r", e)
+        finally:
+            self.warm_s = round(time.perf_counter() - t0, 3)
+
+    def stats(self):
+        return {"state": self.state, "ready": self.ready, "analytics_loaded": loaded(),
+                "import_s": import_s, "warm_s": self.warm_s, "watchlist": self.symbols, "error": self.error}
@@ -0,0 +1,111 @@
+# hkbot/watchlists.py
+"""
+組合 / 自選清單指令（pf）：解析指令、每位使用者存一份清單。
+
+    pf 700 9988 1810 ... [mode=swing] [days=120] [page=2]   # 直接查一批（最多 PORTFOLIO_MAX 檔）
+    pf save 700 9988 1810 ...                              # 存成自己的清單
+    pf [mode=…] [page=…]                                    # 查已存的清單
+    pf clear                                               # 刪除清單
+
+不依賴 pandas / numpy：app 啟動時就能載入；實際計算在 hkbot.portfolio。
+清單存成一個 JSON 檔（{user: [symbol, ...]}），寫入走暫存檔 + os.replace。
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+from hkbot.config import data_path
+
+log = logging.getLogger("uvicorn.error")
+
+PORTFOLIO_MAX = int(os.getenv("PORTFOLIO_MAX", "100"))              # 一次最多幾檔
+WATCHLIST_FILE = os.getenv("WATCHLIST_FILE", data_path("watchlists.json"))  # 設為空字串即不存檔
+
+_CMD = re.compile(r"^\s*(?:pf|portfolio|組合|自選)(?=\s|$)\s*(save|clear|儲存|清除)?", re.I)
+_PARAM = re.compile(r"\b(?:mode|days|page)\s*=\s*\S+", re.I)
+
+
+def parse_portfolio(txt: str):
+    """
+    「pf save 700 9988」→ (action, rest)；action 為 "query" / "save" / "clear"，
+    rest 為去掉指令與 mode= / days= / page= 之後的文字（給 parse_codes_from_text）。
+    不是組合指令回 None。
+    """
+    m = _CMD.match(txt)
+    if not m:
+        return None
+    action = {"save": "save", "儲存": "save", "clear": "clear", "清除": "clear"}.get((m.group(1) or "").lower(), "query")
+    return action, _PARAM.sub(" ", txt[m.end():])
+
+
+def parse_page(txt: str):
+    m = re.search(r"page\s*=\s*(\d{1,3})", txt, re.I)
+    return max(1, int(m.group(1))) if m else 1
+
+
+class Watchlists:
+    def __init__(self, path=WATCHLIST_FILE, max_symbols=PORTFOLIO_MAX):
+        self.path = path or None
+        self.max_symbols = max_symbols
+        self._lock = threading.Lock()
+        self._lists = {}
+        self._mtime = None
+
+    def _reload(self):
+        """檔案被別的 worker 改過就重讀（多 worker 共用同一個檔）。"""
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                self._lists = json.load(fh)
+            self._mtime = mtime
+        except (OSError, ValueError) as e:
+            log.warning("watchlists load failed: %r", e)
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            d = os.path.dirname(self.path) or "."
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-watchlists-")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(self._lists, fh, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            log.warning("watchlists save failed: %r", e)
+
+    def get(self, user):
+        with self._lock:
+            self._reload()
+            return list(self._lists.get(str(user)) or [])
+
+    def set(self, user, symbols):
+        symbols = list(dict.fromkeys(symbols))[:self.max_symbols]
+        with self._lock:
+            self._reload()
+            self._lists[str(user)] = symbols
+            self._save()
+        return symbols
+
+    def clear(self, user):
+        with self._lock:
+            self._reload()
+            existed = self._lists.pop(str(user), None) is not None
+            if existed:
+                self._save()
+        return existed
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._lists), "symbols": sum(len(v) for v in self._lists.values())}